@@ -0,0 +1,218 @@
+from typing import *
+
+import io
+
+import asyncio
+
+from time import perf_counter
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from logging import debug,\
+	DEBUG,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_ASYNC_IO_WORKERS,\
+	DEFAULT_ASYNC_SERIALIZER_WORKERS
+
+from .compatibility import *
+
+logger = getLogger()
+
+class Var_async:
+	"""asyncio interface to load and store variables without blocking the event loop.
+	Filesystem I/O and (de)serialization run in their own executors
+	"""
+	_async_io_executor_: Optional[Executor]
+	_async_serializer_executor_: Optional[Executor]
+
+	# (event loop id, varname) -> running load, so concurrent requests share it
+	_async_loads_: Dict[Tuple[int, str], asyncio.Task]
+
+	# External variables
+	_rlocals_: Dict[str, Any]
+	_storager_: object
+	_scope_active_: int
+	_io_stats_: Optional[object]
+
+	filesystem: object
+	serializer: object
+
+	add_loaded_var: Callable[[Self, str], None]
+	add_stored_var: Callable[[Self, str], None]
+	_set_scope_local: Callable[[Self, str, Any], None]
+	_invalidate_prefetch: Callable[[Self, str], None]
+
+	def __init__(self,
+			  	 async_io_executor: Executor=None,
+				 async_serializer_executor: Executor=None,
+				 **kwargs
+		) -> None:
+		self._async_io_executor_ = async_io_executor
+		self._async_serializer_executor_ = async_serializer_executor
+		self._async_loads_ = dict()
+
+	@property
+	def _io_executor(self) -> Executor:
+		if(self._async_io_executor_ is None):
+			self._async_io_executor_ = ThreadPoolExecutor(
+				DEFAULT_ASYNC_IO_WORKERS,
+				thread_name_prefix='var_async_io'
+			)
+		return self._async_io_executor_
+
+	@property
+	def _serializer_executor(self) -> Executor:
+		if(self._async_serializer_executor_ is None):
+			self._async_serializer_executor_ = ThreadPoolExecutor(
+				DEFAULT_ASYNC_SERIALIZER_WORKERS,
+				thread_name_prefix='var_async_serializer'
+			)
+		return self._async_serializer_executor_
+
+	def set_async_executors(self, *, io_executor: Executor=None, serializer_executor: Executor=None) -> None:
+		"""Set the executors used by aload / astore / agather
+
+		Kwargs:
+			io_executor (Executor): Executor for the filesystem reads and writes
+			serializer_executor (Executor): Executor for serializing and deserializing
+		"""
+		if(io_executor is not None):
+			self._async_io_executor_ = io_executor
+		if(serializer_executor is not None):
+			self._async_serializer_executor_ = serializer_executor
+
+	async def aload(self, attr: str) -> Any:
+		"""Load a variable without blocking the event loop.
+		Concurrent loads of the same variable are served by a single read
+
+		Args:
+			attr (str): The name of the variable
+
+		Returns:
+			Any: The requested variable if found, None othewise
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.aload({attr=})")
+
+		if(self._scope_active_):
+			self.add_loaded_var(attr)
+
+		if(attr in self._rlocals_):
+			if(self._io_stats_ is not None):
+				self._io_stats_.record_hit(attr)
+			return self._rlocals_[attr]
+
+		loop = asyncio.get_running_loop()
+		key = (id(loop), attr)
+
+		task = self._async_loads_.get(key)
+		if(task is None):
+			task = loop.create_task(self._aload(attr))
+			self._async_loads_[key] = task
+			task.add_done_callback(lambda _: self._async_loads_.pop(key, None))
+		elif(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] joined running load of \"{attr}\"")
+
+		return await asyncio.shield(task)
+
+	async def agather(self, attrs: Iterable[str]) -> List[Any]:
+		"""Load many variables concurrently without blocking the event loop
+
+		Args:
+			attrs (Iterable[str]): The names of the variables
+
+		Returns:
+			List[Any]: The variables, in the same order
+		"""
+		return list(await asyncio.gather(*(
+			self.aload(attr)
+			for attr in attrs
+		)))
+
+	async def astore(self, attr: str, value: Any) -> Any:
+		"""Store a variable without blocking the event loop
+
+		Args:
+			attr (str): The name of the variable
+			value (Any): Either a function, class or pickleable object
+
+		Returns:
+			Any: The value passed as a parameter
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.astore({attr=})")
+
+		if(self._scope_active_):
+			self.add_stored_var(attr)
+
+		self._set_scope_local(attr, value)
+
+		loop = asyncio.get_running_loop()
+		storager = self._storager_
+
+		if(
+				type(value).__name__ in ("function", "type") or
+				not storager._allowed_base_ or
+				(storager._prefix_ and storager._prefix_references_)
+			):
+			return await loop.run_in_executor(self._io_executor, storager.store_var, attr, value)
+
+		start = perf_counter()
+		data = await loop.run_in_executor(self._serializer_executor, self._serialize, value)
+		write_start = perf_counter()
+		await loop.run_in_executor(
+			self._io_executor,
+			self._write_bytes,
+			f"{storager._folder_name_}/{storager._prefix_}{attr}",
+			data
+		)
+
+		if(self._io_stats_ is not None):
+			self._io_stats_.record_store(attr, len(data), write_start - start, perf_counter() - write_start)
+		self._invalidate_prefetch(attr)
+
+		return value
+
+	async def _aload(self, attr: str) -> Any:
+		loop = asyncio.get_running_loop()
+		storager = self._storager_
+
+		path = await loop.run_in_executor(self._io_executor, storager.get_var_path, attr)
+
+		value: Any
+		if(path is None):
+			value = await loop.run_in_executor(self._io_executor, storager.load_var, attr)
+		else:
+			io_stats = self._io_stats_
+			start = perf_counter()
+			data = await loop.run_in_executor(self._io_executor, self._read_bytes, path)
+			read_end = perf_counter()
+			try:
+				value = await loop.run_in_executor(self._serializer_executor, self._deserialize, data)
+			except (AttributeError, self.serializer.UnpicklingError):
+				# Same fallback to the source code as a synchronous load
+				value = await loop.run_in_executor(self._io_executor, storager.load_var, attr)
+			else:
+				if(io_stats is not None):
+					io_stats.record_load(attr, len(data), read_end - start, perf_counter() - read_end)
+
+		self._set_scope_local(attr, value)
+		return value
+
+	def _read_bytes(self, path: str) -> bytes:
+		with open(self.filesystem.resolve(path), 'rb') as f:
+			return f.read()
+
+	def _write_bytes(self, path: str, data: bytes) -> None:
+		path = self.filesystem.resolve(path, create=True)
+		self.filesystem.unshare(path, 'wb')
+		with open(path, 'wb') as f:
+			f.write(data)
+
+	def _deserialize(self, data: bytes) -> Any:
+		return self.serializer.load(io.BytesIO(self.filesystem.transform_back(data)))
+
+	def _serialize(self, value: Any) -> bytes:
+		return self.filesystem.transform(self.serializer.dumps(value))
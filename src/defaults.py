@@ -17,6 +17,10 @@ DEFAULT_SUFFIX: Final[str] = ""
 
 DEFAULT_FOLDER_NAME: Final[str] = ".jupyter_vars"
 DEFAULT_FOLDER_ADD_TIMESTAMP: Final[bool] = False
+# Folder of a snapshot of the variables folder
+DEFAULT_SNAPSHOT_FOLDER: Final[str] = "{folder}.{name}"
+# Files a snapshot copies instead of linking, since they are written in place
+DEFAULT_SNAPSHOT_COPY: Final[str] = r"^(\.git/(?!objects/)|\.\$\.config$|_run_launch|_tmp_launch)|\.(stepidx|stepnames)$"
 
 DEFAULT_PYTHON_PATH: Final[str] = "python"
 with open(f'{__folder__}/src_templates/launch/file_start.py', 'r') as f:
@@ -32,21 +36,86 @@ DEFAULT_LOCKED_TYPES: Final[Set[str]] = {
 	"type"
 }
 DEFAULT_DEPSGRAPH_NAME: Final[str] = "$depsgraph.meta"
+DEFAULT_DEPSGRAPH_LOG_SUFFIX: Final[str] = ".log"
+# Scopes appended to the depsgraph log before it is compacted into the checkpoint
+DEFAULT_DEPSGRAPH_CHECKPOINT_INTERVAL: Final[int] = 1024
+# array typecodes of the depsgraph: int32 variable ids, int64 microsecond timestamps and offsets
+DEFAULT_VAR_ID_TYPECODE: Final[str] = 'i'
+DEFAULT_TIMESTAMP_TYPECODE: Final[str] = 'q'
+DEFAULT_OFFSET_TYPECODE: Final[str] = 'q'
+DEFAULT_RETENTION_NAME: Final[str] = "$retention.meta"
+DEFAULT_STEP_CACHE_NAME: Final[str] = "$stepcache.meta"
+DEFAULT_PRODUCERS_NAME: Final[str] = "$producers.meta"
+DEFAULT_PRODUCERS_LOG_SUFFIX: Final[str] = ".log"
+# Step runs appended to the producers log before it is compacted into the checkpoint
+DEFAULT_PRODUCERS_CHECKPOINT_INTERVAL: Final[int] = 1024
+# Variables not loaded for this many seconds are reported as cold by reclaim
+DEFAULT_RECLAIM_MAX_IDLE: Final[float] = 90 * 24 * 3600.
+DEFAULT_RECLAIM_CHUNK_SIZE: Final[int] = 1024**2
+DEFAULT_ARCHIVE_FOLDER: Final[str] = ".archive"
+DEFAULT_ARCHIVE_SUFFIX: Final[str] = ".xz"
+DEFAULT_ATIME_PROBE: Final[str] = ".atime_probe"
+
+DEFAULT_PREFETCH: Final[bool] = False
+DEFAULT_PREFETCH_BUDGET: Final[int] = 512 * 1024**2
+DEFAULT_PREFETCH_WORKERS: Final[int] = 2
+# Maximum amount of co-occurring variables requested on each trigger
+DEFAULT_PREFETCH_MAX_VARS: Final[int] = 16
+# Threads loading step arguments and scope preloads concurrently
+DEFAULT_PRELOAD_WORKERS: Final[int] = 8
+
+DEFAULT_IO_STATS: Final[bool] = False
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket has no bound
+DEFAULT_IO_STATS_BUCKETS: Final[Tuple[float, ...]] = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1., 10.)
+
+# When closing a scope collects garbage: "auto", "always" or "never"
+DEFAULT_GC_POLICY: Final[str] = 'auto'
+# Bytes of process memory over which scope exits always collect and spill. None for no limit
+DEFAULT_GC_MEMORY_LIMIT: Final[Optional[int]] = None
+DEFAULT_GC_GROWTH: Final[int] = 256 * 1024**2
+DEFAULT_GC_YOUNG_GENERATION: Final[Optional[int]] = 0
+DEFAULT_GC_SPILL_BYTES: Final[Optional[int]] = 64 * 1024**2
 
 DEFAULT_SSH_PATH: Final[str] = '.'
 DEFAULT_SSH_PYTHON_PATH: Final[str] = 'python'
 DEFAULT_SSH_PORT: Final[int] = 22
 with open(f'{__folder__}/src_templates/ssh/ssh_file_start.py', 'r') as f:
 	DEFAULT_SSH_FILE_START: Final[List[str]] = f.readlines()
+DEFAULT_SSH_BATCHED: Final[bool] = True
+# Files bigger than this are sent one by one instead of inside the batch archive
+DEFAULT_SSH_BATCH_MAX_FILE_SIZE: Final[int] = 256 * 1024**2
+DEFAULT_SSH_BATCH_COMPRESSION: Final[str] = 'gz'
 
 DEFAULT_STORAGER: Final[str] = 'base'
 
+DEFAULT_ASYNC_IO_WORKERS: Final[int] = 8
+DEFAULT_ASYNC_SERIALIZER_WORKERS: Final[int] = 2
+
 DEFAULT_LATEST_SUFFIX: Final[str] = '.latest'
 DEFAULT_STEP_SUFFIX: Final[str] = ".steps"
+DEFAULT_STEP_INDEX_SUFFIX: Final[str] = '.stepidx'
+DEFAULT_STEP_NAMES_SUFFIX: Final[str] = '.stepnames'
 
 DEFAULT_SERIALIZER: Final[str] = 'dill'
 DEFAULT_FILESYSTEM: Final[str] = 'disk'
+DEFAULT_LAYOUT: Final[str] = 'flat'
+# Files at least this big are read with sequential access hints
+DEFAULT_SEQUENTIAL_READ_SIZE: Final[int] = 64 * 1024**2
+# Files in the root of the folder that are never moved into shards
+DEFAULT_SHARD_EXCLUDE: Final[str] = r"^(\.|_run_launch|_tmp_launch|dagster_)"
 DEFAULT_VERSION_CONTROLLER: Final[str] = 'git'
+DEFAULT_STEP_CACHE: Final[bool] = True
+DEFAULT_STEP_CACHE_MAX_ENTRIES: Final[int] = 1024
+DEFAULT_STEP_WORKERS: Final[int] = os.cpu_count() or 1
+DEFAULT_DELTA_STEPS: Final[bool] = False
+# Every this many step versions one is kept whole, so loading walks at most as many deltas
+DEFAULT_DELTA_KEYFRAME_INTERVAL: Final[int] = 8
+DEFAULT_DELTA_SUFFIX: Final[str] = '.delta'
+DEFAULT_DELTA_REPORT_INTERVALS: Final[Tuple[int, ...]] = (1, 2, 4, 8, 16, 32)
+# Versioned files at least this big are kept out of the git repository
+DEFAULT_GIT_OBJECT_THRESHOLD: Final[int] = 64 * 1024**2
+DEFAULT_OBJECT_STORE_FOLDER: Final[str] = '.objects'
+DEFAULT_OBJECT_STORE_WORKERS: Final[int] = 4
 DEFAULT_PROCESSER: Final[str] = 'base'
 DEFAULT_ORCHESTRATOR: Final[str] = 'dagster'
 
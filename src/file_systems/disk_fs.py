@@ -1,9 +1,30 @@
 from typing import *
 
 import os
+import errno
 import shutil
 
-class Disk:
+from logging import debug,\
+	DEBUG,\
+	getLogger
+
+try:
+	import fcntl
+	use_fcntl = True
+except ImportError:
+	use_fcntl = False
+
+from .sharding import Sharded_layout
+
+from ..defaults import DEFAULT_SEQUENTIAL_READ_SIZE
+
+logger = getLogger()
+
+# ioctl request to share the extents of a file (reflink), from linux/fs.h
+FICLONE: Final[int] = 0x40049409
+COPY_CHUNK_SIZE: Final[int] = 1024**3
+
+class Disk(Sharded_layout):
 	READ_TEXT: Final[str]='r'
 	WRITE_TEXT: Final[str]='w'
 	APPEND_TEXT: Final[str]='a'
@@ -19,28 +40,126 @@ class Disk:
 	READ_CREATE_BINARY: Final[str]='rb+'
 	WRITE_CREATE_BINARY: Final[str]='wb+'
 	APPEND_CREATE_BINARY: Final[str]='ab+'
+
+	_sequential_read_size_: int
+	# Whether the filesystem refused to reflink, so it is not tried again
+	_reflink_unsupported_: bool
 		
-	def __init__(self, **kwargs) -> None:
-		pass
+	def __init__(self, sequential_read_size: int=DEFAULT_SEQUENTIAL_READ_SIZE, **kwargs) -> None:
+		Sharded_layout.__init__(self, **kwargs)
 
-	def __contains__(self, file: str) -> bool:
-		return os.path.exists(file)
+		self._sequential_read_size_ = sequential_read_size
+		self._reflink_unsupported_ = not use_fcntl
 
-	def open(self, file: str, *args, version: str='', source: str='', **kwargs):
-		return open('.'.join(filter(None, (file, version, source))), *args, **kwargs)
-	
-	def mkdir(self, *args, **kwargs) -> None:
-		os.mkdir(*args, **kwargs)
+	def open(self, file: str, mode: str='r', *args, version: str='', source: str='', **kwargs):
+		path = self.resolve('.'.join(filter(None, (file, version, source))), create=mode[0] in 'wa')
+		self.unshare(path, mode)
+
+		f = open(
+			path,
+			mode,
+			*args,
+			**kwargs
+		)
+
+		if(mode[0] == 'r' and hasattr(os, 'posix_fadvise')):
+			fd = f.fileno()
+			if(os.fstat(fd).st_size >= self._sequential_read_size_):
+				os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
 
-	def rename(self, *args, **kwargs) -> None:
-		os.rename(*args, **kwargs)
+		return f
+
+	def rename(self, src: str, dst: str, *args, **kwargs) -> None:
+		src = self.resolve(src)
+		dst = self.resolve(dst, create=True)
+		try:
+			os.rename(src, dst, *args, **kwargs)
+		except OSError as err:
+			if(err.errno != errno.EXDEV):
+				raise
+
+			if(logger.isEnabledFor(DEBUG)):
+				debug(f" [i] \"{src}\" is in another device, copying it instead")
+
+			if(os.path.isdir(src)):
+				shutil.copytree(src, dst, copy_function=self._copy_file, dirs_exist_ok=True)
+				shutil.rmtree(src)
+			else:
+				self._copy_file(src, dst)
+				os.remove(src)
 	
-	def copy(self, *args, **kwargs) -> None:
-		shutil.copy(*args, **kwargs)
+	def copy(self, src: str, dst: str, *args, **kwargs) -> None:
+		dst = self.resolve(dst, create=True)
+		if(os.path.isdir(dst)):
+			dst = os.path.join(dst, os.path.basename(src))
+
+		self._copy_file(self.resolve(src), dst)
+
+	def link(self, src: str, dst: str) -> None:
+		"""Make dst share the data of src, as a hardlink. Writes through open
+		break the link first. Falls back to a copy when the files are in different devices
+		"""
+		src = self.resolve(src)
+		dst = self.resolve(dst, create=True)
+		try:
+			os.link(src, dst)
+		except OSError as err:
+			if(err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK)):
+				raise
+			self._copy_file(src, dst)
+
+	def _copy_file(self, src: str, dst: str) -> str:
+		"""Copy a file without moving the data through userspace when possible:
+		first as a reflink (copy-on-write clone), then with copy_file_range / sendfile.
+		The permission bits are copied too, as shutil.copy does
+		"""
+		with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+			src_fd = fsrc.fileno()
+			dst_fd = fdst.fileno()
+
+			if(not self._reflink_unsupported_):
+				try:
+					fcntl.ioctl(dst_fd, FICLONE, src_fd)
+					shutil.copymode(src, dst)
+					return dst
+				except OSError as err:
+					if(err.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL)):
+						self._reflink_unsupported_ = True
+					elif(err.errno != errno.EXDEV):
+						raise
+
+			size = os.fstat(src_fd).st_size
+			copied = 0
+			try:
+				if(hasattr(os, 'copy_file_range')):
+					while(copied < size):
+						sent = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - copied))
+						if(not sent):
+							break
+						copied += sent
+				else:
+					while(copied < size):
+						sent = os.sendfile(dst_fd, src_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+						if(not sent):
+							break
+						copied += sent
+			except OSError as err:
+				if(err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)):
+					raise
+				# Resume from where the kernel stopped
+				fsrc.seek(copied)
+				fdst.seek(copied)
+				shutil.copyfileobj(fsrc, fdst)
+
+		shutil.copymode(src, dst)
+		return dst
 	
 	def transform(self, data: str | bytes) -> str | bytes:
 		return data
 	
 	def transform_back(self, data: str | bytes) -> str | bytes:
 		return data
-#
\ No newline at end of file
+
+	def transform_back_stream(self, stream: BinaryIO) -> BinaryIO:
+		return stream
+#
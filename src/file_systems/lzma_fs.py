@@ -8,9 +8,11 @@ from logging import \
 	warn, debug,\
 	getLogger
 
+from .sharding import Sharded_layout
+
 logger = getLogger()
 
-class LZMA:
+class LZMA(Sharded_layout):
 	READ_TEXT: Final[str]='rt'
 	WRITE_TEXT: Final[str]='wt'
 	APPEND_TEXT: Final[str]='at'
@@ -30,20 +32,25 @@ class LZMA:
 	def __init__(self, **kwargs) -> None:
 		if(logger.isEnabledFor(WARN)):
 			logger.warn("Using LZMA. This greatly reduces file sizes, but also increases loading/storing time. If you want to disable this, add the kwarg \"chosen_filesystem='disk'\"")
-		pass
+		Sharded_layout.__init__(self, **kwargs)
 
-	def open(self, file: str, *args, version: str='', source: str='', **kwargs):
+	def open(self, file: str, mode: str='rb', *args, version: str='', source: str='', **kwargs):
+		file = self.resolve('.'.join(filter(None, (file, version, source))), create=True)
+		self.unshare(file, mode)
 		if(not os.path.exists(file)):
 			open(file, 'w+').close()
 		
-		return lzma.open('.'.join(filter(None, (file, version, source))), *args, **kwargs)
+		return lzma.open(file, mode, *args, **kwargs)
 
-	def rename(self, *args, **kwargs) -> None:
-		return os.rename(*args, **kwargs)
+	def rename(self, src: str, dst: str, *args, **kwargs) -> None:
+		return os.rename(self.resolve(src), self.resolve(dst, create=True), *args, **kwargs)
 	
 	def transform(self, data: str | bytes) -> str | bytes:
 		return lzma.compress(data)
 	
 	def transform_back(self, data: str | bytes) -> str | bytes:
 		return lzma.decompress(data)
+
+	def transform_back_stream(self, stream: BinaryIO) -> BinaryIO:
+		return lzma.open(stream, self.READ_BINARY)
 #
\ No newline at end of file
@@ -0,0 +1,218 @@
+from typing import *
+
+import os
+import re
+import shutil
+import hashlib
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from ..defaults import \
+	DEFAULT_FOLDER_NAME,\
+	DEFAULT_LAYOUT,\
+	DEFAULT_SHARD_EXCLUDE
+
+logger = getLogger()
+
+FLAT_LAYOUT: Final[str] = 'flat'
+SHARDED_LAYOUT: Final[str] = 'sharded'
+
+shard_dir_re = re.compile(r"^[0-9a-f]{2}$")
+
+def shard_of(name: str) -> str:
+	"""Get the two-level hash-prefix subfolder a file name belongs to
+
+	Args:
+		name (str): The name of the file (or folder) in the root of the variables folder
+
+	Returns:
+		str: The relative subfolder, as "ab/cd"
+	"""
+	digest = hashlib.md5(name.encode()).hexdigest()
+	return f"{digest[:2]}/{digest[2:4]}"
+
+class Sharded_listing:
+	"""Lazy replacement for os.listdir on a sharded folder.
+	Membership checks only stat the file in its shard, while iterating
+	walks all the shards
+	"""
+	__slots__ = ['_layout_', '_root_']
+
+	def __init__(self, layout: 'Sharded_layout', root: str) -> None:
+		self._layout_ = layout
+		self._root_ = root
+
+	def __contains__(self, name: str) -> bool:
+		return os.path.exists(self._layout_.resolve(f"{self._root_}/{name}"))
+
+	def __iter__(self) -> Iterator[str]:
+		for entry in os.scandir(self._root_):
+			if(not (entry.is_dir() and shard_dir_re.match(entry.name))):
+				yield entry.name
+				continue
+
+			for sub_entry in os.scandir(entry.path):
+				if(sub_entry.is_dir()):
+					yield from os.listdir(sub_entry.path)
+
+class Sharded_layout:
+	"""Mixin for filesystems that maps every file in the root of the variables folder
+	into two-level hash-prefix subfolders when the "sharded" layout is enabled.
+	Paths inside a root entry (like "var.steps/...") follow their root entry
+	"""
+	_root_folder_: str
+	_sharded_: bool
+	_shard_exclude_: Pattern
+
+	def __init__(self,
+			  	 parent: object=None,
+				 folder_name: str=DEFAULT_FOLDER_NAME,
+				 layout: str=DEFAULT_LAYOUT,
+				 *,
+				 shard_exclude: str=DEFAULT_SHARD_EXCLUDE,
+				 **kwargs
+		) -> None:
+		if(parent is not None):
+			folder_name = parent._folder_name_
+
+		self._root_folder_ = os.path.normpath(folder_name)
+		self._sharded_ = layout == SHARDED_LAYOUT
+		self._shard_exclude_ = re.compile(shard_exclude)
+
+	@property
+	def layout(self) -> str:
+		return SHARDED_LAYOUT if self._sharded_ else FLAT_LAYOUT
+
+	def resolve(self, path: str, *, create: bool=False) -> str:
+		"""Get the real path of a file given its path in the flat layout
+
+		Args:
+			path (str): The path as if all variables were in the root of the folder
+		Kwargs:
+			create (bool): Whether to create the shard subfolders if missing
+
+		Returns:
+			str: The path in the current layout
+		"""
+		if(not self._sharded_):
+			return path
+
+		norm_path = os.path.normpath(path)
+		if(not norm_path.startswith(f"{self._root_folder_}{os.sep}")):
+			return path
+
+		rel_path = norm_path[len(self._root_folder_)+1:]
+		root_entry = rel_path.split(os.sep, 1)[0]
+		if(self._shard_exclude_.match(root_entry)):
+			return path
+
+		shard_folder = f"{self._root_folder_}/{shard_of(root_entry)}"
+		if(create and not os.path.exists(shard_folder)):
+			os.makedirs(shard_folder, exist_ok=True)
+
+		return f"{shard_folder}/{rel_path}"
+
+	def __contains__(self, file: str) -> bool:
+		return os.path.exists(self.resolve(file))
+
+	def listdir(self, folder: str) -> Container[str]:
+		if(self._sharded_ and os.path.normpath(folder) == self._root_folder_):
+			return Sharded_listing(self, self._root_folder_)
+		return os.listdir(self.resolve(folder))
+
+	def size(self, path: str) -> int:
+		return os.path.getsize(self.resolve(path))
+
+	def stat(self, path: str) -> os.stat_result:
+		return os.stat(self.resolve(path))
+
+	def mkdir(self, path: str, *args, **kwargs) -> None:
+		os.mkdir(self.resolve(path, create=True), *args, **kwargs)
+
+	def remove(self, path: str) -> None:
+		os.remove(self.resolve(path))
+
+	def unshare(self, real_path: str, mode: str) -> None:
+		"""Break the hardlink of a file shared with a snapshot before it is written,
+		so every other copy keeps its contents. Files that are overwritten are just unlinked
+
+		Args:
+			real_path (str): The real path of the file
+			mode (str): The mode the file is going to be opened with
+		"""
+		if(mode[0] == 'r' and '+' not in mode):
+			return
+
+		try:
+			if(os.stat(real_path).st_nlink < 2):
+				return
+		except FileNotFoundError:
+			return
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] Unsharing \"{real_path}\" before writing it")
+
+		if(mode[0] == 'w'):
+			os.remove(real_path)
+			return
+
+		unshared_path = f"{real_path}.unshare"
+		self._copy_file(real_path, unshared_path)
+		os.replace(unshared_path, real_path)
+
+	def _copy_file(self, src: str, dst: str) -> str:
+		shutil.copyfile(src, dst)
+		shutil.copymode(src, dst)
+		return dst
+
+def migrate_layout(folder: str, layout: str, *, shard_exclude: str=DEFAULT_SHARD_EXCLUDE) -> List[Tuple[str, str]]:
+	"""Convert in place a variables folder between the flat and sharded layouts
+
+	Args:
+		folder (str): The variables folder
+		layout (str): The target layout, either "flat" or "sharded"
+	Kwargs:
+		shard_exclude (str): RegEx of root entries never moved into shards
+
+	Returns:
+		List[Tuple[str, str]]: The (old, new) paths, relative to the folder, of every moved entry
+	"""
+	if(logger.isEnabledFor(DEBUG)):
+		debug(f"[R] migrate_layout({folder=}, {layout=})")
+
+	exclude = re.compile(shard_exclude)
+	moves: List[Tuple[str, str]] = list()
+
+	if(layout == SHARDED_LAYOUT):
+		for entry in os.scandir(folder):
+			if(exclude.match(entry.name) or (entry.is_dir() and shard_dir_re.match(entry.name))):
+				continue
+
+			shard = shard_of(entry.name)
+			os.makedirs(f"{folder}/{shard}", exist_ok=True)
+			os.rename(entry.path, f"{folder}/{shard}/{entry.name}")
+			moves.append((entry.name, f"{shard}/{entry.name}"))
+
+	elif(layout == FLAT_LAYOUT):
+		for entry in os.scandir(folder):
+			if(not (entry.is_dir() and shard_dir_re.match(entry.name))):
+				continue
+
+			for sub_entry in os.scandir(entry.path):
+				if(not sub_entry.is_dir()):
+					continue
+
+				for name in os.listdir(sub_entry.path):
+					os.rename(f"{sub_entry.path}/{name}", f"{folder}/{name}")
+					moves.append((f"{entry.name}/{sub_entry.name}/{name}", name))
+				os.rmdir(sub_entry.path)
+			os.rmdir(entry.path)
+	else:
+		raise ValueError(f"Unknown layout \"{layout}\"")
+
+	if(logger.isEnabledFor(INFO)):
+		info(f"[i] Moved {len(moves)} entries into the {layout} layout")
+
+	return moves
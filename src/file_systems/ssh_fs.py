@@ -6,6 +6,9 @@ __version__ = "1.0.1"
 from typing import *
 import re
 import os
+import shlex
+import tarfile
+import threading
 from logging import debug, info,\
 	INFO,\
 	getLogger
@@ -26,10 +29,15 @@ from .defaults import\
 	DEFAULT_SSH_FILE_START,\
 	DEFAULT_SSH_PATH,\
 	DEFAULT_SSH_PORT,\
-	DEFAULT_SSH_PYTHON_PATH
+	DEFAULT_SSH_PYTHON_PATH,\
+	DEFAULT_SSH_BATCHED,\
+	DEFAULT_SSH_BATCH_MAX_FILE_SIZE,\
+	DEFAULT_SSH_BATCH_COMPRESSION
 
 logger = getLogger()
 
+# tarfile compression -> the flag of the tar command for it
+TAR_COMPRESSION_FLAGS: Final[Dict[str, str]] = {'gz': 'z', 'bz2': 'j', 'xz': 'J', '': ''}
 
 class Var_ssh_manager():
 	_ssh_remote_: str=None
@@ -40,6 +48,10 @@ class Var_ssh_manager():
 
 	_store_in_ssh_: bool
 
+	_ssh_batched_: bool
+	_ssh_batch_max_file_size_: int
+	_ssh_batch_compression_: str
+
 	_ssh_connection_: Connection
 
 	# SSH code
@@ -63,9 +75,17 @@ class Var_ssh_manager():
 				 ssh_port: int=DEFAULT_SSH_PORT,
 				 *,
 				 ssh_file_start: List[str]=DEFAULT_SSH_FILE_START,
+				 ssh_batched: bool=DEFAULT_SSH_BATCHED,
+				 ssh_batch_max_file_size: int=DEFAULT_SSH_BATCH_MAX_FILE_SIZE,
+				 ssh_batch_compression: str=DEFAULT_SSH_BATCH_COMPRESSION,
 				 **kwargs,
 				 ) -> None:
 		self._store_in_ssh_ = store_in_ssh
+		self._ssh_batched_ = ssh_batched
+		self._ssh_batch_max_file_size_ = ssh_batch_max_file_size
+		if(ssh_batch_compression not in TAR_COMPRESSION_FLAGS):
+			raise ValueError(f"Unknown batch compression \"{ssh_batch_compression}\", use one of {tuple(TAR_COMPRESSION_FLAGS)}")
+		self._ssh_batch_compression_ = ssh_batch_compression
 		self._python_ssh_path_ = python_ssh_path
 		self._ssh_path_ = ssh_path.rstrip('/')
 
@@ -178,7 +198,7 @@ class Var_ssh_manager():
 
 			self._ssh_connection_.run(f"{self._python_ssh_path_} {self._ssh_path_}{self._folder_name_}/{self._run_launch_filename_}.py")
 			
-	def ssh_upload_all(self, pattern: Union[list, tuple, Pattern]='.*', *, new_path: str=None, new_name: str=None) -> None:
+	def ssh_upload_all(self, pattern: Union[list, tuple, Pattern]='.*', *, new_path: str=None, new_name: str=None, batched: bool=None) -> None:
 		"""Upload all disk variables into the set up ssh
 		It accepts either a RegEx pattern or an iterable of patterns
 		
@@ -190,6 +210,9 @@ class Var_ssh_manager():
 			new_name (str): The new name to be stored with.
 				The first stored object will be called {new_name}
 				All subsequent objects will be called "{new_name}_{num}"
+			batched (bool): Whether to send the files as a single compressed tar stream. Files bigger
+				than the configured batch max file size, or all of them if the remote tar fails,
+				are still sent one by one. Defaults to the "ssh_batched" init kwarg
 		"""
 		if self._ssh_connection_ is None:
 			raise ValueError("There is no SSH connection")
@@ -206,7 +229,11 @@ class Var_ssh_manager():
 			new_path = self._folder_name_
 		else:
 			new_path = new_path.rstrip('/')
+
+		if(batched is None):
+			batched = self._ssh_batched_
 		
+		batch: List[Tuple[str, str, int]] = list()
 		var_num = 0
 		for var in os.listdir(self._folder_name_):
 			if(valid.match(var) and not os.path.isdir(var)):
@@ -215,14 +242,82 @@ class Var_ssh_manager():
 						name = f"{new_name}_{var_num}"
 					else:
 						name = new_name
-						
-					print(f"↑ {var} -> {new_name}...")   
 				else:
 					name = var
+
+				var_path = f"{self._folder_name_}/{var}"
+				if(batched):
+					size = os.path.getsize(var_path)
+					if(size <= self._ssh_batch_max_file_size_):
+						batch.append((var_path, name, size))
+						continue
+
+				if(new_name is not None):
+					print(f"↑ {var} -> {new_name}...")   
+				else:
+					print(f"↑ {name}...")
+				self._ssh_connection_.put(var_path, f"{self._ssh_path_}{new_path}/{name}")
+
+		if(batch):
+			try:
+				self._ssh_upload_batch(batch, f"{self._ssh_path_}{new_path}")
+			except (OSError, EOFError, tarfile.TarError) as err:
+				if(logger.isEnabledFor(INFO)):
+					info(f"[i] Batch upload failed ({err}), uploading the files one by one")
+				for var_path, name, _ in batch:
 					print(f"↑ {name}...")
-				self._ssh_connection_.put(f"{self._folder_name_}/{var}", f"{self._ssh_path_}{new_path}/{name}")
+					self._ssh_connection_.put(var_path, f"{self._ssh_path_}{new_path}/{name}")
+
+	def _ssh_upload_batch(self, batch: List[Tuple[str, str, int]], remote_path: str) -> None:
+		"""Stream a compressed tar of all the given files through a single channel,
+		unpacking it on the remote side as it arrives
+		
+		Args:
+			batch (List[Tuple[str, str, int]]): (local path, remote name, size) of every file to be sent
+			remote_path (str): The remote folder in which the files will be unpacked
+		"""
+		total_size = sum(size for _, _, size in batch)
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Uploading {len(batch)} files ({total_size} bytes) as a batch")
+
+		channel = self._ssh_connection_.create_session()
+		channel.exec_command(f"tar -x{TAR_COMPRESSION_FLAGS[self._ssh_batch_compression_]}f - -C {shlex.quote(remote_path)}")
+
+		sent = 0
+		try:
+			with channel.makefile('wb') as stream:
+				with tarfile.open(fileobj=stream, mode=f"w|{self._ssh_batch_compression_}") as tar:
+					for var_path, name, size in batch:
+						tar.add(var_path, arcname=name, recursive=False)
+
+						sent += size
+						print(f"↑ {name} [{sent}/{total_size} bytes]")
+			channel.shutdown_write()
+		except (OSError, EOFError):
+			# A remote tar that failed closes the stream, its errors tell why
+			self._ssh_close_tar(channel)
+			raise
+
+		self._ssh_close_tar(channel)
+
+	def _ssh_close_tar(self, channel: object) -> None:
+		"""Wait for the remote tar of a batch to exit
 
-	def ssh_download_all(self, pattern: Union[list, tuple, Pattern]='.*', *, new_path: str=None, new_name: str=None):
+		Args:
+			channel (object): The session channel the tar runs in
+
+		Raises:
+			OSError: If it exited with an error, with its error output
+		"""
+		exit_status = channel.recv_exit_status()
+		with channel.makefile_stderr('rb') as stderr:
+			errors = stderr.read().decode(errors='replace').strip()
+		channel.close()
+
+		if(exit_status):
+			raise OSError(f"Remote tar exited with status {exit_status}: {errors}")
+
+	def ssh_download_all(self, pattern: Union[list, tuple, Pattern]='.*', *, new_path: str=None, new_name: str=None, batched: bool=None):
 		"""Download all ssh variables into the disk
 		It accepts either a RegEx pattern or an iterable of patterns
 		
@@ -234,6 +329,9 @@ class Var_ssh_manager():
 			new_name (str): The new name to be stored with.
 				The first stored object will be called {new_name}
 				All subsequent objects will be called "{new_name}_{num}"
+			batched (bool): Whether to receive the files as a single compressed tar stream. Files bigger
+				than the configured batch max file size, or all of them if the remote tar fails,
+				are still received one by one. Defaults to the "ssh_batched" init kwarg
 		"""
 		if self._ssh_connection_ is None:
 			raise ValueError("There is no SSH connection")
@@ -250,20 +348,111 @@ class Var_ssh_manager():
 			new_path = self._folder_name_
 		else:
 			new_path = new_path.rstrip('/')
-			
+
+		if(batched is None):
+			batched = self._ssh_batched_
+
+		remote_folder = f"{self._ssh_path_}{self._folder_name_}"
+		remote_files: Iterable[Tuple[str, int]]
+		if(batched):
+			# name<TAB>size for every regular file, so big files can be left out of the batch
+			remote_files = (
+				(line.rsplit('\t', 1)[0], int(line.rsplit('\t', 1)[1]))
+				for line in self._ssh_connection_.run(
+					f"find {shlex.quote(remote_folder)} -maxdepth 1 -type f -printf '%f\\t%s\\n'", hide="stdout"
+				).stdout.split('\n')
+				if line
+			)
+		else:
+			remote_files = (
+				(var, None)
+				for var in self._ssh_connection_.run(f"ls -p {shlex.quote(remote_folder)} | grep -v /", hide="stdout").stdout.split('\n')
+			)
+
+		batch: Dict[str, Tuple[str, int]] = dict()
 		var_num = 0
-		for var in self._ssh_connection_.run(f"ls -p {self._ssh_path_}{self._folder_name_} | grep -v /", hide="stdout").stdout.split('\n'):
+		for var, size in remote_files:
 			if(var and valid.match(var)):
 				if(new_name is not None):
 					if(var_num):
 						name = f"{new_name}_{var_num}"
 					else:
 						name = new_name
-						
-					print(f"↓ {var} -> {new_name}...")   
 				else:
 					name = var
+
+				if(size is not None and size <= self._ssh_batch_max_file_size_):
+					batch[var] = (name, size)
+					continue
+
+				if(new_name is not None):
+					print(f"↓ {var} -> {new_name}...")   
+				else:
 					print(f"↓ {name}...")
 				
-				self._ssh_connection_.get(f"{self._ssh_path_}{self._folder_name_}/{var}", f"{new_path}/{name}")
+				self._ssh_connection_.get(f"{remote_folder}/{var}", f"{new_path}/{name}")
+
+		if(batch):
+			try:
+				self._ssh_download_batch(batch, remote_folder, new_path)
+			except (OSError, EOFError, tarfile.TarError) as err:
+				# Reading the file list from stdin needs GNU tar in the remote
+				if(logger.isEnabledFor(INFO)):
+					info(f"[i] Batch download failed ({err}), downloading the files one by one")
+				for var, (name, _) in batch.items():
+					print(f"↓ {name}...")
+					self._ssh_connection_.get(f"{remote_folder}/{var}", f"{new_path}/{name}")
+
+	def _ssh_download_batch(self, batch: Dict[str, Tuple[str, int]], remote_path: str, local_path: str) -> None:
+		"""Receive all the given files as a compressed tar streamed through a single channel,
+		unpacking it into the local folder as it arrives
+		
+		Args:
+			batch (Dict[str, Tuple[str, int]]): remote name -> (local name, size) of every file to be received
+			remote_path (str): The remote folder the files are read from
+			local_path (str): The local folder in which the files will be unpacked
+		"""
+		total_size = sum(size for _, size in batch.values())
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Downloading {len(batch)} files ({total_size} bytes) as a batch")
+
+		# The file list goes through stdin, so there is no limit on the amount of files
+		channel = self._ssh_connection_.create_session()
+		channel.exec_command(f"tar -c{TAR_COMPRESSION_FLAGS[self._ssh_batch_compression_]}f - -C {shlex.quote(remote_path)} -T -")
+
+		def send_file_list() -> None:
+			try:
+				with channel.makefile('wb') as file_list:
+					file_list.write(''.join(f"{var}\n" for var in batch).encode())
+				channel.shutdown_write()
+			except (OSError, EOFError):
+				# The remote tar exited, reading the archive tells why
+				pass
+
+		# Sent while the archive is read, or a long list fills both pipes and blocks
+		sender = threading.Thread(target=send_file_list, daemon=True)
+		sender.start()
+
+		received = 0
+		try:
+			with channel.makefile('rb') as stream:
+				with tarfile.open(fileobj=stream, mode=f"r|{self._ssh_batch_compression_}") as tar:
+					for member in tar:
+						if(not member.isfile() or member.name not in batch):
+							continue
+
+						name, size = batch[member.name]
+						with tar.extractfile(member) as src, open(f"{local_path}/{name}", 'wb') as dst:
+							while(chunk := src.read(1024**2)):
+								dst.write(chunk)
+
+						received += size
+						print(f"↓ {name} [{received}/{total_size} bytes]")
+		except (OSError, EOFError, tarfile.TarError):
+			# A remote tar that failed sends an empty or cut stream, its errors tell why
+			self._ssh_close_tar(channel)
+			raise
+
+		sender.join()
+		self._ssh_close_tar(channel)
 #
\ No newline at end of file
@@ -0,0 +1,317 @@
+from typing import *
+
+import uuid
+
+from threading import RLock
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_PRODUCERS_NAME,\
+	DEFAULT_PRODUCERS_LOG_SUFFIX,\
+	DEFAULT_PRODUCERS_CHECKPOINT_INTERVAL
+
+from .compatibility import *
+
+logger = getLogger()
+
+class Producer(NamedTuple):
+	step_name: str
+	# The step function, serialized
+	step_fn: bytes
+	# Options of step_run_function
+	options: Dict[str, Any]
+	# Explicit arguments of the step
+	kwargs: Dict[str, Any]
+	inputs: Tuple[str, ...]
+	# As given by step_outputs
+	output_spec: Union[str, Tuple[str, ...]]
+	# Step cache key of the run that stored the outputs, if it could be computed
+	cache_key: Optional[str]
+
+	@property
+	def outputs(self) -> Tuple[str, ...]:
+		return self.output_spec if isinstance(self.output_spec, tuple) else (self.output_spec,)
+
+class Producers_checkpoint(NamedTuple):
+	# Output name with its prefix -> the fields of its Producer
+	producers: Dict[str, Tuple]
+	# Id of the log of the step runs recorded after the checkpoint
+	log_id: str
+
+class Var_incremental:
+	"""Make-style recomputation of variables: the step that last stored each output
+	is recorded, and update re-runs only the steps whose code, inputs or kwargs changed
+	since then, and those that depend on them
+	"""
+	# Output name with its prefix -> the step run that last stored it
+	_producers_: Optional[Dict[str, Producer]]
+	_producers_lock_: RLock
+	_producers_log_id_: Optional[str]
+	_producers_log_records_: int
+
+	# External variables
+	_folder_name_: str
+
+	filesystem: object
+	serializer: object
+	version_controller: object
+
+	load_var: Callable[[Self, str], Any]
+	store_var: Callable[[Self, Union[type, object, str], Optional[Any]], Any]
+	get_var_prefix: Callable[[Self], str]
+	run_steps: Callable[[Self, Iterable[Union[Callable, Dict[str, Any]]]], Optional[List[Any]]]
+
+	def __init__(self, **kwargs) -> None:
+		self._producers_ = None
+		self._producers_lock_ = RLock()
+		self._producers_log_id_ = None
+		self._producers_log_records_ = 0
+
+	def _get_producers(self) -> Dict[str, Producer]:
+		with self._producers_lock_:
+			if(self._producers_ is None):
+				stored = self.load_var(DEFAULT_PRODUCERS_NAME)
+				if(isinstance(stored, Producers_checkpoint)):
+					self._producers_ = {
+						output: Producer(*producer)
+						for output, producer in stored.producers.items()
+					}
+					self._replay_producers_log(stored.log_id)
+				else:
+					# Older versions stored the whole dict on every step run
+					self._producers_ = {
+						output: Producer(*producer)
+						for output, producer in (stored or dict()).items()
+					}
+			return self._producers_
+
+	def _replay_producers_log(self, log_id: str) -> None:
+		"""Add the step runs recorded after the checkpoint
+		"""
+		self._producers_log_id_ = log_id
+
+		log_path = f"{self._folder_name_}/{DEFAULT_PRODUCERS_NAME}{DEFAULT_PRODUCERS_LOG_SUFFIX}"
+		if(log_path not in self.filesystem):
+			return
+
+		with self.filesystem.open(log_path, self.filesystem.READ_BINARY) as f:
+			try:
+				if(self.serializer.load(f) != log_id):
+					# The log was already compacted into the checkpoint
+					return
+
+				while(True):
+					outputs, producer = self.serializer.load(f)
+					producer = Producer(*producer)
+					for output in outputs:
+						self._producers_[output] = producer
+					self._producers_log_records_ += 1
+			except (EOFError, self.serializer.UnpicklingError):
+				# End of the log, or a record cut by a crash
+				pass
+
+	def _log_producer(self, outputs: Tuple[str, ...], producer: Producer) -> None:
+		"""Append a step run to the producers log, instead of storing every producer
+		"""
+		with self._producers_lock_:
+			if(self._producers_log_id_ is None or self._producers_log_records_ >= DEFAULT_PRODUCERS_CHECKPOINT_INTERVAL):
+				# The step run is already in the producers, so it is in the checkpoint
+				self.compact_producers()
+				return
+
+			with self.filesystem.open(f"{self._folder_name_}/{DEFAULT_PRODUCERS_NAME}{DEFAULT_PRODUCERS_LOG_SUFFIX}", self.filesystem.APPEND_BINARY) as f:
+				self.serializer.dump((outputs, tuple(producer)), f)
+			self._producers_log_records_ += 1
+
+	def compact_producers(self) -> None:
+		"""Store every recorded producer as a checkpoint and start an empty log.
+		The log id only changes once the checkpoint is stored, so a crash
+		in between never replays a log already in the checkpoint
+		"""
+		log_id = uuid.uuid4().hex
+		with self._producers_lock_:
+			self.store_var(DEFAULT_PRODUCERS_NAME, Producers_checkpoint(
+				{
+					output: tuple(producer)
+					for output, producer in self._get_producers().items()
+				},
+				log_id,
+			))
+
+			with self.filesystem.open(f"{self._folder_name_}/{DEFAULT_PRODUCERS_NAME}{DEFAULT_PRODUCERS_LOG_SUFFIX}", self.filesystem.WRITE_BINARY) as f:
+				self.serializer.dump(log_id, f)
+
+			self._producers_log_id_ = log_id
+			self._producers_log_records_ = 0
+
+	def _record_producer(self,
+					  	 step_fn: Callable,
+						 step_name: str,
+						 output_spec: Union[str, Tuple[str, ...]],
+						 inputs: Iterable[str],
+						 kwargs: Dict[str, Any],
+						 *,
+						 cache_key: Optional[str],
+						 prefix: str,
+						 **options
+			) -> None:
+		"""Record the step run that stored some outputs, so update can run it again
+		"""
+		inputs = tuple(inputs)
+		outputs = output_spec if isinstance(output_spec, tuple) else (output_spec,)
+		if(not set(inputs).isdisjoint(outputs)):
+			# Steps that update their own inputs would always be stale
+			return
+
+		try:
+			step_fn_data = self.serializer.dumps(step_fn)
+		except Exception:
+			if(logger.isEnabledFor(DEBUG)):
+				debug(f" [i] Step \"{step_name}\" can not be serialized, so update can not run it")
+			return
+
+		producer = Producer(
+			step_name,
+			step_fn_data,
+			options,
+			{
+				arg: value
+				for arg, value in kwargs.items()
+				if arg not in ('prefix', 'step_name')
+			},
+			inputs,
+			output_spec,
+			cache_key,
+		)
+
+		outputs = tuple(f"{prefix}{output}" for output in outputs)
+		with self._producers_lock_:
+			producers = self._get_producers()
+			for output in outputs:
+				producers[output] = producer
+
+			self._log_producer(outputs, producer)
+
+	def producers(self, targets: Iterable[str]) -> List[Producer]:
+		"""Get the recorded steps the targets are built from, directly or through other
+		recorded outputs, in an order where each step goes after those producing its inputs
+
+		Args:
+			targets (Iterable[str]): The names of the variables
+
+		Returns:
+			List[Producer]: The steps, in topological order
+		"""
+		producers = self._get_producers()
+		prefix = self.get_var_prefix()
+
+		ordered: List[Producer] = list()
+		# Outputs of each visited step -> whether all its inputs were visited
+		visited: Dict[Tuple[str, ...], bool] = dict()
+
+		# Depth-first, without recursion for long chains of steps
+		stack: List[Tuple[str, bool]] = [(target, False) for target in reversed(list(targets))]
+		while(stack):
+			varname, expanded = stack.pop()
+			producer = producers.get(f"{prefix}{varname}")
+			if(producer is None):
+				continue
+
+			key = producer.outputs
+			if(expanded):
+				visited[key] = True
+				ordered.append(producer)
+				continue
+
+			if(key in visited):
+				if(not visited[key]):
+					raise ValueError(f"Steps form a cycle through \"{varname}\"")
+				continue
+			visited[key] = False
+
+			stack.append((varname, True))
+			stack.extend((input_name, False) for input_name in reversed(producer.inputs))
+
+		return ordered
+
+	def stale_producers(self, targets: Iterable[str]) -> List[Producer]:
+		"""Get the steps update would run to bring the targets up to date.
+		A step is stale when the cache key of running it now, from its code, inputs and kwargs,
+		differs from the one of the run that stored its outputs, or when it reads the output
+		of a stale step
+
+		Args:
+			targets (Iterable[str]): The names of the variables
+
+		Returns:
+			List[Producer]: The stale steps, in topological order
+		"""
+		step_cache = self.version_controller._step_cache_
+		prefix = self.get_var_prefix()
+
+		stale: List[Producer] = list()
+		stale_outputs: Set[str] = set()
+		for producer in self.producers(targets):
+			is_stale = (
+				producer.cache_key is None or
+				not stale_outputs.isdisjoint(producer.inputs) or
+				step_cache.run_key(
+					self.serializer.loads(producer.step_fn),
+					producer.step_name,
+					producer.kwargs,
+					prefix=prefix,
+				) != producer.cache_key
+			)
+
+			if(is_stale):
+				stale.append(producer)
+				stale_outputs.update(producer.outputs)
+
+		return stale
+
+	def update(self, targets: Union[str, Iterable[str]], *, workers: int=None, dry_run: bool=False) -> List[str]:
+		"""Bring variables up to date, re-running only the steps whose code, inputs or kwargs
+		changed since they stored their outputs, and the steps that depend on them.
+		Independent steps run concurrently, as in run_steps
+
+		vv.update('model')
+
+		Args:
+			targets (Union[str, Iterable[str]]): The names of the variables
+		Kwargs:
+			workers (int): The number of processes to run the steps in
+			dry_run (bool): Only report the steps that would run
+
+		Returns:
+			List[str]: The names of the stale steps, in the order they were scheduled
+		"""
+		if(isinstance(targets, str)):
+			targets = (targets,)
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.update({targets=}, {dry_run=})")
+
+		stale = self.stale_producers(targets)
+
+		if(not dry_run and stale):
+			self.run_steps(
+				[
+					dict(
+						step=self.serializer.loads(producer.step_fn),
+						step_name=producer.step_name,
+						output_name=producer.output_spec,
+						**producer.options,
+						**producer.kwargs,
+					)
+					for producer in stale
+				],
+				workers=workers,
+			)
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] {'Would run' if dry_run else 'Ran'} {len(stale)} stale steps")
+
+		return [producer.step_name for producer in stale]
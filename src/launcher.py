@@ -7,6 +7,7 @@ import re
 import os
 
 from .regex import decorators_re
+from .tracing import traced
 from .defaults import \
 	DEFAULT_LAUNCH_FILE_CODE,\
 	DEFAULT_LAUNCH_FILE_START,\
@@ -59,6 +60,7 @@ class Var_launcher:
 		self._launched_filename_ = launched_filename
 		self._launched_file_path_ = f"{self._folder_name_}/{self._launched_filename_}.py"
 	
+	@traced
 	def launch(self, function: object, *, compiled: bool=True) -> None:
 		"""Launch a given function as a separate python process in the current machine. 
 		It also compiles it into cython, since it is meant for heavy processing.
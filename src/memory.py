@@ -0,0 +1,236 @@
+from typing import *
+
+import gc
+import os
+import sys
+import tracemalloc
+
+from time import perf_counter
+from threading import RLock
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+try:
+	import psutil
+	use_psutil = True
+except ImportError:
+	use_psutil = False
+
+from .defaults import \
+	DEFAULT_GC_POLICY,\
+	DEFAULT_GC_MEMORY_LIMIT,\
+	DEFAULT_GC_GROWTH,\
+	DEFAULT_GC_YOUNG_GENERATION,\
+	DEFAULT_GC_SPILL_BYTES
+
+from .tracing import span
+from .prefetch import MISSING
+
+from .compatibility import *
+
+logger = getLogger()
+
+GC_POLICIES: Final[Tuple[str, ...]] = ('auto', 'always', 'never')
+
+def process_memory() -> Optional[int]:
+	"""Get the memory used by this process: the traced bytes if tracemalloc is tracing,
+	and otherwise the resident set size. None if it can not be measured
+	"""
+	if(tracemalloc.is_tracing()):
+		return tracemalloc.get_traced_memory()[0]
+
+	if(use_psutil):
+		return psutil.Process().memory_info().rss
+
+	try:
+		with open('/proc/self/statm', 'r') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, IndexError, AttributeError):
+		return None
+
+def value_bytes(value: Any) -> int:
+	"""Estimate the memory a value holds, preferring the buffer size of arrays
+	"""
+	nbytes = getattr(value, 'nbytes', None)
+	if(isinstance(nbytes, int)):
+		return nbytes
+	try:
+		return sys.getsizeof(value)
+	except TypeError:
+		return 0
+
+class Var_memory:
+	"""Decides when closing a scope runs the garbage collector. With the "auto" policy
+	a full collection only runs when the process grew enough since the last one,
+	the removed variables were big enough or memory is over the limit, and otherwise
+	only the youngest generations are collected. Over the limit, big variables
+	still in locals are spilled, since they are already stored in disk
+	"""
+	_gc_policy_: str
+	_gc_memory_limit_: Optional[int]
+	_gc_growth_: int
+	_gc_young_generation_: Optional[int]
+	_gc_spill_bytes_: Optional[int]
+	# Process memory after the last full collection
+	_gc_baseline_: Optional[int]
+	_gc_stats_: Dict[str, Union[int, float]]
+
+	# External variables
+	_rlocals_: Dict[str, Any]
+	_locked_vars_: Set[str]
+	_locked_types_: Set[str]
+	_scope_refs_: Dict[str, int]
+	_scope_owned_: Set[str]
+	_scope_lock_: RLock
+
+	def __init__(self,
+			  	 gc_policy: str=DEFAULT_GC_POLICY,
+				 gc_memory_limit: Optional[int]=DEFAULT_GC_MEMORY_LIMIT,
+				 gc_growth: int=DEFAULT_GC_GROWTH,
+				 gc_young_generation: Optional[int]=DEFAULT_GC_YOUNG_GENERATION,
+				 gc_spill_bytes: Optional[int]=DEFAULT_GC_SPILL_BYTES,
+				 **kwargs
+			) -> None:
+		self.set_gc_policy(
+			gc_policy,
+			memory_limit=gc_memory_limit,
+			growth=gc_growth,
+			young_generation=gc_young_generation,
+			spill_bytes=gc_spill_bytes,
+		)
+		self._gc_baseline_ = process_memory()
+		self.reset_gc_stats()
+
+	def set_gc_policy(self,
+				   	  policy: str,
+					  *,
+					  memory_limit: Optional[int]=MISSING,
+					  growth: int=MISSING,
+					  young_generation: Optional[int]=MISSING,
+					  spill_bytes: Optional[int]=MISSING
+			) -> None:
+		"""Set when closing a scope collects garbage. The options not given keep their value
+
+		vv.set_gc_policy('auto', memory_limit=8 * 1024**3)
+
+		Args:
+			policy (str): "auto" to collect depending on memory, "always" for a full collection
+				on every scope exit or "never" to leave it to the interpreter
+		Kwargs:
+			memory_limit (Optional[int]): Bytes of process memory over which every exit
+				runs a full collection and spills variables. None for no limit
+			growth (int): Bytes the process, or the removed variables, have to grow
+				since the last full collection for another one
+			young_generation (Optional[int]): The generation collected on the other exits,
+				0 or 1. None to collect nothing
+			spill_bytes (Optional[int]): Over the memory limit, variables of the closed scope
+				that other scopes keep in locals are dropped from locals if at least this big.
+				None to never spill
+		"""
+		if(policy not in GC_POLICIES):
+			raise ValueError(f"Unknown gc policy \"{policy}\", use one of {GC_POLICIES}")
+
+		self._gc_policy_ = policy
+		if(memory_limit is not MISSING):
+			self._gc_memory_limit_ = memory_limit
+		if(growth is not MISSING):
+			self._gc_growth_ = growth
+		if(young_generation is not MISSING):
+			self._gc_young_generation_ = young_generation
+		if(spill_bytes is not MISSING):
+			self._gc_spill_bytes_ = spill_bytes
+
+	def gc_stats(self) -> Dict[str, Union[int, float]]:
+		"""Get the collections run on scope exits, skipped exits, spilled variables
+		and the total and longest pause in seconds
+		"""
+		return dict(self._gc_stats_)
+
+	def reset_gc_stats(self) -> None:
+		self._gc_stats_ = dict(
+			full=0,
+			young=0,
+			skipped=0,
+			spilled=0,
+			spilled_bytes=0,
+			pause=0.,
+			max_pause=0.,
+		)
+
+	def _collect_garbage(self, freed_bytes: int=0, kept: Iterable[str]=()) -> None:
+		"""Collect garbage after removing variables from locals, as the policy decides
+
+		Args:
+			freed_bytes (int): Estimated bytes of the removed variables
+			kept (Iterable[str]): Variables of the closed scope left in locals
+		"""
+		policy = self._gc_policy_
+		if(policy == 'never'):
+			self._gc_stats_['skipped'] += 1
+			return
+
+		generation: Optional[int] = 2
+		if(policy == 'auto'):
+			memory = process_memory()
+			if(memory is None):
+				# Without measures, as before the policy
+				pass
+			elif(self._gc_memory_limit_ is not None and memory >= self._gc_memory_limit_):
+				self._spill(kept)
+			elif(
+				freed_bytes < self._gc_growth_ and
+				(self._gc_baseline_ is None or memory - self._gc_baseline_ < self._gc_growth_)
+				):
+				generation = self._gc_young_generation_
+
+		if(generation is None):
+			self._gc_stats_['skipped'] += 1
+			return
+
+		with span('gc.collect', generation=generation):
+			start = perf_counter()
+			gc.collect(generation)
+			pause = perf_counter() - start
+
+		stats = self._gc_stats_
+		stats['full' if generation == 2 else 'young'] += 1
+		stats['pause'] += pause
+		stats['max_pause'] = max(stats['max_pause'], pause)
+
+		if(generation == 2):
+			self._gc_baseline_ = process_memory()
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] Collected generation {generation} in {pause*1000:.1f}ms")
+
+	def _spill(self, kept: Iterable[str]) -> None:
+		"""Drop big variables from locals, to be loaded again from disk when needed
+		"""
+		if(self._gc_spill_bytes_ is None):
+			return
+
+		# Prefetch threads read and fill locals under the same lock
+		with self._scope_lock_:
+			for var in kept:
+				value = self._rlocals_.get(var)
+				if(
+					value is None or
+					var not in self._scope_owned_ or
+					var in self._locked_vars_ or
+					type(value).__name__ in self._locked_types_
+					):
+					continue
+
+				size = value_bytes(value)
+				if(size < self._gc_spill_bytes_):
+					continue
+
+				del self._rlocals_[var]
+				self._scope_owned_.discard(var)
+				self._gc_stats_['spilled'] += 1
+				self._gc_stats_['spilled_bytes'] += size
+
+				if(logger.isEnabledFor(INFO)):
+					info(f"[i] Spilled \"{var}\" ({size} bytes) from memory")
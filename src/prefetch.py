@@ -0,0 +1,319 @@
+from typing import *
+
+from collections import OrderedDict
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from threading import RLock
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_PREFETCH,\
+	DEFAULT_PREFETCH_BUDGET,\
+	DEFAULT_PREFETCH_WORKERS,\
+	DEFAULT_PREFETCH_MAX_VARS,\
+	DEFAULT_STEP_SUFFIX
+
+from .compatibility import *
+
+logger = getLogger()
+
+MISSING: Final[object] = object()
+
+class Var_prefetcher:
+	"""Warms up the variables that historically are loaded together (as recorded in
+	the depsgraph) in a background thread, so they are already in memory when requested
+	"""
+	_prefetch_enabled_: bool
+	_prefetch_budget_: int
+	_prefetch_workers_: int
+
+	_prefetch_executor_: Optional[ThreadPoolExecutor]
+	_prefetch_lock_: RLock
+
+	# varname -> (value, size in disk). Kept in insertion order to evict the oldest first
+	_prefetched_: 'OrderedDict[str, Tuple[Any, int]]'
+	# Size in disk of the prefetched variables and of those being loaded
+	_prefetched_bytes_: int
+	# varname -> (load, size in disk)
+	_prefetch_pending_: Dict[str, Tuple[Future, int]]
+
+	_prefetch_issued_: int
+	_prefetch_hits_: int
+	_prefetch_misses_: int
+	_prefetch_wasted_: int
+
+	# External variables
+	_folder_name_: str
+	_rlocals_: Dict[str, Any]
+	_depsgraph_: Dict[str, Set[object]]
+	_depsgraph_last_scopes_: Dict[str, object]
+	_scope_lock_: RLock
+	_storager_: object
+
+	filesystem: object
+
+	def __init__(self,
+			  	 prefetch: bool=DEFAULT_PREFETCH,
+				 prefetch_budget: int=DEFAULT_PREFETCH_BUDGET,
+				 prefetch_workers: int=DEFAULT_PREFETCH_WORKERS,
+				 **kwargs
+		) -> None:
+		self._prefetch_enabled_ = prefetch
+		self._prefetch_budget_ = prefetch_budget
+		self._prefetch_workers_ = prefetch_workers
+
+		self._prefetch_executor_ = None
+		self._prefetch_lock_ = RLock()
+
+		self._prefetched_ = OrderedDict()
+		self._prefetched_bytes_ = 0
+		self._prefetch_pending_ = dict()
+
+		self.reset_prefetch_stats()
+
+		# Stores drop the prefetched copies they make stale
+		self._storager_._on_store_ = self._invalidate_prefetch
+
+	def set_prefetch(self, enabled: bool=True, *, budget: int=None) -> None:
+		"""Enable or disable the background prefetching of variables
+
+		Args:
+			enabled (bool): Whether to prefetch
+		Kwargs:
+			budget (int): The maximum amount of bytes kept in the prefetch cache
+		"""
+		self._prefetch_enabled_ = enabled
+		if(budget is not None):
+			self._prefetch_budget_ = budget
+
+		if(not enabled):
+			self.cancel_prefetch()
+
+	def prefetch(self, varnames: Iterable[str]) -> None:
+		"""Load the given variables in the background, as long as they fit in the memory budget
+
+		Args:
+			varnames (Iterable[str]): The variables to be loaded
+		"""
+		with self._prefetch_lock_:
+			if(self._prefetch_executor_ is None):
+				self._prefetch_executor_ = ThreadPoolExecutor(
+					self._prefetch_workers_,
+					thread_name_prefix='var_prefetch',
+				)
+
+			for varname in varnames:
+				if(
+						varname in self._rlocals_ or
+						varname in self._prefetched_ or
+						varname in self._prefetch_pending_
+					):
+					continue
+
+				size = self._prefetch_size(varname)
+				if(size is None or size > self._prefetch_budget_ or not self._prefetch_reserve(size)):
+					continue
+
+				self._prefetch_issued_ += 1
+				self._prefetch_pending_[varname] = (
+					self._prefetch_executor_.submit(self._prefetch_load, varname),
+					size,
+				)
+
+				if(logger.isEnabledFor(DEBUG)):
+					debug(f" [i] Prefetching \"{varname}\"")
+
+	def cancel_prefetch(self) -> int:
+		"""Cancel all pending prefetches and drop the not-yet-used prefetched variables
+
+		Returns:
+			int: The amount of prefetches that were wasted
+		"""
+		with self._prefetch_lock_:
+			wasted = len(self._prefetched_)
+			for future, _ in self._prefetch_pending_.values():
+				if(future.cancel()):
+					wasted += 1
+
+			self._prefetch_pending_.clear()
+			self._prefetched_.clear()
+			self._prefetched_bytes_ = 0
+
+			self._prefetch_wasted_ += wasted
+
+		return wasted
+
+	def prefetch_stats(self) -> Dict[str, Union[int, float]]:
+		"""Get the prefetcher counters
+
+		Returns:
+			Dict[str, Union[int, float]]: issued, hits, misses and wasted prefetches,
+				and the hit ratio of loads served from the prefetch cache
+		"""
+		requests = self._prefetch_hits_ + self._prefetch_misses_
+		return dict(
+			issued=self._prefetch_issued_,
+			hits=self._prefetch_hits_,
+			misses=self._prefetch_misses_,
+			wasted=self._prefetch_wasted_,
+			hit_ratio=self._prefetch_hits_ / requests if requests else 0.,
+			cached_bytes=self._prefetched_bytes_,
+		)
+
+	def reset_prefetch_stats(self) -> None:
+		self._prefetch_issued_ = 0
+		self._prefetch_hits_ = 0
+		self._prefetch_misses_ = 0
+		self._prefetch_wasted_ = 0
+
+	def _prefetch_size(self, varname: str) -> Optional[int]:
+		"""Estimate the size of a variable before loading it.
+		Only plain and step variables are prefetched, since loading sources runs code
+
+		Returns:
+			Optional[int]: The size of the file in disk, 0 if unknown or None if it should not be prefetched
+		"""
+		filesystem = self.filesystem
+		prefix = self._storager_._prefix_
+		for filename in (f"{prefix}{varname}", varname):
+			path = f"{self._folder_name_}/{filename}"
+			if(path in filesystem):
+				try:
+					return filesystem.size(path)
+				except OSError:
+					return None
+			if(f"{path}{DEFAULT_STEP_SUFFIX}" in filesystem):
+				return 0
+
+		return None
+
+	def _prefetch_reserve(self, size: int) -> bool:
+		"""Make room in the budget for a new prefetch, evicting the oldest prefetched variables.
+		Pending loads keep their room
+
+		Returns:
+			bool: Whether the size fits, and was added to the prefetched bytes
+		"""
+		while(self._prefetched_bytes_ + size > self._prefetch_budget_ and self._prefetched_):
+			evicted, (_, evicted_size) = self._prefetched_.popitem(last=False)
+			self._prefetched_bytes_ -= evicted_size
+			self._prefetch_wasted_ += 1
+
+			if(logger.isEnabledFor(DEBUG)):
+				debug(f" [i] Evicted prefetched \"{evicted}\"")
+
+		if(self._prefetched_bytes_ + size > self._prefetch_budget_):
+			return False
+
+		self._prefetched_bytes_ += size
+		return True
+
+	def _prefetch_load(self, varname: str) -> None:
+		try:
+			value = self._storager_.load_var(varname)
+		except Exception:
+			with self._prefetch_lock_:
+				pending = self._prefetch_pending_.pop(varname, None)
+				if(pending is not None):
+					self._prefetched_bytes_ -= pending[1]
+					self._prefetch_wasted_ += 1
+			raise
+
+		with self._prefetch_lock_:
+			pending = self._prefetch_pending_.pop(varname, None)
+			if(pending is None):
+				# Cancelled, or stored again, while loading
+				self._prefetch_wasted_ += 1
+				return
+
+			self._prefetched_[varname] = (value, pending[1])
+
+	def _invalidate_prefetch(self, varname: str) -> None:
+		"""Drop the prefetched copy of a variable that was stored or removed.
+		A load in progress is cancelled, or its value ignored
+		"""
+		with self._prefetch_lock_:
+			cached = self._prefetched_.pop(varname, None)
+			if(cached is not None):
+				self._prefetched_bytes_ -= cached[1]
+				self._prefetch_wasted_ += 1
+
+			pending = self._prefetch_pending_.pop(varname, None)
+			if(pending is not None):
+				future, size = pending
+				future.cancel()
+				self._prefetched_bytes_ -= size
+				self._prefetch_wasted_ += 1
+
+	def _take_prefetched(self, varname: str) -> Any:
+		"""Get a variable from the prefetch cache, waiting for it if it is being loaded
+
+		Returns:
+			Any: The variable, or MISSING if it was not prefetched
+		"""
+		if(not self._prefetch_enabled_):
+			return MISSING
+
+		with self._prefetch_lock_:
+			cached = self._prefetched_.pop(varname, None)
+			if(cached is not None):
+				self._prefetched_bytes_ -= cached[1]
+				self._prefetch_hits_ += 1
+				return cached[0]
+
+			pending = self._prefetch_pending_.get(varname)
+			if(pending is None or pending[0].cancel()):
+				if(pending is not None):
+					del self._prefetch_pending_[varname]
+					self._prefetched_bytes_ -= pending[1]
+				self._prefetch_misses_ += 1
+				return MISSING
+
+		# Already loading, so waiting is cheaper than loading it again
+		try:
+			pending[0].result()
+		except Exception:
+			pass
+
+		with self._prefetch_lock_:
+			cached = self._prefetched_.pop(varname, None)
+			if(cached is None):
+				self._prefetch_misses_ += 1
+				return MISSING
+
+			self._prefetched_bytes_ -= cached[1]
+			self._prefetch_hits_ += 1
+			return cached[0]
+
+	def _cooccurring_vars(self, varname: str) -> List[str]:
+		"""Get the variables that have been loaded in the same scopes as the given one,
+		the most frequent first
+		"""
+		counts: Dict[str, int] = dict()
+		with self._scope_lock_:
+			for dependency in self._depsgraph_.get(varname, ()):
+				for name in dependency.names():
+					if(name != varname):
+						counts[name] = counts.get(name, 0) + 1
+
+		return sorted(counts, key=counts.__getitem__, reverse=True)[:DEFAULT_PREFETCH_MAX_VARS]
+
+	def _prefetch_related(self, varname: str) -> None:
+		if(self._prefetch_enabled_):
+			self.prefetch(self._cooccurring_vars(varname))
+
+	def _prefetch_scope(self, scope_name: Optional[str]) -> None:
+		"""Prefetch the variables loaded the last time a scope with the same name was run
+		"""
+		if(not self._prefetch_enabled_ or scope_name is None):
+			return
+
+		previous = self._depsgraph_last_scopes_.get(scope_name)
+		if(previous is not None):
+			if(logger.isEnabledFor(INFO)):
+				info(f"[i] Prefetching variables of scope \"{scope_name}\"")
+			self.prefetch(previous.names())
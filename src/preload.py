@@ -0,0 +1,137 @@
+from typing import *
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from contextvars import copy_context
+
+from logging import debug,\
+	DEBUG,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_PRELOAD_WORKERS
+
+from .prefetch import MISSING
+
+from .compatibility import *
+
+logger = getLogger()
+
+# Set in the preload threads, whose own bulk loads run sequentially
+# so they never wait on the pool they are running in
+_preload_thread = threading.local()
+
+def _init_preload_thread() -> None:
+	_preload_thread.active = True
+
+class Var_preloader:
+	"""Loads many variables at once through a pool of threads, such as the arguments
+	of a step or the preload of a scope, so waiting for all of them takes about
+	as long as loading the biggest one
+	"""
+	_preload_workers_: int
+	_preload_executor_: Optional[ThreadPoolExecutor]
+	_preload_lock_: threading.Lock
+
+	# External variables
+	_rlocals_: Dict[str, Any]
+	_storager_: object
+	_scope_active_: int
+	_io_stats_: Optional[object]
+
+	add_loaded_var: Callable[[Self, str], None]
+	_set_scope_local: Callable[[Self, str, Any], None]
+	_take_prefetched: Callable[[Self, str], Any]
+
+	def __init__(self, preload_workers: int=DEFAULT_PRELOAD_WORKERS, **kwargs) -> None:
+		self._preload_workers_ = preload_workers
+		self._preload_executor_ = None
+		self._preload_lock_ = threading.Lock()
+
+	def preload(self, varnames: Iterable[str]) -> None:
+		"""Load variables into locals concurrently. Inside a scope they are added
+		to its dependencies and removed from memory when it closes
+
+		with vv.scope('train', preload=['x', 'y', 'weights']):
+			...
+
+		Args:
+			varnames (Iterable[str]): The variables to be loaded
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.preload()")
+
+		for _ in self._load_vars(varnames, in_locals=True):
+			pass
+
+	@property
+	def _preload_pool(self) -> ThreadPoolExecutor:
+		with self._preload_lock_:
+			if(self._preload_executor_ is None):
+				self._preload_executor_ = ThreadPoolExecutor(
+					self._preload_workers_,
+					thread_name_prefix='var_preload',
+					initializer=_init_preload_thread,
+				)
+			return self._preload_executor_
+
+	def _load_vars(self, varnames: Iterable[str], *, in_locals: bool=False) -> Iterator[Tuple[str, Any]]:
+		"""Load variables concurrently, yielding each one as soon as it is ready.
+		The prefetched ones go first. Inside a scope, each one is added to its dependencies
+		as it arrives
+
+		Args:
+			varnames (Iterable[str]): The variables to be loaded
+		Kwargs:
+			in_locals (bool): Whether to take the variables already in locals and keep
+				the loaded ones there. Step arguments are always loaded from storage,
+				since their versions and cache keys are those of the stored values
+
+		Returns:
+			Iterator[Tuple[str, Any]]: The name and value of each variable
+		"""
+		pending: List[str] = list()
+		for varname in dict.fromkeys(varnames):
+			value = self._rlocals_.get(varname, MISSING) if in_locals else MISSING
+			if(value is MISSING):
+				value = self._take_prefetched(varname)
+				if(value is MISSING):
+					pending.append(varname)
+					continue
+
+			if(self._io_stats_ is not None):
+				self._io_stats_.record_hit(varname)
+			yield self._loaded_var(varname, value, in_locals)
+
+		if(len(pending) < 2 or self._preload_workers_ < 2 or getattr(_preload_thread, 'active', False)):
+			for varname in pending:
+				yield self._loaded_var(varname, self._storager_.load_var(varname), in_locals)
+			return
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] Loading {len(pending)} variables concurrently")
+
+		pool = self._preload_pool
+		# Each load runs in a copy of this context, so the loads it triggers
+		# (as the arguments of a step) are still part of the open scope
+		futures = {
+			pool.submit(copy_context().run, self._storager_.load_var, varname): varname
+			for varname in pending
+		}
+		try:
+			for future in as_completed(futures):
+				yield self._loaded_var(futures[future], future.result(), in_locals)
+		finally:
+			for future in futures:
+				future.cancel()
+
+	def _loaded_var(self, varname: str, value: Any, in_locals: bool) -> Tuple[str, Any]:
+		if(self._scope_active_):
+			self.add_loaded_var(varname)
+
+		if(in_locals):
+			self._set_scope_local(varname, value)
+
+		return varname, value
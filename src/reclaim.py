@@ -0,0 +1,378 @@
+from typing import *
+
+import os
+import re
+import stat
+import lzma
+import time
+import shutil
+import hashlib
+
+from threading import RLock
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_RECLAIM_MAX_IDLE,\
+	DEFAULT_RECLAIM_CHUNK_SIZE,\
+	DEFAULT_ARCHIVE_FOLDER,\
+	DEFAULT_ARCHIVE_SUFFIX,\
+	DEFAULT_ATIME_PROBE,\
+	DEFAULT_STEP_SUFFIX,\
+	DEFAULT_SHARD_EXCLUDE
+
+from .scope import VAR_IDS
+
+from .compatibility import *
+
+logger = getLogger()
+
+# In the order they are checked, each variable is reported with the first that applies
+RECLAIM_REASONS: Final[Tuple[str, ...]] = ('superseded', 'never_read', 'cold', 'duplicate')
+RECLAIM_ACTIONS: Final[Tuple[str, ...]] = ('report', 'archive', 'delete')
+
+shard_exclude_re = re.compile(DEFAULT_SHARD_EXCLUDE)
+
+class Reclaim_candidate(NamedTuple):
+	# The name of the file, with the variable prefix
+	varname: str
+	reason: str
+	size: int
+	# Seconds since the epoch. None if it was never read, as far as the
+	# scopes, the I/O stats and the access time of the file know
+	last_loaded: Optional[float]
+	modified: float
+	# The copy that is kept of a duplicated variable
+	duplicate_of: Optional[str]=None
+
+class Var_reclaimer:
+	"""Finds the variables that take disk space without being used: never read, not read
+	in a long time, only read by steps that have since been replaced, or duplicated.
+	They can be archived compressed, to be restored later, or deleted
+	"""
+	# External variables
+	_folder_name_: str
+	_rlocals_: Dict[str, Any]
+	_locked_vars_: Set[str]
+	_depsgraph_: Dict[str, Set[object]]
+	_scope_lock_: RLock
+
+	filesystem: object
+	stats: object
+
+	get_var_prefix: Callable[[Self], str]
+	_get_producers: Callable[[Self], Dict[str, object]]
+	_invalidate_prefetch: Callable[[Self, str], None]
+	_depsgraph_index: Callable[[Self], Tuple[Dict[str, Set[str]], Dict[str, Set[str]]]]
+
+	def reclaim(self,
+			 	*,
+				max_idle: float=DEFAULT_RECLAIM_MAX_IDLE,
+				reasons: Iterable[str]=RECLAIM_REASONS,
+				action: str='report'
+		) -> Dict[str, Any]:
+		"""Find the variables that could be removed, from the depsgraph, the I/O stats
+		and the metadata of their files. Their values are never loaded, and only the files
+		of the same size are read, in chunks, to find duplicates.
+		Variables in memory, locked or with step versions (see gc_steps) are left alone.
+		Never read and cold variables are only archived or deleted if the filesystem
+		records when files are read, since loads outside scopes leave no other trace
+
+		vv.reclaim()['reclaimable_bytes']
+		vv.reclaim(reasons=['superseded', 'duplicate'], action='archive')
+
+		Args:
+			max_idle (float): Seconds since a variable was last loaded, or stored if it never was,
+				for it to be cold or never read
+			reasons (Iterable[str]): Which of "superseded" (only read by steps whose outputs are now
+				stored by steps that do not read it), "never_read", "cold" and "duplicate"
+				(same contents as a variable that is kept) to look for
+			action (str): "report" to only list them, "archive" to move them compressed to the
+				archive folder, from where unarchive restores them, or "delete". Deleted duplicates
+				are hardlinked to the copy that is kept, so they still load
+
+		Returns:
+			Dict[str, Any]: The candidates, the bytes they take in total and per reason,
+				and the bytes freed by the action
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.reclaim({max_idle=}, {action=})")
+
+		if(action not in RECLAIM_ACTIONS):
+			raise ValueError(f"Unknown reclaim action \"{action}\", use one of {RECLAIM_ACTIONS}")
+
+		reasons = set(reasons)
+		if(not reasons.issubset(RECLAIM_REASONS)):
+			raise ValueError(f"Unknown reclaim reasons {reasons.difference(RECLAIM_REASONS)}, use {RECLAIM_REASONS}")
+
+		folder = self._folder_name_
+		prefix = self.get_var_prefix()
+		now = time.time()
+		atime_tracked = self._atime_tracked(folder)
+
+		last_loaded = self._last_loaded()
+		# Loaded during this session, as far as the stats know
+		for row in self.stats():
+			if(row.loads or row.hits):
+				last_loaded[row.varname] = now
+
+		consumers: Dict[str, Set[str]] = dict()
+		producers: Dict[str, object] = dict()
+		if('superseded' in reasons):
+			consumers = self._depsgraph_index()[1]
+			producers = self._get_producers()
+
+		candidates: List[Reclaim_candidate] = list()
+		# size -> the variables kept, where duplicates are looked for
+		kept_by_size: Dict[int, List[Reclaim_candidate]] = dict()
+		# Files already hardlinked to a variable that is kept
+		kept_inodes: Set[Tuple[int, int]] = set()
+		for filename, varname, file_stat in self._variable_files(folder, prefix):
+			loaded = last_loaded.get(varname)
+			if(atime_tracked and file_stat.st_atime > file_stat.st_mtime):
+				# Read since it was last written, maybe outside any scope
+				loaded = max(loaded or 0., file_stat.st_atime)
+			candidate = Reclaim_candidate(filename, '', file_stat.st_size, loaded, file_stat.st_mtime)
+
+			reason = None
+			if('superseded' in reasons and self._is_superseded(varname, consumers, producers, prefix)):
+				reason = 'superseded'
+			elif(now - max(loaded or 0., candidate.modified) >= max_idle):
+				reason = 'never_read' if loaded is None else 'cold'
+				if(reason not in reasons):
+					reason = None
+
+			if(reason is not None):
+				candidates.append(candidate._replace(reason=reason))
+			elif(candidate.size and (file_stat.st_dev, file_stat.st_ino) not in kept_inodes):
+				kept_inodes.add((file_stat.st_dev, file_stat.st_ino))
+				kept_by_size.setdefault(candidate.size, list()).append(candidate)
+
+		if('duplicate' in reasons):
+			candidates.extend(self._duplicates(kept_by_size, folder))
+
+		by_reason: Dict[str, int] = dict()
+		for candidate in candidates:
+			by_reason[candidate.reason] = by_reason.get(candidate.reason, 0) + candidate.size
+
+		reclaimed = 0
+		if(action != 'report'):
+			acted = candidates
+			if(not atime_tracked):
+				acted = [candidate for candidate in candidates if candidate.reason not in ('never_read', 'cold')]
+				if(len(acted) < len(candidates) and logger.isEnabledFor(INFO)):
+					info(f"[i] {len(candidates) - len(acted)} never read or cold variables are only reported, the filesystem does not record when files are read")
+
+			for candidate in acted:
+				path = f"{folder}/{candidate.varname}"
+				if(action == 'archive'):
+					reclaimed -= self._archive_file(path, self._archive_path(candidate.varname))
+
+				self.filesystem.remove(path)
+				if(action == 'delete' and candidate.duplicate_of is not None):
+					# Shares the data of the copy that is kept, and still loads
+					self.filesystem.link(f"{folder}/{candidate.duplicate_of}", path)
+				self._invalidate_prefetch(self._unprefixed(candidate.varname, prefix))
+				reclaimed += candidate.size
+
+				if(logger.isEnabledFor(DEBUG)):
+					debug(f" [i] {action.capitalize()}d \"{candidate.varname}\" ({candidate.reason})")
+
+		reclaimable = sum(by_reason.values())
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] {len(candidates)} variables take {reclaimable} reclaimable bytes" + (
+				f", {action}d freeing {reclaimed} bytes" if action != 'report' else ''
+			))
+
+		return dict(
+			action=action,
+			candidates=candidates,
+			reclaimable_bytes=reclaimable,
+			by_reason=by_reason,
+			reclaimed_bytes=reclaimed,
+		)
+
+	def archived(self) -> List[str]:
+		"""Get the variables archived by reclaim, with their prefix
+		"""
+		archive_folder = f"{self._folder_name_}/{DEFAULT_ARCHIVE_FOLDER}"
+		if(not os.path.isdir(archive_folder)):
+			return list()
+
+		return sorted(
+			filename[:-len(DEFAULT_ARCHIVE_SUFFIX)]
+			for filename in os.listdir(archive_folder)
+			if filename.endswith(DEFAULT_ARCHIVE_SUFFIX)
+		)
+
+	def unarchive(self, varnames: Union[str, Iterable[str]]) -> None:
+		"""Restore variables archived by reclaim
+
+		Args:
+			varnames (Union[str, Iterable[str]]): The variables, with their prefix, as reported by reclaim
+		"""
+		if(isinstance(varnames, str)):
+			varnames = (varnames,)
+
+		filesystem = self.filesystem
+		for varname in varnames:
+			archive_path = self._archive_path(varname)
+			if(not os.path.exists(archive_path)):
+				raise FileNotFoundError(f"Variable \"{varname}\" is not archived in \"{archive_path}\"")
+
+			with lzma.open(archive_path, 'rb') as src,\
+					filesystem.open(f"{self._folder_name_}/{varname}", filesystem.WRITE_CREATE_BINARY) as dst:
+				shutil.copyfileobj(src, dst, DEFAULT_RECLAIM_CHUNK_SIZE)
+			os.remove(archive_path)
+			self._invalidate_prefetch(self._unprefixed(varname, self.get_var_prefix()))
+
+			if(logger.isEnabledFor(INFO)):
+				info(f"[i] Restored \"{varname}\" from the archive")
+
+	def _unprefixed(self, filename: str, prefix: str) -> str:
+		return filename[len(prefix):] if filename.startswith(prefix) else filename
+
+	def _archive_path(self, varname: str) -> str:
+		return f"{self._folder_name_}/{DEFAULT_ARCHIVE_FOLDER}/{varname}{DEFAULT_ARCHIVE_SUFFIX}"
+
+	def _archive_file(self, path: str, archive_path: str) -> int:
+		"""Compress a file into the archive
+
+		Returns:
+			int: The size of the archived file
+		"""
+		os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+
+		with self.filesystem.open(path, self.filesystem.READ_BINARY) as src,\
+				lzma.open(archive_path, 'wb') as dst:
+			shutil.copyfileobj(src, dst, DEFAULT_RECLAIM_CHUNK_SIZE)
+
+		return os.path.getsize(archive_path)
+
+	def _atime_tracked(self, folder: str) -> bool:
+		"""Whether reading a file of the folder updates its access time. It does not in
+		noatime mounts, and with relatime only when it is older than the modification time
+		"""
+		probe = f"{folder}/{DEFAULT_ATIME_PROBE}"
+		try:
+			with open(probe, 'wb') as f:
+				f.write(b'\0')
+			os.utime(probe, ns=(0, 0))
+			with open(probe, 'rb') as f:
+				f.read()
+			return os.stat(probe).st_atime_ns > 0
+		except OSError:
+			return False
+		finally:
+			if(os.path.exists(probe)):
+				os.remove(probe)
+
+	def _variable_files(self, folder: str, prefix: str) -> Iterator[Tuple[str, str, os.stat_result]]:
+		"""Walk the variable files of the folder, without the ones in use
+
+		Returns:
+			Iterator[Tuple[str, str, os.stat_result]]: The file name, the variable name
+				without the prefix and the metadata of the file
+		"""
+		filesystem = self.filesystem
+		in_use = self._locked_vars_.union(self._rlocals_)
+
+		for filename in filesystem.listdir(folder):
+			# Sources, references, steps and metadata are not identifiers
+			if(not filename.isidentifier() or shard_exclude_re.match(filename)):
+				continue
+
+			varname = self._unprefixed(filename, prefix)
+			if(varname in in_use or filename in in_use):
+				continue
+
+			path = f"{folder}/{filename}"
+			if(f"{path}{DEFAULT_STEP_SUFFIX}" in filesystem):
+				continue
+
+			try:
+				file_stat = filesystem.stat(path)
+			except OSError:
+				continue
+
+			if(stat.S_ISREG(file_stat.st_mode)):
+				yield filename, varname, file_stat
+
+	def _last_loaded(self) -> Dict[str, float]:
+		"""Get when each variable was last loaded in a scope, in seconds since the epoch
+		"""
+		last_loaded: Dict[int, int] = dict()
+		with self._scope_lock_:
+			seen: Set[int] = set()
+			for var_deps in self._depsgraph_.values():
+				for dependency in var_deps:
+					if(id(dependency) in seen):
+						continue
+					seen.add(id(dependency))
+
+					for var_id, timestamp in zip(dependency._var_ids_, dependency._times_):
+						if(timestamp > last_loaded.get(var_id, -1)):
+							last_loaded[var_id] = timestamp
+
+		return {
+			VAR_IDS.name(var_id): timestamp / 1e6
+			for var_id, timestamp in last_loaded.items()
+		}
+
+	def _is_superseded(self,
+					   varname: str,
+					   consumers: Dict[str, Set[str]],
+					   producers: Dict[str, object],
+					   prefix: str
+			) -> bool:
+		"""Whether every variable built from this one is now stored by a step that does not read it
+		"""
+		var_consumers = consumers.get(varname)
+		if(not var_consumers):
+			return False
+
+		for consumer in var_consumers:
+			producer = producers.get(f"{prefix}{consumer}")
+			if(producer is None or varname in producer.inputs):
+				return False
+
+		return True
+
+	def _duplicates(self, kept_by_size: Dict[int, List[Reclaim_candidate]], folder: str) -> Iterator[Reclaim_candidate]:
+		"""Find the variables with the same contents as another one, hashing only the files
+		that share their size. The most recently used copy is kept
+		"""
+		for size, same_size in kept_by_size.items():
+			if(len(same_size) < 2):
+				continue
+
+			by_digest: Dict[bytes, List[Reclaim_candidate]] = dict()
+			for candidate in same_size:
+				try:
+					digest = self._file_digest(f"{folder}/{candidate.varname}")
+				except OSError:
+					continue
+				by_digest.setdefault(digest, list()).append(candidate)
+
+			for copies in by_digest.values():
+				if(len(copies) < 2):
+					continue
+
+				copies.sort(key=lambda copy: max(copy.last_loaded or 0., copy.modified), reverse=True)
+				original = copies[0].varname
+				for copy in copies[1:]:
+					yield copy._replace(reason='duplicate', duplicate_of=original)
+
+	def _file_digest(self, path: str) -> bytes:
+		file_stat = self.filesystem.stat(path)
+		digest = hashlib.blake2b()
+		try:
+			with self.filesystem.open(path, self.filesystem.READ_BINARY) as f:
+				for chunk in iter(lambda: f.read(DEFAULT_RECLAIM_CHUNK_SIZE), b''):
+					digest.update(chunk)
+		finally:
+			# Hashing is not a read of the variable
+			os.utime(path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+		return digest.digest()
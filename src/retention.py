@@ -0,0 +1,169 @@
+from typing import *
+
+import re
+import time
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .defaults import DEFAULT_RETENTION_NAME
+
+from .compatibility import *
+
+logger = getLogger()
+
+class Retention_policy(NamedTuple):
+	# RegEx matched against the start of the variable name (with its prefix)
+	pattern: str
+	keep_last: Optional[int]=None
+	# In seconds
+	max_age: Optional[float]=None
+	pinned: FrozenSet[str]=frozenset()
+	max_bytes: Optional[int]=None
+
+class Step_candidate(NamedTuple):
+	step_names: Tuple[str, ...]
+	timestamp: float
+	size: int
+
+def select_versions(versions: Sequence[Step_candidate], policy: Retention_policy, *, now: float=None) -> List[bool]:
+	"""Decide which versions of a variable are kept by a retention policy.
+	A version is kept if it is one of the last keep_last, younger than max_age or pinned.
+	Then the oldest unpinned versions are dropped until the kept ones fit in max_bytes.
+	The newest version is always kept
+
+	Args:
+		versions (Sequence[Step_candidate]): The versions, the newest first
+		policy (Retention_policy): The policy to apply
+	Kwargs:
+		now (float): The current timestamp
+
+	Returns:
+		List[bool]: Whether each version is kept
+	"""
+	if(now is None):
+		now = time.time()
+
+	keep_all = policy.keep_last is None and policy.max_age is None and not policy.pinned
+
+	keep: List[bool] = list()
+	for i, version in enumerate(versions):
+		keep.append(
+			keep_all or
+			i == 0 or
+			(policy.keep_last is not None and i < policy.keep_last) or
+			(policy.max_age is not None and now - version.timestamp <= policy.max_age) or
+			not policy.pinned.isdisjoint(version.step_names)
+		)
+
+	if(policy.max_bytes is not None):
+		kept_bytes = sum(
+			version.size
+			for version, kept in zip(versions, keep)
+			if kept
+		)
+
+		for i in range(len(versions)-1, 0, -1):
+			if(kept_bytes <= policy.max_bytes):
+				break
+
+			if(keep[i] and policy.pinned.isdisjoint(versions[i].step_names)):
+				keep[i] = False
+				kept_bytes -= versions[i].size
+
+	return keep
+
+class Var_retention:
+	"""Retention policies that decide which step versions gc_steps deletes,
+	set per variable or prefix and kept in the variables folder
+	"""
+	_retention_policies_: Dict[str, Retention_policy]
+
+	# External variables
+	load_var: Callable[[Self, str], Any]
+	store_var: Callable[[Self, Union[type, object, str], Optional[Any]], Any]
+
+	def __init__(self, **kwargs) -> None:
+		self._retention_policies_ = {
+			pattern: Retention_policy(**{
+				**policy,
+				'pinned': frozenset(policy.get('pinned', ())),
+			})
+			for pattern, policy in (self.load_var(DEFAULT_RETENTION_NAME) or dict()).items()
+		}
+
+	def set_retention(self,
+				   	  pattern: str='',
+					  *,
+					  keep_last: int=None,
+					  max_age: float=None,
+					  pinned: Iterable[str]=(),
+					  max_bytes: int=None
+			) -> Retention_policy:
+		"""Set the retention policy of the step versions of every variable
+		whose name starts with a pattern. It is applied by gc_steps
+
+		vv.set_retention('exp1_', keep_last=3, pinned=['baseline'], max_bytes=10 * 1024**3)
+
+		Args:
+			pattern (str): RegEx matched against the start of the variable names, with their prefix.
+				The policies are tried in the order they were first set
+		Kwargs:
+			keep_last (int): Keep the last N versions
+			max_age (float): Keep the versions younger than this many seconds
+			pinned (Iterable[str]): Keep the versions of these steps
+			max_bytes (int): Drop the oldest unpinned versions until the rest fit in this many bytes
+
+		Returns:
+			Retention_policy: The new policy
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.set_retention({pattern=}, {keep_last=}, {max_age=}, {max_bytes=})")
+
+		re.compile(pattern)
+
+		policy = Retention_policy(
+			pattern,
+			keep_last,
+			max_age,
+			frozenset(pinned),
+			max_bytes,
+		)
+		self._retention_policies_[pattern] = policy
+		self._store_retention()
+
+		return policy
+
+	def remove_retention(self, pattern: str) -> None:
+		self._retention_policies_.pop(pattern, None)
+		self._store_retention()
+
+	@property
+	def retention_policies(self) -> List[Retention_policy]:
+		return list(self._retention_policies_.values())
+
+	def get_retention(self, varname: str) -> Optional[Retention_policy]:
+		"""Get the retention policy that applies to a variable
+
+		Args:
+			varname (str): The name of the variable, with its prefix
+
+		Returns:
+			Optional[Retention_policy]: The first matching policy, or None if its versions are kept forever
+		"""
+		for pattern, policy in self._retention_policies_.items():
+			if(re.match(pattern, varname)):
+				return policy
+
+	def _store_retention(self) -> None:
+		self.store_var(DEFAULT_RETENTION_NAME, {
+			pattern: {
+				**policy._asdict(),
+				'pinned': tuple(policy.pinned),
+			}
+			for pattern, policy in self._retention_policies_.items()
+		})
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Stored {len(self._retention_policies_)} retention policies")
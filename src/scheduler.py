@@ -0,0 +1,382 @@
+from typing import *
+
+import multiprocessing
+
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from inspect import signature
+
+import typeguard
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .prefetch import MISSING
+
+from .defaults import DEFAULT_STEP_WORKERS
+
+from .compatibility import *
+
+logger = getLogger()
+
+# Options of step_run_function that are not arguments of the step
+STEP_OPTIONS: Final[Tuple[str, ...]] = (
+	'output_name',
+	'keep_intermediate',
+	'step_n',
+	'type_check',
+	'step_name',
+	'processer',
+	'force',
+)
+
+class Scheduled_step(NamedTuple):
+	step_fn: Callable
+	step_name: str
+	# Options of step_run_function
+	options: Dict[str, Any]
+	# Explicit arguments of the step
+	kwargs: Dict[str, Any]
+	inputs: FrozenSet[str]
+	outputs: FrozenSet[str]
+
+def step_outputs(output_name: Union[None, str, Sequence[str]], value: Any) -> Tuple[Union[None, str, Tuple[str, ...]], Optional[List[Any]]]:
+	"""Get the outputs a step run stores from the value it returned.
+	A value with as many items as output names is split among them, and otherwise stored whole
+
+	Returns:
+		Tuple[Union[None, str, Tuple[str, ...]], Optional[List[Any]]]: The output names,
+			either a single one or a tuple of them, and their values. None if nothing is stored
+	"""
+	if(output_name is None or value is None):
+		return None, None
+
+	if(
+		hasattr(value, '__len__') and
+		hasattr(output_name, '__len__') and
+		type(output_name) != str and
+		type(value) != str and
+		len(output_name) == len(value)
+		):
+		return tuple(output_name), list(value)
+	return output_name, [value]
+
+# The store each worker process opens once
+_worker_store: Optional[object] = None
+
+def _open_worker_store(store_class: type, var_name: str, folder_name: str, open_lock: object) -> None:
+	global _worker_store
+
+	# Opening a store rewrites its configuration, so workers take turns
+	with open_lock:
+		_worker_store = store_class(
+			var_name,
+			dict(),
+			folder_name=folder_name,
+			folder_add_timestamp=False,
+		)
+
+def _run_worker_step(
+			step_fn_data: bytes,
+			kwargs: Dict[str, Any],
+			*,
+			output_name: Union[None, str, Sequence[str]],
+			prefix: str,
+			type_check: bool,
+			return_value: bool
+		) -> Tuple[Union[None, str, Tuple[str, ...]], List[str], bool, Optional[bytes]]:
+	"""Run a step in a worker, loading its inputs from and storing its outputs into the store
+
+	Returns:
+		Tuple[Union[None, str, Tuple[str, ...]], List[str], bool, Optional[bytes]]: The stored outputs,
+			the loaded inputs, whether the step returned None and the serialized value if requested
+	"""
+	store = _worker_store
+	store.set_var_prefix(prefix, sep='')
+
+	step_fn = store.serializer.loads(step_fn_data)
+	if(type_check):
+		step_fn = typeguard.typechecked(step_fn)
+
+	try:
+		fn_args = store.load_function_args(step_fn, not_load=kwargs.keys())
+		input_names = list(fn_args.keys())
+		fn_args.update(kwargs)
+
+		step_fn_sig = signature(step_fn)
+		value = step_fn(**{
+			arg: arg_value
+			for arg, arg_value in fn_args.items()
+			if arg in step_fn_sig.parameters
+		})
+
+		output_spec, output_values = step_outputs(output_name, value)
+		if(output_spec is not None):
+			for output_name_n, value_n in zip(
+						output_spec if isinstance(output_spec, tuple) else (output_spec,),
+						output_values
+					):
+				store.store_var(output_name_n, value_n)
+
+		return (
+			output_spec,
+			input_names,
+			value is None,
+			store.serializer.dumps(value) if return_value else None,
+		)
+	finally:
+		# Other steps may change the variables loaded here
+		store.empty_scope()
+
+class Var_scheduler:
+	"""Runs independent steps concurrently in a pool of processes, each with its own
+	view of the same variables folder. The outputs are versioned by this process
+	"""
+	_step_workers_: int
+
+	# External variables
+	_var_name_: str
+	_folder_name_: str
+	_rlocals_: Dict[str, Any]
+
+	serializer: object
+	version_controller: object
+
+	__enter__: Callable[[Self, Optional[str]], None]
+	__exit__: Callable[[Self], None]
+	add_loaded_var: Callable[[Self, str], None]
+	_invalidate_prefetch: Callable[[Self, str], None]
+	function_arg_names: Callable[[Self, Callable], List[str]]
+	get_var_prefix: Callable[[Self], str]
+	_record_producer: Callable[..., None]
+
+	def __init__(self, step_workers: int=DEFAULT_STEP_WORKERS, **kwargs) -> None:
+		self._step_workers_ = max(1, step_workers)
+
+	def _schedule_step(self, step: Union[Callable, Dict[str, Any]]) -> Scheduled_step:
+		if(callable(step)):
+			step = dict(step=step)
+		else:
+			step = dict(step)
+
+		step_fn = step.pop('step')
+		options = {
+			option: step.pop(option)
+			for option in STEP_OPTIONS
+			if option in step
+		}
+		step_name = options.get('step_name') or step_fn.__name__
+
+		output_name = options.get('output_name')
+		outputs: FrozenSet[str]
+		if(output_name is None):
+			outputs = frozenset()
+		elif(isinstance(output_name, str)):
+			outputs = frozenset((output_name,))
+		else:
+			outputs = frozenset(output_name)
+
+		return Scheduled_step(
+			step_fn,
+			step_name,
+			options,
+			step,
+			frozenset(self.function_arg_names(step_fn, not_load=step.keys())),
+			outputs,
+		)
+
+	def run_steps(self,
+			   	  steps: Iterable[Union[Callable, Dict[str, Any]]],
+				  *,
+				  workers: int=None,
+				  return_values: bool=False
+		) -> Optional[List[Any]]:
+		"""Run many steps, running concurrently those that do not depend on each other.
+		The inputs of each step are its arguments, loaded as in step, and its outputs are its output_name,
+		so a step waits for the earlier steps that write its inputs, read its outputs or write them too.
+		The results are the same as running the steps one by one, in order, and each one is versioned
+		as soon as it finishes
+
+		vv.run_steps([
+			load_data,
+			dict(step=clean, output_name='clean_df'),
+			dict(step=features, output_name=('X', 'y'), scale=2),
+		])
+
+		Steps run in separate processes, so variables they store other than their outputs are not
+		versioned, and processer steps run in this process
+
+		Args:
+			steps (Iterable[Union[Callable, Dict[str, Any]]]): Either the step functions, or dicts with the
+				function in "step", the options of step (output_name, step_name, step_n...) and its arguments
+		Kwargs:
+			workers (int): The number of processes. With one, the steps run in this process
+			return_values (bool): Whether to send back the values the steps return
+
+		Returns:
+			Optional[List[Any]]: The value returned by each step, if requested
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.run_steps({workers=}, {return_values=})")
+
+		scheduled = [self._schedule_step(step) for step in steps]
+		if(workers is None):
+			workers = self._step_workers_
+
+		if(workers <= 1):
+			values = [
+				self.version_controller.step_run_function(
+					step.step_fn,
+					**step.options,
+					**step.kwargs
+				)
+				for step in scheduled
+			]
+			return values if return_values else None
+
+		# Earlier steps each one has to wait for, so the order of reads and writes is kept
+		dependencies: List[Set[int]] = [set() for _ in scheduled]
+		dependents: List[List[int]] = [list() for _ in scheduled]
+		last_writer: Dict[str, int] = dict()
+		readers: Dict[str, List[int]] = dict()
+		for step_i, step in enumerate(scheduled):
+			for input_name in step.inputs:
+				if(input_name in last_writer):
+					dependencies[step_i].add(last_writer[input_name])
+			for output_name in step.outputs:
+				if(output_name in last_writer):
+					dependencies[step_i].add(last_writer[output_name])
+				dependencies[step_i].update(readers.get(output_name, ()))
+			dependencies[step_i].discard(step_i)
+
+			for input_name in step.inputs:
+				readers.setdefault(input_name, list()).append(step_i)
+			for output_name in step.outputs:
+				last_writer[output_name] = step_i
+				readers[output_name] = list()
+
+			for dependency in dependencies[step_i]:
+				dependents[dependency].append(step_i)
+
+		values: List[Any] = [None] * len(scheduled)
+		waiting: List[int] = [len(step_deps) for step_deps in dependencies]
+		ready: List[int] = [step_i for step_i, n_deps in enumerate(waiting) if not n_deps]
+		# Future -> (step number, cache key)
+		running: Dict[Future, Tuple[int, Optional[str]]] = dict()
+		error: Optional[BaseException] = None
+
+		def finish(step_i: int) -> None:
+			for dependent in dependents[step_i]:
+				waiting[dependent] -= 1
+				if(not waiting[dependent]):
+					ready.append(dependent)
+
+		version_controller = self.version_controller
+		prefix = self.get_var_prefix()
+
+		with ProcessPoolExecutor(
+					workers,
+					initializer=_open_worker_store,
+					initargs=(type(self), self._var_name_, self._folder_name_, multiprocessing.Lock())
+				) as executor:
+			while(ready or running):
+				while(ready and error is None):
+					step_i = ready.pop(0)
+					step = scheduled[step_i]
+
+					if(step.options.get('processer')):
+						# Processer steps need their arguments here
+						values[step_i] = version_controller.step_run_function(
+							step.step_fn,
+							**step.options,
+							**step.kwargs
+						)
+						finish(step_i)
+						continue
+
+					cache_key, value = version_controller._cached_step(
+						step.step_fn,
+						step.step_name,
+						dict(step.kwargs),
+						force=step.options.get('force', False),
+					)
+					if(value is not MISSING):
+						values[step_i] = value
+						finish(step_i)
+						continue
+
+					future = executor.submit(
+						_run_worker_step,
+						self.serializer.dumps(step.step_fn),
+						step.kwargs,
+						output_name=step.options.get('output_name'),
+						prefix=prefix,
+						type_check=step.options.get('type_check', False),
+						return_value=return_values,
+					)
+					running[future] = (step_i, cache_key)
+
+				if(not running):
+					break
+
+				done, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in done:
+					step_i, cache_key = running.pop(future)
+					step = scheduled[step_i]
+
+					try:
+						output_spec, input_names, returned_none, value_data = future.result()
+					except Exception as err:
+						# Running steps are still versioned, but no other step is started
+						if(error is None):
+							error = err
+						continue
+
+					# Same bookkeeping of the loaded variables as a step run here
+					self.__enter__()
+					for input_name in input_names:
+						self.add_loaded_var(input_name)
+					self.__exit__()
+
+					if(output_spec is not None):
+						for output_name in (output_spec if isinstance(output_spec, tuple) else (output_spec,)):
+							self._rlocals_.pop(output_name, None)
+							self._invalidate_prefetch(output_name)
+
+					version_controller._version_step(
+						step.step_name,
+						(),
+						input_names,
+						output_spec=output_spec,
+						keep_intermediate=step.options.get('keep_intermediate', True),
+						step_n=step.options.get('step_n'),
+						# Only runs whose value can be rebuilt from their outputs are cached
+						cache_key=cache_key if returned_none or output_spec is not None else None,
+						prefix=prefix,
+					)
+
+					if(output_spec is not None):
+						self._record_producer(
+							step.step_fn,
+							step.step_name,
+							output_spec,
+							input_names,
+							step.kwargs,
+							cache_key=cache_key,
+							prefix=prefix,
+							keep_intermediate=step.options.get('keep_intermediate', True),
+							type_check=step.options.get('type_check', False),
+						)
+
+					if(value_data is not None):
+						values[step_i] = self.serializer.loads(value_data)
+					finish(step_i)
+
+		if(error is not None):
+			raise error
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Ran {len(scheduled)} steps in {workers} processes")
+
+		return values if return_values else None
@@ -1,100 +1,413 @@
 from typing import *
 
-import gc
-
 from logging import debug,\
 	DEBUG,\
 	getLogger
 
 import os
+import uuid
+import threading
+
+from contextvars import ContextVar
+from contextlib import contextmanager
+
+from array import array
+from bisect import bisect_right
 
-from sortedcontainers import SortedList
+from itertools import chain, repeat
 
-from itertools import cycle
+from time import time_ns, perf_counter
 
 from datetime import datetime
 
+try:
+	import numpy
+	use_numpy = True
+except ImportError:
+	use_numpy = False
+
 from .defaults import\
 	DEFAULT_DEPSGRAPH_NAME,\
+	DEFAULT_DEPSGRAPH_LOG_SUFFIX,\
+	DEFAULT_DEPSGRAPH_CHECKPOINT_INTERVAL,\
+	DEFAULT_VAR_ID_TYPECODE,\
+	DEFAULT_TIMESTAMP_TYPECODE,\
+	DEFAULT_OFFSET_TYPECODE,\
 	DEFAULT_LOCKED_TYPES
 
+from .tracing import traced
+from .memory import value_bytes
+
 from .compatibility import *
 
 logger = getLogger()
 
 def get0(t): return t[0]
-class Dependency:
-	__slots__ = ['_loaded_vars_', '_name_', '_hash_']
 
+class Var_ids:
+	"""Interned variable names. Dependencies store the id of each name,
+	so every name is kept once however many scopes load it
+	"""
+	__slots__ = ['_names_', '_ids_', '_lock_']
+
+	_names_: List[str]
+	_ids_: Dict[str, int]
+	_lock_: threading.Lock
+
+	def __init__(self) -> None:
+		self._names_ = list()
+		self._ids_ = dict()
+		self._lock_ = threading.Lock()
+
+	def __len__(self) -> int:
+		return len(self._names_)
+
+	def id(self, varname: str) -> int:
+		var_id = self._ids_.get(varname)
+		if(var_id is None):
+			with self._lock_:
+				var_id = self._ids_.get(varname)
+				if(var_id is None):
+					var_id = len(self._names_)
+					self._names_.append(varname)
+					self._ids_[varname] = var_id
+		return var_id
+
+	def get(self, varname: str) -> int:
+		"""Get the id of a name, or -1 if it was never interned
+		"""
+		return self._ids_.get(varname, -1)
+
+	def name(self, var_id: int) -> str:
+		return self._names_[var_id]
+
+	def names(self, var_ids: Iterable[int]) -> List[str]:
+		names = self._names_
+		return [names[var_id] for var_id in var_ids]
+
+VAR_IDS: Final[Var_ids] = Var_ids()
+
+def to_timestamp(moment: datetime) -> int:
+	"""Get a datetime as integer microseconds since the epoch,
+	without losing precision as float timestamps do
+	"""
+	return int(moment.replace(microsecond=0).timestamp()) * 1_000_000 + moment.microsecond
+
+def from_timestamp(timestamp: int) -> datetime:
+	seconds, microseconds = divmod(timestamp, 1_000_000)
+	return datetime.fromtimestamp(seconds).replace(microsecond=microseconds)
+
+class Dependency:
+	"""The variables loaded in a scope, in the order they were loaded.
+	Names are stored as interned ids in an int32 array and load times
+	as microseconds in an int64 array
+	"""
+	__slots__ = ['_var_ids_', '_times_', '_name_']
 
-	# Key is datetime
-	_loaded_vars_: SortedList[str]
+	_var_ids_: array
+	_times_: array
 	_name_: Optional[str]
-	_hash_: Optional[int]
 
 	def __init__(self, 
-			  loaded: Iterable[Tuple[datetime, str]]=list(),
+			  loaded: Iterable[Tuple[datetime, str]]=(),
 			  name: Optional[str]=None,
 			  ) -> None:
-		self._loaded_vars_ = SortedList(loaded, key=get0)
+		loaded = sorted(loaded, key=get0)
 
+		self._var_ids_ = array(DEFAULT_VAR_ID_TYPECODE, [VAR_IDS.id(varname) for _, varname in loaded])
+		self._times_ = array(DEFAULT_TIMESTAMP_TYPECODE, [to_timestamp(moment) for moment, _ in loaded])
 		self._name_ = name
-		if(self._name_ is not None):
-			self._hash_ = name.__hash__()
-		else:
-			self._hash_ = None
+
+	@classmethod
+	def from_arrays(cls, var_ids: array, times: array, name: Optional[str]=None) -> Self:
+		dependency = cls.__new__(cls)
+		dependency._var_ids_ = var_ids
+		dependency._times_ = times
+		dependency._name_ = name
+		return dependency
 
 	def __hash__(self) -> int:
-		if(self._hash_ is not None):
-			return self._hash_
-		return tuple(self._loaded_vars_).__hash__()
-	
+		if(self._name_ is not None):
+			return self._name_.__hash__()
+		# Dependencies only equal themselves, and change as variables are loaded
+		return object.__hash__(self)
+
+	def __len__(self) -> int:
+		return len(self._var_ids_)
+
 	def __contains__(self, varname: str):
-		return varname in self._loaded_vars_
+		# Scanned in C, without building a tuple per variable
+		return VAR_IDS.get(varname) in self._var_ids_
 	
-	def __iter__(self):
-		return self._loaded_vars_.__iter__()
+	def __iter__(self) -> Iterator[Tuple[datetime, str]]:
+		return zip(
+			map(from_timestamp, self._times_),
+			VAR_IDS.names(self._var_ids_),
+		)
+
+	def names(self) -> List[str]:
+		"""Get the loaded variables, without their load times
+		"""
+		return VAR_IDS.names(self._var_ids_)
 
 	def add(self, varname: str):
-		self._loaded_vars_.add((datetime.now(), varname))
+		timestamp = time_ns() // 1000
+		if(not self._times_ or self._times_[-1] <= timestamp):
+			self._var_ids_.append(VAR_IDS.id(varname))
+			self._times_.append(timestamp)
+		else:
+			self._insert(timestamp, (VAR_IDS.id(varname),))
 
 	def update(self, varname: Iterable[str]):
-		now = datetime.now()
-
-		self._loaded_vars_.update(
-			zip(
-				varname,
-				[now]
-			)
+		self._insert(
+			time_ns() // 1000,
+			[VAR_IDS.id(name) for name in varname]
 		)
 
+	def _insert(self, timestamp: int, var_ids: Sequence[int]) -> None:
+		if(not self._times_ or self._times_[-1] <= timestamp):
+			self._var_ids_.extend(var_ids)
+			self._times_.extend(repeat(timestamp, len(var_ids)))
+			return
+
+		# The clock went back
+		position = bisect_right(self._times_, timestamp)
+		self._var_ids_[position:position] = array(DEFAULT_VAR_ID_TYPECODE, var_ids)
+		self._times_[position:position] = array(DEFAULT_TIMESTAMP_TYPECODE, repeat(timestamp, len(var_ids)))
+
 	def copy(self):
-		return self.__class__(
-			self._loaded_vars_.copy(),
+		return self.from_arrays(
+			array(DEFAULT_VAR_ID_TYPECODE, self._var_ids_),
+			array(DEFAULT_TIMESTAMP_TYPECODE, self._times_),
 			self._name_
 		)
 
+	def __reduce__(self):
+		# Ids are only valid in this process, so names are stored
+		return (
+			_load_dependency,
+			(self.names(), self._times_.tobytes(), self._name_)
+		)
+
+	def __setstate__(self, state: Tuple[None, Dict[str, Any]]) -> None:
+		# Dependencies pickled before ids were interned
+		_, slots = state
+		loaded = slots['_loaded_vars_']
+		self._var_ids_ = array(DEFAULT_VAR_ID_TYPECODE, [VAR_IDS.id(varname) for _, varname in loaded])
+		self._times_ = array(DEFAULT_TIMESTAMP_TYPECODE, [to_timestamp(moment) for moment, _ in loaded])
+		self._name_ = slots['_name_']
+
+def _load_dependency(names: List[str], times: bytes, name: Optional[str]) -> Dependency:
+	var_ids = VAR_IDS.id
+	timestamps = array(DEFAULT_TIMESTAMP_TYPECODE)
+	timestamps.frombytes(times)
+
+	return Dependency.from_arrays(
+		array(DEFAULT_VAR_ID_TYPECODE, [var_ids(varname) for varname in names]),
+		timestamps,
+		name
+	)
+
+def _last_load(dependency: Dependency) -> int:
+	return dependency._times_[-1] if dependency._times_ else -1
+
+class Packed_depsgraph(NamedTuple):
+	"""A depsgraph as flat arrays, in compressed sparse row layout.
+	The loaded variables of dependency i are dep_vars[dep_offsets[i]:dep_offsets[i+1]],
+	and the dependencies of graph_vars[j] are graph_deps[graph_offsets[j]:graph_offsets[j+1]]
+	"""
+	# Variable names, indexed by the ids in dep_vars and graph_vars
+	names: List[str]
+	dep_names: List[Optional[str]]
+	dep_offsets: bytes
+	dep_vars: bytes
+	dep_times: bytes
+	graph_vars: bytes
+	graph_offsets: bytes
+	graph_deps: bytes
+	# One byte per entry of graph_deps, 1 if that dependency stored the variable.
+	# Empty in graphs packed before it was kept
+	graph_stored: bytes = b''
+
+def _remap(var_ids: array, table: array) -> array:
+	"""Translate every id through a table
+	"""
+	if(use_numpy and var_ids):
+		remapped = numpy.frombuffer(table, numpy.int32)[numpy.frombuffer(var_ids, numpy.int32)]
+		return array(DEFAULT_VAR_ID_TYPECODE, remapped.tobytes())
+
+	return array(DEFAULT_VAR_ID_TYPECODE, [table[var_id] for var_id in var_ids])
+
+def pack_depsgraph(graph: Dict[str, Set[Dependency]], stored: Dict[str, Set[Dependency]]) -> Packed_depsgraph:
+	"""Flatten a depsgraph into arrays, so it pickles as a few buffers
+	instead of an object per dependency and a tuple per loaded variable
+
+	Args:
+		graph (Dict[str, Set[Dependency]]): Variable -> the dependencies of the scopes that loaded or stored it
+		stored (Dict[str, Set[Dependency]]): Variable -> the dependencies of the scopes that stored it
+	"""
+	dependencies: Dict[int, int] = dict()
+	dep_names: List[Optional[str]] = list()
+	dep_offsets = array(DEFAULT_OFFSET_TYPECODE, (0,))
+	dep_vars = array(DEFAULT_VAR_ID_TYPECODE)
+	dep_times = array(DEFAULT_TIMESTAMP_TYPECODE)
+
+	graph_vars = array(DEFAULT_VAR_ID_TYPECODE)
+	graph_offsets = array(DEFAULT_OFFSET_TYPECODE, (0,))
+	graph_deps = array(DEFAULT_VAR_ID_TYPECODE)
+	graph_stored = bytearray()
+
+	for varname, var_deps in graph.items():
+		graph_vars.append(VAR_IDS.id(varname))
+		var_stored = stored.get(varname, ())
+		for dependency in var_deps:
+			dep_i = dependencies.get(id(dependency))
+			if(dep_i is None):
+				dep_i = dependencies[id(dependency)] = len(dep_names)
+				dep_names.append(dependency._name_)
+				dep_vars.extend(dependency._var_ids_)
+				dep_times.extend(dependency._times_)
+				dep_offsets.append(len(dep_vars))
+			graph_deps.append(dep_i)
+			graph_stored.append(dependency in var_stored)
+		graph_offsets.append(len(graph_deps))
+
+	# Only the names in this graph are stored, with ids from 0
+	table = array(DEFAULT_VAR_ID_TYPECODE, repeat(-1, len(VAR_IDS)))
+	names: List[str] = list()
+	for var_id in chain(graph_vars, dep_vars):
+		if(table[var_id] == -1):
+			table[var_id] = len(names)
+			names.append(VAR_IDS.name(var_id))
+
+	return Packed_depsgraph(
+		names,
+		dep_names,
+		dep_offsets.tobytes(),
+		_remap(dep_vars, table).tobytes(),
+		dep_times.tobytes(),
+		_remap(graph_vars, table).tobytes(),
+		graph_offsets.tobytes(),
+		graph_deps.tobytes(),
+		bytes(graph_stored),
+	)
+
+def unpack_depsgraph(packed: Packed_depsgraph) -> Tuple[Dict[str, Set[Dependency]], Optional[Dict[str, Set[Dependency]]]]:
+	"""Rebuild a depsgraph packed by pack_depsgraph
+
+	Returns:
+		Tuple[Dict[str, Set[Dependency]], Optional[Dict[str, Set[Dependency]]]]: The depsgraph, and the
+			dependencies of the scopes that stored each variable. None if the graph was packed without them
+	"""
+	def load(typecode: str, data: bytes) -> array:
+		loaded = array(typecode)
+		loaded.frombytes(data)
+		return loaded
+
+	table = array(DEFAULT_VAR_ID_TYPECODE, [VAR_IDS.id(varname) for varname in packed.names])
+
+	dep_offsets = load(DEFAULT_OFFSET_TYPECODE, packed.dep_offsets)
+	dep_vars = _remap(load(DEFAULT_VAR_ID_TYPECODE, packed.dep_vars), table)
+	dep_times = load(DEFAULT_TIMESTAMP_TYPECODE, packed.dep_times)
+
+	dependencies = [
+		Dependency.from_arrays(
+			dep_vars[dep_offsets[dep_i]:dep_offsets[dep_i+1]],
+			dep_times[dep_offsets[dep_i]:dep_offsets[dep_i+1]],
+			name
+		)
+		for dep_i, name in enumerate(packed.dep_names)
+	]
+
+	graph_vars = load(DEFAULT_VAR_ID_TYPECODE, packed.graph_vars)
+	graph_offsets = load(DEFAULT_OFFSET_TYPECODE, packed.graph_offsets)
+	graph_deps = load(DEFAULT_VAR_ID_TYPECODE, packed.graph_deps)
+
+	graph = {
+		packed.names[var_i]: {
+			dependencies[dep_i]
+			for dep_i in graph_deps[graph_offsets[var_n]:graph_offsets[var_n+1]]
+		}
+		for var_n, var_i in enumerate(graph_vars)
+	}
+
+	if(len(packed.graph_stored) != len(graph_deps)):
+		return graph, None
+
+	stored: Dict[str, Set[Dependency]] = dict()
+	for var_n, var_i in enumerate(graph_vars):
+		start, end = graph_offsets[var_n], graph_offsets[var_n+1]
+		var_stored = {
+			dependencies[dep_i]
+			for dep_i, is_stored in zip(graph_deps[start:end], packed.graph_stored[start:end])
+			if is_stored
+		}
+		if(var_stored):
+			stored[packed.names[var_i]] = var_stored
+
+	return graph, stored
+
+class Depsgraph_checkpoint(NamedTuple):
+	graph: Union[Packed_depsgraph, Dict[str, Set[Dependency]]]
+	# Id of the log of the scopes closed after the checkpoint
+	log_id: str
+	# Seconds the last scope storing each variable took
+	durations: Dict[str, float] = {}
+
+class Scope_frame(NamedTuple):
+	dependency: Dependency
+	stored: Set[str]
+	# perf_counter when the scope started
+	start: float
+
 class Var_depsgraph_scope:
 	_rlocals_: Dict[str, Any]
 	_locked_vars_: Set[str]
 
 	_locked_types_: Set[str]
-	_scope_active_: int
 
-	_dependencies_: List[Dependency]
 	_depsgraph_: Dict[str, Set[Dependency]]
-	_stored_vars_: List[Set[str]]
 
-	_scope_deps_: Dependency=None
-	_scope_stored_: Set[str]=None
+	# The open scopes of each thread and asyncio task, innermost last.
+	# Each push sets a new tuple, so tasks never share a stack with their parent
+	_scope_stack_: ContextVar
+	# Guards the depsgraph, its log and _scope_refs_, shared by every thread
+	_scope_lock_: threading.RLock
+	# Variable -> the number of open scopes, in any thread, that loaded or stored it
+	_scope_refs_: Dict[str, int]
+	# Variables that open scopes put in locals, the only ones removed when they close.
+	# Those already in locals, such as the globals of a notebook, are left alone
+	_scope_owned_: Set[str]
+	_open_scopes_: int
+
+	# Variable -> the variables it was built from, and the reverse.
+	# Built on the first query and kept up to date as scopes close
+	_depsgraph_inputs_: Optional[Dict[str, Set[str]]]
+	_depsgraph_outputs_: Optional[Dict[str, Set[str]]]
+	_depsgraph_durations_: Dict[str, float]
+	# Variable -> the dependencies of the scopes that stored it. The other
+	# dependencies of the variable in the depsgraph only loaded it
+	_depsgraph_stored_: Dict[str, Set[Dependency]]
+	# Scope name -> the dependency of the last scope closed with that name
+	_depsgraph_last_scopes_: Dict[str, Dependency]
 
 	_depsgraph_fname_: str
+	_depsgraph_log_fname_: str
+	_depsgraph_checkpoint_interval_: int
+	_depsgraph_log_id_: Optional[str]
+	_depsgraph_log_records_: int
 
 	_folder_name_: str
 
+	filesystem: object
+	serializer: object
+
 	load_function_args: Callable[[Self, Callable], Dict[str, Any]]
 	store_var: Callable[[Self, Union[type, object, str], Optional[Any]], Any]
 	load_var: Callable[[Self, str], Any]
+	_prefetch_scope: Callable[[Self, Optional[str]], None]
+	preload: Callable[[Self, Iterable[str]], None]
+	_collect_garbage: Callable[[Self, int, Iterable[str]], None]
 
 	def __init__(self, 
 	      		 var_name: str,
@@ -102,16 +415,29 @@ class Var_depsgraph_scope:
 				 depsgraph_filename: str=DEFAULT_DEPSGRAPH_NAME,
 				 *,
 				 locked_types: Set[str]=DEFAULT_LOCKED_TYPES,
+				 depsgraph_checkpoint_interval: int=DEFAULT_DEPSGRAPH_CHECKPOINT_INTERVAL,
 				 **kwargs,
 				) -> None:
-		self._scope_active_ = 0
 		self._locked_types_ = locked_types
 		self._locked_vars_ = set()
 
-		self._dependencies_ = list()
-		self._stored_vars_ = list()
+		self._scope_stack_ = ContextVar(f"{var_name}_scopes", default=())
+		self._scope_lock_ = threading.RLock()
+		self._scope_refs_ = dict()
+		self._scope_owned_ = set()
+		self._open_scopes_ = 0
+
+		self._depsgraph_inputs_ = None
+		self._depsgraph_outputs_ = None
+		self._depsgraph_durations_ = dict()
+		self._depsgraph_stored_ = dict()
+		self._depsgraph_last_scopes_ = dict()
 
 		self._depsgraph_fname_ = depsgraph_filename
+		self._depsgraph_log_fname_ = f"{depsgraph_filename}{DEFAULT_DEPSGRAPH_LOG_SUFFIX}"
+		self._depsgraph_checkpoint_interval_ = max(1, depsgraph_checkpoint_interval)
+		self._depsgraph_log_id_ = None
+		self._depsgraph_log_records_ = 0
 
 		self.lock(var_name)
 		self.set_locals(locals_)
@@ -124,11 +450,48 @@ class Var_depsgraph_scope:
 		)
 
 		depsgraph = self.load_var(depsgraph_filename)
-		if(depsgraph):
-			self._depsgraph_ = depsgraph
+		stored = None
+		if(isinstance(depsgraph, Depsgraph_checkpoint)):
+			if(isinstance(depsgraph.graph, Packed_depsgraph)):
+				self._depsgraph_, stored = unpack_depsgraph(depsgraph.graph)
+			else:
+				self._depsgraph_ = depsgraph.graph
+			self._depsgraph_durations_ = dict(depsgraph.durations)
+		elif(depsgraph):
+			# Older graphs stored a single Dependency for stored variables
+			self._depsgraph_ = {
+				varname: var_deps if isinstance(var_deps, set) else {var_deps,}
+				for varname, var_deps in depsgraph.items()
+			}
 		else:
 			self._depsgraph_ = dict()
 
+		if(stored is None):
+			# Graphs stored without it. Scopes that did not load a variable stored it
+			stored = dict()
+			for varname, var_deps in self._depsgraph_.items():
+				var_stored = {dependency for dependency in var_deps if varname not in dependency}
+				if(var_stored):
+					stored[varname] = var_stored
+		self._depsgraph_stored_ = stored
+
+		# The checkpoint does not keep the order scopes closed in, the last load tells it
+		for var_deps in self._depsgraph_.values():
+			for dependency in var_deps:
+				name = dependency._name_
+				if(name is None):
+					continue
+				last = self._depsgraph_last_scopes_.get(name)
+				if(last is None or _last_load(dependency) > _last_load(last)):
+					self._depsgraph_last_scopes_[name] = dependency
+
+		if(isinstance(depsgraph, Depsgraph_checkpoint)):
+			self._replay_depsgraph_log(depsgraph.log_id)
+
+		if(self._depsgraph_log_id_ is None):
+			# Graphs from older versions are stored once as a checkpoint
+			self.compact_depsgraph()
+
 	def __call__(self, function: Callable, *, force=False):
 		if(logger.isEnabledFor(DEBUG)):
 			debug(f"[R] {self.__class__.__name__}.__call__()")
@@ -142,6 +505,27 @@ class Var_depsgraph_scope:
 
 		return function
 	
+	@contextmanager
+	def scope(self, scope_name: Optional[str]=None, *, preload: Iterable[str]=()) -> Iterator[Self]:
+		"""Open a named scope, loading the given variables concurrently on entry
+
+		with vv.scope('train', preload=['x', 'y', 'weights']):
+			model.fit(vv.x, vv.y)
+
+		Args:
+			scope_name (Optional[str]): The name of the scope in the depsgraph
+		Kwargs:
+			preload (Iterable[str]): Variables loaded into locals as the scope opens
+		"""
+		self.__enter__(scope_name)
+		try:
+			if(preload):
+				self.preload(preload)
+			yield self
+		finally:
+			self.__exit__()
+
+	@traced
 	def __enter__(self, scope_name: Optional[str]=None, *args: Iterable) -> None:
 		"""This generates a new temporal scope in which any variable loaded/stored
 		from this object will be removed from memory
@@ -162,68 +546,431 @@ class Var_depsgraph_scope:
 		if(logger.isEnabledFor(DEBUG)):
 			debug(f" [i] Added new _added_vars_ set (number {len(self._added_vars_)})")
 
+		self._prefetch_scope(scope_name)
+
+	@traced
 	def __exit__(self, *args: Iterable):
 		if(logger.isEnabledFor(DEBUG)):
 			debug(f"[R] {self.__class__.__name__}.__exit__")
-		for var in self._added_vars_:
-			if(var not in self._locked_vars_ and var in self._rlocals_ and type(self._rlocals_[var]).__name__ not in self._locked_types_):
-				if(logger.isEnabledFor(DEBUG)):
-					debug(f" [i] Removed var \"{var}\" from locals")
-				del self._rlocals_[var]
+		scope_deps = self._scope_deps_
+		scope_stored = self._scope_stored_
+
+		freed_bytes = 0
+		kept: List[str] = list()
+		with self._scope_lock_:
+			for var in self._added_vars_:
+				refs = self._scope_refs_.pop(var, 1) - 1
+				if(refs):
+					# Still used by another open scope
+					self._scope_refs_[var] = refs
+					kept.append(var)
+					continue
 
-		self._pop_scope()
+				if(var not in self._scope_owned_):
+					continue
+				self._scope_owned_.discard(var)
+
+				if(var not in self._locked_vars_ and var in self._rlocals_ and type(self._rlocals_[var]).__name__ not in self._locked_types_):
+					if(logger.isEnabledFor(DEBUG)):
+						debug(f" [i] Removed var \"{var}\" from locals")
+					freed_bytes += value_bytes(self._rlocals_.pop(var))
+
+		duration = self._pop_scope()
 		if(logger.isEnabledFor(DEBUG)):
 			debug(f" [i] Removed _added_vars_ set (number {len(self._added_vars_)+1})")
 
-		gc.collect()
+		self._collect_garbage(freed_bytes, kept)
 
-		self.store_var(self._depsgraph_fname_, self._depsgraph_)
+		self._log_scope(scope_deps, scope_stored, duration)
 
-	def _add_scope(self, scope_name: Optional[str]=None) -> None:
-		self._scope_deps_ = Dependency(name=scope_name)
-		self._scope_stored_ = set()
+	def _add_depsgraph_edges(self, dependency: Dependency, varnames: Iterable[str]) -> None:
+		for varname in varnames:
+			var_deps = self._depsgraph_.get(varname)
+			if(var_deps is None):
+				self._depsgraph_[varname] = {dependency,}
+			else:
+				var_deps.add(dependency)
 
-		self._dependencies_.append(self._scope_deps_)
-		self._stored_vars_.append(self._scope_stored_)
+	def _close_depsgraph_scope(self, dependency: Dependency, stored: Iterable[str], duration: Optional[float]) -> None:
+		"""Add the variables a scope stored to the depsgraph, and its edges to the indexes if they are built
+		"""
+		self._add_depsgraph_edges(dependency, stored)
+		if(dependency._name_ is not None):
+			self._depsgraph_last_scopes_[dependency._name_] = dependency
+		for varname in stored:
+			var_stored = self._depsgraph_stored_.get(varname)
+			if(var_stored is None):
+				self._depsgraph_stored_[varname] = {dependency,}
+			else:
+				var_stored.add(dependency)
 
-		self._scope_active_ += 1
-	
-	def _pop_scope(self) -> None:
-		for stored_var in self._scope_stored_:
-			var_deps = self._depsgraph_.get(stored_var)
-			if(var_deps is None):
-				self._depsgraph_[stored_var] = self._scope_deps_
+		if(duration is not None):
+			for varname in stored:
+				self._depsgraph_durations_[varname] = duration
+
+		if(self._depsgraph_inputs_ is not None):
+			self._index_depsgraph_edges(dependency.names(), stored)
+
+	def _index_depsgraph_edges(self, loaded: Iterable[str], stored: Iterable[str]) -> None:
+		loaded = set(loaded)
+		for varname in stored:
+			# Variables updated from themselves are not cycles
+			var_inputs = loaded - {varname,}
+			if(not var_inputs):
+				continue
+
+			self._depsgraph_inputs_.setdefault(varname, set()).update(var_inputs)
+			for input_name in var_inputs:
+				self._depsgraph_outputs_.setdefault(input_name, set()).add(varname)
+
+	def _depsgraph_index(self) -> Tuple[Dict[str, Set[str]], Dict[str, Set[str]]]:
+		"""Get the variables each one was built from, and those built from each one
+		"""
+		with self._scope_lock_:
+			if(self._depsgraph_inputs_ is None):
+				self._depsgraph_inputs_ = dict()
+				self._depsgraph_outputs_ = dict()
+
+				for varname, var_stored in self._depsgraph_stored_.items():
+					for dependency in var_stored:
+						self._index_depsgraph_edges(dependency.names(), (varname,))
+
+				if(logger.isEnabledFor(DEBUG)):
+					debug(f" [i] Indexed {sum(map(len, self._depsgraph_inputs_.values()))} depsgraph edges")
+
+			return self._depsgraph_inputs_, self._depsgraph_outputs_
+
+	def _reachable(self, varnames: Iterable[str], edges: Dict[str, Set[str]]) -> Set[str]:
+		reached: Set[str] = set()
+		pending = list(varnames)
+		while(pending):
+			for next_name in edges.get(pending.pop(), ()):
+				if(next_name not in reached):
+					reached.add(next_name)
+					pending.append(next_name)
+		return reached
+
+	def ancestors(self, varname: str) -> Set[str]:
+		"""Get the variables a variable was built from, directly or through others
+
+		Args:
+			varname (str): The name of the variable
+
+		Returns:
+			Set[str]: The names of the variables, without the given one unless it is in a cycle
+		"""
+		with self._scope_lock_:
+			inputs, _ = self._depsgraph_index()
+			return self._reachable((varname,), inputs)
+
+	def descendants(self, varname: str) -> Set[str]:
+		"""Get the variables built from a variable, directly or through others
+
+		Args:
+			varname (str): The name of the variable
+
+		Returns:
+			Set[str]: The names of the variables, without the given one unless it is in a cycle
+		"""
+		with self._scope_lock_:
+			_, outputs = self._depsgraph_index()
+			return self._reachable((varname,), outputs)
+
+	def strongly_connected_components(self, varnames: Optional[Iterable[str]]=None) -> List[List[str]]:
+		"""Get the groups of variables built from each other, each one in a cycle
+		with the rest of its group, or alone
+
+		Args:
+			varnames (Optional[Iterable[str]]): Only these variables and their ancestors.
+				Defaults to the whole depsgraph
+
+		Returns:
+			List[List[str]]: The groups, each one after the groups it was built from
+		"""
+		with self._scope_lock_:
+			inputs, outputs = self._depsgraph_index()
+			if(varnames is None):
+				nodes = set(self._depsgraph_).union(inputs, outputs)
 			else:
-				var_deps.update(self._scope_stored_)
-			
-		self._dependencies_.pop()
-		self._stored_vars_.pop()
+				varnames = list(varnames)
+				nodes = self._reachable(varnames, inputs).union(varnames)
 
-		self._scope_active_ -= 1
-		if(not self._scope_active_):
-			self._scope_deps_ = None
-			self._scope_stored_ = None
+			# Tarjan's algorithm, without recursion for long chains of steps.
+			# Walking inputs, each component is found after those it was built from
+			index: Dict[str, int] = dict()
+			lowlink: Dict[str, int] = dict()
+			stack: List[str] = list()
+			on_stack: Set[str] = set()
+			components: List[List[str]] = list()
 
-	def add_loaded_var(self, varname: str) -> None:
-		if(True or varname in self._scope_stored_):
+			for root in sorted(nodes):
+				if(root in index):
+					continue
+
+				index[root] = lowlink[root] = len(index)
+				stack.append(root)
+				on_stack.add(root)
+				work: List[Tuple[str, Iterator[str]]] = [(root, iter(sorted(inputs.get(root, ()))))]
+				while(work):
+					varname, var_inputs = work[-1]
+
+					for input_name in var_inputs:
+						if(input_name not in index):
+							index[input_name] = lowlink[input_name] = len(index)
+							stack.append(input_name)
+							on_stack.add(input_name)
+							work.append((input_name, iter(sorted(inputs.get(input_name, ())))))
+							break
+						if(input_name in on_stack):
+							lowlink[varname] = min(lowlink[varname], index[input_name])
+					else:
+						work.pop()
+						if(work):
+							parent = work[-1][0]
+							lowlink[parent] = min(lowlink[parent], lowlink[varname])
+
+						if(lowlink[varname] == index[varname]):
+							component: List[str] = list()
+							while(True):
+								member = stack.pop()
+								on_stack.discard(member)
+								component.append(member)
+								if(member == varname):
+									break
+							components.append(sorted(component))
+
+			return components
+
+	def topological_order(self, varnames: Optional[Iterable[str]]=None) -> List[str]:
+		"""Get an order to rebuild variables in, where each one goes after those it was built from.
+		Variables built from each other go together
+
+		vv.topological_order(['model', 'report'])
+
+		Args:
+			varnames (Optional[Iterable[str]]): Only these variables and their ancestors.
+				Defaults to the whole depsgraph
+
+		Returns:
+			List[str]: The names of the variables
+		"""
+		return [
+			varname
+			for component in self.strongly_connected_components(varnames)
+			for varname in component
+		]
+
+	def critical_path(self, varnames: Optional[Iterable[str]]=None) -> Tuple[List[str], float]:
+		"""Get the chain of variables that takes the longest to rebuild, adding up
+		the time the last scope storing each one took.
+		Edges between variables built from each other are not followed
+
+		Args:
+			varnames (Optional[Iterable[str]]): Only these variables and their ancestors.
+				Defaults to the whole depsgraph
+
+		Returns:
+			Tuple[List[str], float]: The variables in the path, inputs first, and its duration in seconds
+		"""
+		with self._scope_lock_:
+			inputs, _ = self._depsgraph_index()
+			durations = self._depsgraph_durations_
+
+			components = self.strongly_connected_components(varnames)
+			component_of: Dict[str, int] = {
+				varname: component_i
+				for component_i, component in enumerate(components)
+				for varname in component
+			}
+
+			# Longest path ending at each variable, and the variable before it
+			path_time: Dict[str, float] = dict()
+			previous: Dict[str, Optional[str]] = dict()
+			for component_i, component in enumerate(components):
+				for varname in component:
+					best_input = max(
+						(
+							input_name
+							for input_name in inputs.get(varname, ())
+							if component_of.get(input_name, component_i) != component_i
+						),
+						key=path_time.__getitem__,
+						default=None
+					)
+					previous[varname] = best_input
+					path_time[varname] = durations.get(varname, 0.) + (0. if best_input is None else path_time[best_input])
+
+			if(not path_time):
+				return list(), 0.
+
+			varname = max(path_time, key=path_time.__getitem__)
+			total = path_time[varname]
+			path: List[str] = list()
+			while(varname is not None):
+				path.append(varname)
+				varname = previous[varname]
+
+			return path[::-1], total
+
+	def _replay_depsgraph_log(self, log_id: str) -> None:
+		"""Add to the depsgraph the scopes closed after its checkpoint
+		"""
+		self._depsgraph_log_id_ = log_id
+
+		log_path = f"{self._folder_name_}/{self._depsgraph_log_fname_}"
+		if(log_path not in self.filesystem):
 			return
-	
-		var_deps = self._depsgraph_.get(varname)
-		if(var_deps is None):
-			self._scope_deps_.add(varname)
 
-			self._depsgraph_[varname] = {self._scope_deps_,}
-		else:
-			for d in var_deps:
-				if(varname in d):
+		with self.filesystem.open(log_path, self.filesystem.READ_BINARY) as f:
+			try:
+				if(self.serializer.load(f) != log_id):
+					# The log was already compacted into the checkpoint
 					return
-				
-			self._scope_deps_.add(varname)
 
-			var_deps.add(self._scope_deps_)
+				while(True):
+					record = self.serializer.load(f)
+
+					duration = None
+					if(len(record) == 3):
+						# Records with a (datetime, varname) tuple per loaded variable
+						name, loaded, stored = record
+						dependency = Dependency(loaded, name)
+					else:
+						name, loaded_names, times, stored, *duration = record
+						dependency = _load_dependency(loaded_names, times, name)
+						duration = duration[0] if duration else None
+
+					self._add_depsgraph_edges(dependency, dependency.names())
+					self._close_depsgraph_scope(dependency, stored, duration)
+					self._depsgraph_log_records_ += 1
+			except (EOFError, self.serializer.UnpicklingError):
+				# End of the log, or a record cut by a crash
+				pass
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] Replayed {self._depsgraph_log_records_} scopes from the depsgraph log")
+
+	def _log_scope(self, dependency: Dependency, stored: Set[str], duration: float) -> None:
+		"""Append a closed scope to the depsgraph log, instead of storing the whole graph.
+		The log is compacted into the checkpoint once it is long enough and no scope is open
+		"""
+		with self._scope_lock_:
+			if(not self._open_scopes_ and self._depsgraph_log_records_ >= self._depsgraph_checkpoint_interval_):
+				# The closed scope is already in the graph, so it is in the checkpoint
+				self.compact_depsgraph()
+				return
+
+			with self.filesystem.open(f"{self._folder_name_}/{self._depsgraph_log_fname_}", self.filesystem.APPEND_BINARY) as f:
+				self.serializer.dump((dependency._name_, dependency.names(), dependency._times_.tobytes(), tuple(stored), duration), f)
+			self._depsgraph_log_records_ += 1
+
+	@traced
+	def compact_depsgraph(self) -> None:
+		"""Store the whole depsgraph as a checkpoint and start an empty log.
+		The log id only changes once the checkpoint is stored, so a crash
+		in between never replays a log already in the checkpoint
+		"""
+		log_id = uuid.uuid4().hex
+		with self._scope_lock_:
+			self.store_var(self._depsgraph_fname_, Depsgraph_checkpoint(
+				pack_depsgraph(self._depsgraph_, self._depsgraph_stored_),
+				log_id,
+				self._depsgraph_durations_
+			))
+
+			with self.filesystem.open(f"{self._folder_name_}/{self._depsgraph_log_fname_}", self.filesystem.WRITE_BINARY) as f:
+				self.serializer.dump(log_id, f)
+
+			self._depsgraph_log_id_ = log_id
+			self._depsgraph_log_records_ = 0
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] Compacted the depsgraph into \"{self._depsgraph_fname_}\"")
+
+	@property
+	def _scope_active_(self) -> int:
+		return len(self._scope_stack_.get())
+
+	@property
+	def _scope_deps_(self) -> Optional[Dependency]:
+		frames = self._scope_stack_.get()
+		return frames[-1].dependency if frames else None
+
+	@property
+	def _scope_stored_(self) -> Optional[Set[str]]:
+		frames = self._scope_stack_.get()
+		return frames[-1].stored if frames else None
+
+	@property
+	def _dependencies_(self) -> List[Dependency]:
+		return [frame.dependency for frame in self._scope_stack_.get()]
+
+	@property
+	def _stored_vars_(self) -> List[Set[str]]:
+		return [frame.stored for frame in self._scope_stack_.get()]
+
+	def _add_scope(self, scope_name: Optional[str]=None) -> None:
+		self._scope_stack_.set((
+			*self._scope_stack_.get(),
+			Scope_frame(Dependency(name=scope_name), set(), perf_counter()),
+		))
+
+		with self._scope_lock_:
+			self._open_scopes_ += 1
+	
+	def _pop_scope(self) -> float:
+		"""Close the innermost scope of this thread or task
+
+		Returns:
+			float: The seconds the scope was open
+		"""
+		frames = self._scope_stack_.get()
+		self._scope_stack_.set(frames[:-1])
+
+		dependency, stored, start = frames[-1]
+		duration = perf_counter() - start
+
+		with self._scope_lock_:
+			self._open_scopes_ -= 1
+			self._close_depsgraph_scope(dependency, stored, duration)
+
+		return duration
+
+	def add_loaded_var(self, varname: str) -> None:
+		dependency, stored, _ = self._scope_stack_.get()[-1]
+		# Preload threads add to the scope that started them
+		with self._scope_lock_:
+			if(varname in stored or varname in dependency):
+				return
+
+			dependency.add(varname)
+
+			self._scope_refs_[varname] = self._scope_refs_.get(varname, 0) + 1
+
+			var_deps = self._depsgraph_.get(varname)
+			if(var_deps is None):
+				self._depsgraph_[varname] = {dependency,}
+			else:
+				var_deps.add(dependency)
+
+	def _set_scope_local(self, varname: str, value: Any) -> None:
+		"""Put a loaded or stored variable in locals. Inside a scope, it is removed
+		when the last scope using it closes
+		"""
+		self._rlocals_[varname] = value
+		if(self._scope_active_):
+			with self._scope_lock_:
+				self._scope_owned_.add(varname)
 
 	def add_stored_var(self, varname: str) -> None:
-		self._scope_stored_.add(varname)
+		dependency, stored, _ = self._scope_stack_.get()[-1]
+		with self._scope_lock_:
+			if(varname in stored):
+				return
+
+			stored.add(varname)
+			if(varname not in dependency):
+				self._scope_refs_[varname] = self._scope_refs_.get(varname, 0) + 1
 
 	def get_scope_dependencies(self, name: Optional[str]=None) -> Dependency:
 		deps = Dependency
@@ -237,11 +984,13 @@ class Var_depsgraph_scope:
 	def empty_scope(self) -> None:
 		"""Empty scope clears the data in locals, that is, all variables set
 		"""
+		freed_bytes = 0
 		for var, t in {k:type(v).__name__ for k,v in self._rlocals_.items()}.items():
 			if(var.startswith('_') or var in self._locked_vars_ or t in self._locked_types_): continue
 
-			del self._rlocals_[var]
-		gc.collect()
+			freed_bytes += value_bytes(self._rlocals_.pop(var))
+			self._scope_owned_.discard(var)
+		self._collect_garbage(freed_bytes)
 
 	def set_lock_vars(self, vars: Iterable[str]) -> None:
 		"""set_lock_vars sets all variables not-to-be-removed by empty_scope.
@@ -269,11 +1018,12 @@ class Var_depsgraph_scope:
 		self._rlocals_ = new_locals
 
 	@property
-	def _added_vars_(self) -> Optional[Set[str]]:
-		if(self._scope_active_):
-			return [
-				*self._scope_deps_,
-				*self._scope_stored_,
-			]
-		return -1
+	def _added_vars_(self) -> Set[str]:
+		frames = self._scope_stack_.get()
+		if(frames):
+			return {
+				*frames[-1].dependency.names(),
+				*frames[-1].stored,
+			}
+		return set()
 #
\ No newline at end of file
@@ -0,0 +1,136 @@
+from typing import *
+
+import os
+import re
+import errno
+import shutil
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_SNAPSHOT_FOLDER,\
+	DEFAULT_SNAPSHOT_COPY
+
+from .compatibility import *
+
+logger = getLogger()
+
+def link_tree(src: str, dst: str, *, copy: str=DEFAULT_SNAPSHOT_COPY) -> Tuple[int, int]:
+	"""Recreate a folder sharing the data of its files through hardlinks,
+	so it takes the same time however big the files are
+
+	Args:
+		src (str): The folder to snapshot
+		dst (str): The new folder. It must not exist
+	Kwargs:
+		copy (str): RegEx of the paths, relative to src, that are copied instead,
+			since they are written in place without going through the filesystem
+
+	Returns:
+		Tuple[int, int]: The number of linked and copied files
+	"""
+	copy_re = re.compile(copy)
+
+	linked = 0
+	copied = 0
+	for folder, _, filenames in os.walk(src):
+		rel_folder = os.path.relpath(folder, src)
+		dst_folder = os.path.normpath(os.path.join(dst, rel_folder))
+		os.makedirs(dst_folder)
+
+		for filename in filenames:
+			rel_path = filename if rel_folder == '.' else f"{rel_folder}/{filename}"
+			if(copy_re.search(rel_path.replace(os.sep, '/'))):
+				shutil.copy2(f"{folder}/{filename}", f"{dst_folder}/{filename}")
+				copied += 1
+				continue
+
+			try:
+				os.link(f"{folder}/{filename}", f"{dst_folder}/{filename}")
+				linked += 1
+			except OSError as err:
+				if(err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK)):
+					raise
+				shutil.copy2(f"{folder}/{filename}", f"{dst_folder}/{filename}")
+				copied += 1
+
+	return linked, copied
+
+class Var_snapshots:
+	"""Copy-on-write snapshots of the whole variables folder. Files are shared
+	through hardlinks, and the first write to a shared file breaks the link
+	"""
+	# External variables
+	_folder_name_: str
+	_var_name_: str
+
+	def snapshot_folder(self, name: str) -> str:
+		return DEFAULT_SNAPSHOT_FOLDER.format(folder=self._folder_name_.rstrip('/'), name=name)
+
+	def snapshot(self, name: str) -> str:
+		"""Save the current state of every variable, its steps and history
+		in a new folder, without copying their data
+
+		vv.snapshot('before_cleaning')
+
+		Args:
+			name (str): The name of the snapshot
+
+		Returns:
+			str: The folder of the snapshot, which can be opened as any other variables folder
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.snapshot({name=})")
+
+		folder = self.snapshot_folder(name)
+		if(os.path.exists(folder)):
+			raise FileExistsError(f"Snapshot \"{name}\" already exists in \"{folder}\"")
+
+		linked, copied = link_tree(self._folder_name_, folder)
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Snapshot \"{name}\" in \"{folder}\" shares {linked} files and copied {copied}")
+
+		return folder
+
+	def branch(self, name: str, *, var_name: str=None, locals_: Dict[str, Any]=None, **kwargs) -> Self:
+		"""Snapshot the variables folder and open the snapshot as a new store,
+		to experiment without touching the current variables
+
+		exp = vv.branch('exp1')
+		exp.df = exp.df.dropna()
+
+		Args:
+			name (str): The name of the branch
+		Kwargs:
+			var_name (str): The name of the new store. Defaults to the current one
+			locals_ (Dict[str, Any]): The locals of the new store. Defaults to a new dict
+			**kwargs: Other options of the new store
+
+		Returns:
+			Self: The new store
+		"""
+		folder = self.snapshot(name)
+
+		return self.__class__(
+			self._var_name_ if var_name is None else var_name,
+			dict() if locals_ is None else locals_,
+			folder_name=folder,
+			folder_add_timestamp=False,
+			**kwargs
+		)
+
+	def snapshots(self) -> List[str]:
+		"""Get the names of the snapshots of the variables folder
+		"""
+		prefix = self.snapshot_folder('')
+		parent_folder = os.path.dirname(prefix) or '.'
+		prefix = os.path.basename(prefix)
+
+		return sorted(
+			entry.name[len(prefix):]
+			for entry in os.scandir(parent_folder)
+			if entry.is_dir() and entry.name.startswith(prefix) and len(entry.name) > len(prefix)
+		)
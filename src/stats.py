@@ -0,0 +1,254 @@
+from typing import *
+
+import io
+import csv
+import json
+import threading
+
+from bisect import bisect_left
+
+from logging import debug,\
+	DEBUG,\
+	getLogger
+
+from .defaults import \
+	DEFAULT_IO_STATS,\
+	DEFAULT_IO_STATS_BUCKETS
+
+from .compatibility import *
+
+logger = getLogger()
+
+# Kinds of timed operations, each with its own histogram
+IO_TIMINGS: Final[Tuple[str, ...]] = ('serialize', 'deserialize', 'read', 'write')
+
+class Var_io_stats(NamedTuple):
+	varname: str
+	loads: int
+	stores: int
+	# Loads served from memory or from the prefetcher
+	hits: int
+	bytes_read: int
+	bytes_written: int
+	# Total seconds of each kind of operation
+	serialize_time: float
+	deserialize_time: float
+	read_time: float
+	write_time: float
+	# Operations of each kind per latency bucket, as in DEFAULT_IO_STATS_BUCKETS
+	histograms: Dict[str, Tuple[int, ...]]
+
+	@property
+	def io_time(self) -> float:
+		return self.serialize_time + self.deserialize_time + self.read_time + self.write_time
+
+class _Var_counters:
+	__slots__ = ['loads', 'stores', 'hits', 'bytes_read', 'bytes_written', 'times', 'histograms']
+
+	loads: int
+	stores: int
+	hits: int
+	bytes_read: int
+	bytes_written: int
+	times: Dict[str, float]
+	histograms: Dict[str, List[int]]
+
+	def __init__(self, n_buckets: int) -> None:
+		self.loads = 0
+		self.stores = 0
+		self.hits = 0
+		self.bytes_read = 0
+		self.bytes_written = 0
+		self.times = dict.fromkeys(IO_TIMINGS, 0.)
+		self.histograms = {
+			timing: [0] * n_buckets
+			for timing in IO_TIMINGS
+		}
+
+class Io_stats:
+	"""Loads, stores, cache hits, bytes and latency histograms of every variable.
+	Disabled, the storager skips it entirely and loads stream from the file as usual.
+	Enabled, files are read and written whole, to time the filesystem apart from the serializer
+
+	vv.stats.enable()
+	vv.stats('read_time')[:10]
+	vv.stats(format='csv', file='io.csv')
+	vv.stats.reset()
+	"""
+	_vars_: Dict[str, _Var_counters]
+	_buckets_: Tuple[float, ...]
+	_enabled_: bool
+	_lock_: threading.Lock
+	# Called with whether the stats are enabled, to attach them to the storager
+	_on_toggle_: Callable[[bool], None]
+
+	def __init__(self,
+			  	 on_toggle: Callable[[bool], None],
+				 *,
+				 enabled: bool=DEFAULT_IO_STATS,
+				 buckets: Tuple[float, ...]=DEFAULT_IO_STATS_BUCKETS
+			) -> None:
+		self._vars_ = dict()
+		self._buckets_ = tuple(buckets)
+		self._lock_ = threading.Lock()
+		self._on_toggle_ = on_toggle
+		self._enabled_ = enabled
+
+	@property
+	def enabled(self) -> bool:
+		return self._enabled_
+
+	def enable(self) -> None:
+		self._enabled_ = True
+		self._on_toggle_(True)
+
+	def disable(self) -> None:
+		"""Stop collecting. The stats collected so far are kept until reset
+		"""
+		self._enabled_ = False
+		self._on_toggle_(False)
+
+	def reset(self) -> None:
+		with self._lock_:
+			self._vars_.clear()
+
+	def _counters(self, varname: str) -> _Var_counters:
+		counters = self._vars_.get(varname)
+		if(counters is None):
+			counters = self._vars_[varname] = _Var_counters(len(self._buckets_) + 1)
+		return counters
+
+	def _time(self, counters: _Var_counters, timing: str, seconds: float) -> None:
+		counters.times[timing] += seconds
+		counters.histograms[timing][bisect_left(self._buckets_, seconds)] += 1
+
+	def record_load(self, varname: str, size: int, read_time: float, deserialize_time: float) -> None:
+		with self._lock_:
+			counters = self._counters(varname)
+			counters.loads += 1
+			counters.bytes_read += size
+			self._time(counters, 'read', read_time)
+			self._time(counters, 'deserialize', deserialize_time)
+
+	def record_store(self, varname: str, size: int, serialize_time: float, write_time: float) -> None:
+		with self._lock_:
+			counters = self._counters(varname)
+			counters.stores += 1
+			counters.bytes_written += size
+			self._time(counters, 'serialize', serialize_time)
+			self._time(counters, 'write', write_time)
+
+	def record_hit(self, varname: str) -> None:
+		with self._lock_:
+			self._counters(varname).hits += 1
+
+	def __call__(self,
+			  	 sort_by: str='io_time',
+				 *,
+				 reverse: bool=True,
+				 format: Optional[str]=None,
+				 file: Optional[str]=None
+			) -> Union[List[Var_io_stats], str]:
+		"""Get the stats of every variable
+
+		Args:
+			sort_by (str): The field of Var_io_stats to sort by, or "io_time" for the total time
+		Kwargs:
+			reverse (bool): Whether the biggest values go first
+			format (Optional[str]): Either "csv" or "json" to export the stats as text
+			file (Optional[str]): A path to also write the exported text to
+
+		Returns:
+			Union[List[Var_io_stats], str]: The stats, or their export if a format was given
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.__call__({sort_by=}, {format=})")
+
+		with self._lock_:
+			rows = [
+				Var_io_stats(
+					varname,
+					counters.loads,
+					counters.stores,
+					counters.hits,
+					counters.bytes_read,
+					counters.bytes_written,
+					counters.times['serialize'],
+					counters.times['deserialize'],
+					counters.times['read'],
+					counters.times['write'],
+					{
+						timing: tuple(histogram)
+						for timing, histogram in counters.histograms.items()
+					},
+				)
+				for varname, counters in self._vars_.items()
+			]
+
+		rows.sort(key=lambda row: getattr(row, sort_by), reverse=reverse)
+
+		if(format is None):
+			return rows
+
+		if(format == 'json'):
+			text = json.dumps(
+				{
+					'buckets': self._buckets_,
+					'vars': [
+						dict(row._asdict(), io_time=row.io_time)
+						for row in rows
+					],
+				},
+				indent='\t'
+			)
+		elif(format == 'csv'):
+			text_io = io.StringIO()
+			writer = csv.writer(text_io)
+
+			bucket_names = [f"le_{bucket:g}s" for bucket in self._buckets_] + ['inf']
+			writer.writerow([
+				*Var_io_stats._fields[:-1],
+				'io_time',
+				*(
+					f"{timing}_{bucket_name}"
+					for timing in IO_TIMINGS
+					for bucket_name in bucket_names
+				),
+			])
+			for row in rows:
+				writer.writerow([
+					*row[:-1],
+					row.io_time,
+					*(
+						count
+						for timing in IO_TIMINGS
+						for count in row.histograms[timing]
+					),
+				])
+			text = text_io.getvalue()
+		else:
+			raise ValueError(f"Unknown stats format \"{format}\", use \"csv\" or \"json\"")
+
+		if(file is not None):
+			with open(file, 'w') as f:
+				f.write(text)
+
+		return text
+
+class Var_stats:
+	"""Per-variable I/O statistics, off by default, in vv.stats
+	"""
+	stats: Io_stats
+	# The stats the storager and loads report to, or None while disabled
+	_io_stats_: Optional[Io_stats] = None
+
+	# External variables
+	storager: object
+
+	def __init__(self, io_stats: bool=DEFAULT_IO_STATS, **kwargs) -> None:
+		self.stats = Io_stats(self._attach_io_stats, enabled=io_stats)
+		self._attach_io_stats(io_stats)
+
+	def _attach_io_stats(self, enabled: bool) -> None:
+		self._io_stats_ = self.stats if enabled else None
+		self.storager._io_stats_ = self._io_stats_
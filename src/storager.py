@@ -26,14 +26,17 @@ from logging import debug, info, warn,\
 
 from .storagers import storagers, Base_storager, ForbiddenMethodException
 from .file_systems import filesystems
+from .file_systems.sharding import migrate_layout
 from .serializers import serializers
 from .version_controllers import version_controllers
+from .tracing import traced
 
 from .defaults import \
 	DEFAULT_STORAGER, \
 	DEFAULT_SERIALIZER, \
 	DEFAULT_FILESYSTEM, \
 	DEFAULT_VERSION_CONTROLLER, \
+	DEFAULT_LAYOUT, \
 	DEFAULT_KEY
 
 logger = getLogger()
@@ -54,6 +57,11 @@ class Var_storager:
 	_available_version_controllers_: Dict[str, object] = version_controllers
 	_enabled_version_controllers_: Dict[str, object]
 
+	_storager_name_: str
+	_serializer_name_: str
+	_filesystem_name_: str
+	_version_controller_name_: str
+
 	# External variables
 	_folder_name_: str
 	_var_name_: str
@@ -63,14 +71,17 @@ class Var_storager:
 	_version_controller_vars_: Set[str]
 
 	_scope_active_: int
+	_io_stats_: Optional[object]
 
-	add_loaded_var: Callable[[Self, str], None]
+	_load_vars: Callable[[Self, Iterable[str]], Iterator[Tuple[str, Any]]]
+	_invalidate_prefetch: Callable[[Self, str], None]
 
 	def __init__(self,
 			  	 chosen_storager: str=None,
 				 chosen_serializer: str=None,
 				 chosen_filesystem: str=None,
 				 chosen_version_controller: str=None,
+				 layout: str=None,
 	      		 **kwargs,
 				) -> None:
 		if(logger.isEnabledFor(DEBUG)):
@@ -104,8 +115,15 @@ class Var_storager:
 				chosen_version_controller = config_data['VERSION_CONTROLLER']
 				if(logger.isEnabledFor(INFO)):
 					info(f"[i] Set version_controller to previously configured \"{chosen_version_controller}\"")
+			if(layout is None and 'LAYOUT' in config_data):
+				layout = config_data['LAYOUT']
+				if(logger.isEnabledFor(INFO)):
+					info(f"[i] Set layout to previously configured \"{layout}\"")
+
+		if(layout is None):
+			layout = DEFAULT_LAYOUT
 
-		serializer_name = \
+		self._serializer_name_ = serializer_name = \
 			chosen_serializer \
 			if chosen_serializer in self._available_serializers_ \
 			else DEFAULT_SERIALIZER
@@ -114,16 +132,17 @@ class Var_storager:
 			**kwargs
 		)
 
-		filesystem_name = \
+		self._filesystem_name_ = filesystem_name = \
 			chosen_filesystem \
 			if chosen_filesystem in self._available_filesystems_ \
 			else DEFAULT_FILESYSTEM
 		self.filesystem = filesystem = self._available_filesystems_[filesystem_name](
 			parent=self,
+			layout=layout,
 			**kwargs
 		)
 
-		version_controller_name = \
+		self._version_controller_name_ = version_controller_name = \
 			chosen_version_controller \
 			if chosen_version_controller in self._available_version_controllers_ \
 			else DEFAULT_VERSION_CONTROLLER
@@ -132,7 +151,7 @@ class Var_storager:
 			**kwargs
 		)
 
-		storager_name = \
+		self._storager_name_ = storager_name = \
 			chosen_storager \
 			if chosen_storager in self._available_storagers_ \
 			else DEFAULT_STORAGER
@@ -156,15 +175,46 @@ class Var_storager:
 			version_controller_name=version_controller
 		)
 
+		self._write_config()
+
+	def _write_config(self) -> None:
 		config_text = f"""
-			STORAGER={storager_name}
-			SERIALIZER={serializer_name}
-			FILESYSTEM={filesystem_name}
-			VERSION_CONTROLLER={version_controller_name}
+			STORAGER={self._storager_name_}
+			SERIALIZER={self._serializer_name_}
+			FILESYSTEM={self._filesystem_name_}
+			VERSION_CONTROLLER={self._version_controller_name_}
+			LAYOUT={self.filesystem.layout}
 		""".strip().replace(' ','').replace('\t','')
-		with open(config_path, 'w+') as f:
+		with open(f"{self._folder_name_}/.$.config", 'w+') as f:
 			f.write(config_text)
 
+	def set_layout(self, layout: str) -> None:
+		"""Convert in place the variables folder into a new layout, either
+		"flat" (all files in the folder) or "sharded" (files in two-level hash-prefix subfolders,
+		for folders with very many variables)
+
+		Args:
+			layout (str): The new layout
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.set_layout({layout=})")
+
+		filesystem = self.filesystem
+		if(layout == filesystem.layout):
+			return
+
+		moves = migrate_layout(
+			self._folder_name_,
+			layout,
+			shard_exclude=filesystem._shard_exclude_.pattern
+		)
+		filesystem._sharded_ = not filesystem._sharded_
+
+		if(hasattr(self.version_controller, '_relocate_')):
+			self.version_controller._relocate_(moves)
+
+		self._write_config()
+
 	@property
 	def storager(self) -> Base_storager:
 		if(logger.isEnabledFor(DEBUG)):
@@ -180,6 +230,8 @@ class Var_storager:
 		
 		self._storager_vars_.clear()
 		self._storager_ = storager
+		storager._io_stats_ = self._io_stats_
+		storager._on_store_ = self._invalidate_prefetch
 
 		for fnn in dir(storager):
 			if(not fnn.startswith('_') and hasattr(getattr(storager, fnn), '__call__')):
@@ -525,27 +577,49 @@ class Var_storager:
 					break
 		return wrapper
 
+	def function_arg_names(self, 
+						   function: Callable, 
+						   *,
+						   not_load: Iterable[str]=[],
+						   force_load_all: bool=False
+						   ) -> List[str]:
+		"""Get the names of the arguments load_function_args loads for a function
+		"""
+		return [
+			arg
+			for arg, param in signature(function).parameters.items()
+			if force_load_all or not (
+				param.default != _empty or 
+				arg in not_load
+			)
+		]
+
+	@traced
 	def load_function_args(self, 
 						function: Callable, 
 						*,
 						not_load: Iterable[str]=[],
 						force_load_all: bool=False
 						) -> Dict[str, Any]:
-		fn_sig = signature(function)
-
-		arg_values: Dict[str, Any] = dict()
-		for arg, param in fn_sig.parameters.items():
-			if(not force_load_all and (
-					param.default != _empty or 
-					arg in not_load
-				)):
-				continue
-		
-			if(self._scope_active_):
-				self.add_loaded_var(arg)
-			arg_values[arg] = self.load_var(arg)
-		
-		return arg_values
+		"""Load the arguments of a function without a default value from storage, all at once.
+		Values in locals are not used, so steps run on the stored versions
+
+		Args:
+			function (Callable): The function whose arguments are loaded
+		Kwargs:
+			not_load (Iterable[str]): Arguments not to be loaded
+			force_load_all (bool): Whether to also load the arguments with a default value
+
+		Returns:
+			Dict[str, Any]: The value of each argument, in the order of the signature
+		"""
+		arg_names = self.function_arg_names(function, not_load=not_load, force_load_all=force_load_all)
+		arg_values = dict(self._load_vars(arg_names))
+
+		return {
+			arg: arg_values[arg]
+			for arg in arg_names
+		}
 
 	def move_var(self, src_var, target_path, *, folder: str=None) -> None:
 		if(folder is None):
@@ -581,6 +655,8 @@ class Var_storager:
 
 	load_file_step:  Callable[[Self, str, str], Any]
 
+	load_file_steps: Callable[[Self, str, Iterable[str], Iterable[int]], List[Any]]
+
 	step: Callable[[Self, str, bool, int], Any]
 
 	step_load: Callable[[Self, str, str, bool, int,], Any]
@@ -591,4 +667,26 @@ class Var_storager:
 
 	add_new_step: Callable[[Self, str, str, int], None]
 
+	commit_steps: Callable[[Self], Any]
+
+	defer_commits: Callable[[Self], ContextManager]
+
+	prune_objects: Callable[[Self], int]
+
+	set_delta_steps: Callable[[Self, bool], None]
+
+	delta_report: Callable[[Self, str, Iterable[int]], Dict[str, Any]]
+
+	gc_steps: Callable[[Self], Dict[str, Any]]
+
+	get_step_at: Callable[[Self, str, float], Optional[str]]
+
+	set_step_cache: Callable[[Self, bool], None]
+
+	step_cache_stats: Callable[[Self], Dict[str, Union[int, float]]]
+
+	reset_step_cache_stats: Callable[[Self], None]
+
+	clear_step_cache: Callable[[Self], None]
+
 #
\ No newline at end of file
@@ -8,11 +8,14 @@ import os
 
 import pickle
 
+from time import perf_counter
+
 from inspect import getsource
 
 from ..regex import decorators_re
 from ..folder_handler import Var_folder_handler as Folder_handler
 from ..utils import Var_utils as Utils
+from ..tracing import traced
 from ..defaults import DEFAULT_LATEST_SUFFIX, DEFAULT_STEP_SUFFIX
 
 from ..defaults import \
@@ -56,6 +59,11 @@ class Base_storager(Folder_handler, Utils):
 
 	_rlocals_: Dict[str, Any]
 
+	# Set by Var_stats while I/O stats are enabled
+	_io_stats_: Optional[object] = None
+	# Set by Var_prefetcher, called with the name of every stored variable
+	_on_store_: Optional[Callable[[str], None]] = None
+
 	_class_vars_: Set[str] = {'_class_vars_'}
 
 	def __init__(self, 
@@ -190,7 +198,7 @@ class Base_storager(Folder_handler, Utils):
 			debug(f"[R] {self.__class__.__name__}.load_source({fname=}, {extension=})")
 
 		source_file = f"{folder}/{fname}{extension}"
-		if(os.path.exists(source_file)):
+		if(source_file in self._filesystem_):
 			if(logger.isEnabledFor(DEBUG)):
 				debug(f" [i] source file \"{source_file}\" exists")
 			with self._filesystem_.open(source_file, "r") as f:
@@ -203,6 +211,7 @@ class Base_storager(Folder_handler, Utils):
 			return locals().get(load_as or fname, self._rlocals_.get(fname))
 		return None
 
+	@traced
 	def load_var(self, attr: str, *, loaded_refs: Set[str]=set(), folder: str=None, load_as: str=None) -> Any:
 		""" Load a variable in disk given its name
 		This function checks for soruce code (functions / classes) when
@@ -221,7 +230,7 @@ class Base_storager(Folder_handler, Utils):
 		if(logger.isEnabledFor(DEBUG)):
 			debug(f"[R] {self.__class__.__name__}.load_var({attr=})")
 
-		folder_files = os.listdir(folder)
+		folder_files = self._filesystem_.listdir(folder)
 
 		if(self._allowed_base_ and f"{self._prefix_}{attr}{DEFAULT_SUFFIX}" in folder_files):
 			return self._load_base(attr, prefix=self._prefix_, folder=folder, load_as=load_as)
@@ -250,6 +259,50 @@ class Base_storager(Folder_handler, Utils):
 		elif(self._allowed_steps_ and f"{attr}{DEFAULT_STEP_SUFFIX}" in folder_files):
 			return self._load_step(attr, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
 		
+	def get_var_path(self, attr: str, *, loaded_refs: Set[str]=None, folder: str=None) -> Optional[str]:
+		""" Get the path of the serialized file load_var would read for a variable,
+		following references.
+		
+		Args:
+			attr (str): The name of the variable
+				
+		Returns:
+			Optional[str]: The path of the file, or None if the variable is not a plain
+				serialized value (sources, generators, steps) or does not exist
+		"""
+		if(folder is None):
+			folder = self._folder_name_
+		if(loaded_refs is None):
+			loaded_refs = set()
+
+		folder_files = self._filesystem_.listdir(folder)
+
+		if(self._allowed_base_ and f"{self._prefix_}{attr}{DEFAULT_SUFFIX}" in folder_files):
+			return f"{folder}/{self._prefix_}{attr}{DEFAULT_SUFFIX}"
+		
+		elif(self._allowed_base_ and f"{attr}{DEFAULT_SUFFIX}" in folder_files):
+			return f"{folder}/{attr}{DEFAULT_SUFFIX}"
+		
+		elif(self._allowed_source_ and f"{attr}{DEFAULT_SRC_SUFFIX}" in folder_files):
+			return None
+		
+		elif(self._allowed_generator_ and f"{attr}{DEFAULT_GEN_SUFFIX}" in folder_files):
+			return None
+
+		for ref_filename in (f"{self._prefix_}{attr}{DEFAULT_REF_SUFFIX}", f"{attr}{DEFAULT_REF_SUFFIX}"):
+			if(self._allowed_reference_ and ref_filename in folder_files):
+				with self._filesystem_.open(f"{folder}/{ref_filename}", self._filesystem_.READ_TEXT) as f:
+					ref_varname = f.read()
+				
+				if(ref_varname in loaded_refs):
+					raise ValueError(f"Found loop in the references: {loaded_refs}")
+				
+				loaded_refs.add(ref_varname)
+				return self.get_var_path(ref_varname, loaded_refs=loaded_refs, folder=folder)
+
+		return None
+
+	@traced
 	def store_gen(self, attr:Union[type, T, str], value: Union[type, T]=None, *, folder: str=None, load_as: str=None) -> Union[type, T]:
 		"""Store a generator of attr into disk. Works only for functions.
 		It can also be used as a wrapper, that is
@@ -303,6 +356,7 @@ class Base_storager(Folder_handler, Utils):
 		
 		return res
 
+	@traced
 	def store_var(self, attr: Union[type, T, str], value: Union[type, T]=None, *, folder: str=None, load_as: str=None) -> Union[type, T]:
 		"""Store any variable into disk. Works for pickleable objects, functions and classes..
 		For functions and classes, it can also be used as a wrapper, that is
@@ -338,18 +392,32 @@ class Base_storager(Folder_handler, Utils):
 				
 		else:
 			self._store_val(attr, value, folder=folder, load_as=load_as)
+
+		if(self._on_store_ is not None):
+			self._on_store_(attr)
 		
 		return value
 
+	@traced
 	def _load_base(self, attr: str, *, folder: str, prefix: str='', load_as: str=None) -> Any:
 		if(logger.isEnabledFor(INFO)):
 			info(f"Loading binary \"{prefix}{attr}{DEFAULT_SUFFIX}\"")
 		
+		io_stats = self._io_stats_
 		f = None
 		try:
-			f = self._filesystem_.open(f"{folder}/{prefix}{attr}{DEFAULT_SUFFIX}", self._filesystem_.READ_BINARY)
+			if(io_stats is None):
+				f = self._filesystem_.open(f"{folder}/{prefix}{attr}{DEFAULT_SUFFIX}", self._filesystem_.READ_BINARY)
+
+				value = self._serializer_.load(f)
+			else:
+				start = perf_counter()
+				f = self._filesystem_.open(f"{folder}/{prefix}{attr}{DEFAULT_SUFFIX}", self._filesystem_.READ_BINARY)
+				data = f.read()
+				read_end = perf_counter()
 
-			value = self._serializer_.load(f)
+				value = self._serializer_.loads(data)
+				io_stats.record_load(attr, len(data), read_end - start, perf_counter() - read_end)
 		except (AttributeError, self._serializer_.UnpicklingError):
 			value = self.load_source(attr, load_as=load_as)
 
@@ -364,6 +432,7 @@ class Base_storager(Folder_handler, Utils):
 
 		return value
 
+	@traced
 	def _load_src(self, attr: str, *, folder: str, load_as: str=None) -> Any:
 		if(logger.isEnabledFor(INFO)):
 			info(f"Loading source \"{attr}{DEFAULT_SRC_SUFFIX}\"")
@@ -374,6 +443,7 @@ class Base_storager(Folder_handler, Utils):
 
 		return value
 
+	@traced
 	def _load_gen(self, attr: str, *, folder: str, load_as: str=None) -> Any:
 		if(logger.isEnabledFor(INFO)):
 			info(f"Loading generator \"{attr}{DEFAULT_GEN_SUFFIX}\"")
@@ -384,6 +454,7 @@ class Base_storager(Folder_handler, Utils):
 
 		return value()
 
+	@traced
 	def _load_pref_ref(self, attr: str, *, loaded_refs: Set[str], folder: str, prefix: str='', load_as: str=None) -> Any:
 		ref_varname: str
 		with self._filesystem_.open(f"{folder}/{prefix}{attr}{DEFAULT_REF_SUFFIX}", self._filesystem_.READ_TEXT) as f:
@@ -395,6 +466,7 @@ class Base_storager(Folder_handler, Utils):
 		loaded_refs.add(ref_varname)
 		return self.load_var(ref_varname, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
 
+	@traced
 	def _load_ref(self, attr: str, *, loaded_refs: Set[str], folder: str, load_as: str=None) -> Any:
 		ref_varname: str
 		with self._filesystem_.open(f"{folder}/{attr}{DEFAULT_REF_SUFFIX}", self._filesystem_.READ_TEXT) as f:
@@ -406,9 +478,11 @@ class Base_storager(Folder_handler, Utils):
 		loaded_refs.add(ref_varname)
 		return self.load_var(ref_varname, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
 
+	@traced
 	def _load_step(self, attr: str, *, loaded_refs: Set[str], folder: str, prefix: str='', load_as: str=None) -> Any:
 		return self._version_controller_.load_latest_step(attr, folder=folder, loaded_refs=loaded_refs, load_as=load_as, prefix=prefix)
 
+	@traced
 	def _store_fn(self, attr: str, value: Any, *, folder: str, load_as: str=None) -> Any:
 		if(not self._allowed_source_):
 			raise ForbiddenMethodException('Source', self)
@@ -429,6 +503,7 @@ class Base_storager(Folder_handler, Utils):
 
 		return value
 
+	@traced
 	def _store_type(self, attr: str, value: Any, *, folder: str, load_as: str=None) -> Any:
 		if(not self._allowed_source_):
 				raise AttributeError("Source", self)
@@ -444,6 +519,7 @@ class Base_storager(Folder_handler, Utils):
 
 		return value
 
+	@traced
 	def _store_val(self, attr: str, value: Any, *, folder: str, load_as: str=None) -> Any:
 		if(not self._allowed_base_):
 			raise ForbiddenMethodException("Serializing", self)
@@ -453,14 +529,24 @@ class Base_storager(Folder_handler, Utils):
 		
 		if(self._prefix_ and self._prefix_references_):
 			filepath = f"{folder}/{attr}"
-			with self._filesystem_.open(filepath, self._filesystem_.WRITE_CREATE_BINARY) as f:
-				self._serializer_.dump(value, f)
-			
-			ref_filepath = self.set_reference(attr, f"{self._prefix_}{attr}")
 		else:
 			filepath = f"{folder}/{self._prefix_}{attr}"
+
+		io_stats = self._io_stats_
+		if(io_stats is None):
 			with self._filesystem_.open(filepath, self._filesystem_.WRITE_CREATE_BINARY) as f:
 				self._serializer_.dump(value, f)
+		else:
+			start = perf_counter()
+			data = self._serializer_.dumps(value)
+			write_start = perf_counter()
+
+			with self._filesystem_.open(filepath, self._filesystem_.WRITE_CREATE_BINARY) as f:
+				f.write(data)
+			io_stats.record_store(attr, len(data), write_start - start, perf_counter() - write_start)
+
+		if(self._prefix_ and self._prefix_references_):
+			self.set_reference(attr, f"{self._prefix_}{attr}")
 
 		return value
 
@@ -0,0 +1,274 @@
+from typing import *
+
+import os
+import json
+import threading
+import functools
+
+from time import perf_counter_ns, time_ns
+from itertools import count
+from contextvars import ContextVar
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .compatibility import *
+
+logger = getLogger()
+
+class Span(NamedTuple):
+	span_id: int
+	# 0 for spans not nested in another one of the same thread or task
+	parent_id: int
+	name: str
+	# Nanoseconds since the epoch
+	start_ns: int
+	duration_ns: int
+	thread_id: int
+	args: Dict[str, Any]
+
+class Memory_exporter:
+	"""Keeps the finished spans in a list
+	"""
+	spans: List[Span]
+
+	def __init__(self) -> None:
+		self.spans = list()
+
+	def export(self, span: Span) -> None:
+		self.spans.append(span)
+
+	def close(self) -> None:
+		pass
+
+	def totals(self) -> Dict[str, Tuple[int, float, float]]:
+		"""Get the calls, total seconds and self seconds (without nested spans)
+		of each span name, the slowest first
+		"""
+		children_ns: Dict[int, int] = dict()
+		for span in self.spans:
+			if(span.parent_id):
+				children_ns[span.parent_id] = children_ns.get(span.parent_id, 0) + span.duration_ns
+
+		totals: Dict[str, List[int]] = dict()
+		for span in self.spans:
+			name_totals = totals.setdefault(span.name, [0, 0, 0])
+			name_totals[0] += 1
+			name_totals[1] += span.duration_ns
+			name_totals[2] += span.duration_ns - children_ns.get(span.span_id, 0)
+
+		return {
+			name: (calls, total_ns / 1e9, self_ns / 1e9)
+			for name, (calls, total_ns, self_ns) in sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+		}
+
+class Chrome_trace_exporter:
+	"""Writes the spans as Chrome trace events on close, to open the run
+	in chrome://tracing, Perfetto or any viewer of the format
+	"""
+	_path_: str
+	_events_: List[Dict[str, Any]]
+
+	def __init__(self, path: str) -> None:
+		self._path_ = path
+		self._events_ = list()
+
+	def export(self, span: Span) -> None:
+		self._events_.append(dict(
+			name=span.name,
+			ph='X',
+			# Microseconds
+			ts=span.start_ns / 1000,
+			dur=span.duration_ns / 1000,
+			pid=os.getpid(),
+			tid=span.thread_id,
+			args=span.args,
+		))
+
+	def close(self) -> None:
+		with open(self._path_, 'w') as f:
+			json.dump(dict(traceEvents=self._events_, displayTimeUnit='ms'), f, default=repr)
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Wrote {len(self._events_)} trace events to \"{self._path_}\"")
+
+class _Open_span:
+	__slots__ = ['_tracer_', '_name_', '_args_', '_span_id_', '_parent_id_', '_token_', '_start_']
+
+	def __init__(self, tracer: 'Tracer', name: str, args: Dict[str, Any]) -> None:
+		self._tracer_ = tracer
+		self._name_ = name
+		self._args_ = args
+
+	def __enter__(self) -> Self:
+		tracer = self._tracer_
+		self._span_id_ = next(tracer._ids_)
+		self._parent_id_ = tracer._parent_.get()
+		self._token_ = tracer._parent_.set(self._span_id_)
+		self._start_ = perf_counter_ns()
+		return self
+
+	def __exit__(self, exc_type: Optional[type], *args: Iterable) -> None:
+		end = perf_counter_ns()
+		tracer = self._tracer_
+		tracer._parent_.reset(self._token_)
+
+		if(exc_type is not None):
+			self._args_['error'] = exc_type.__name__
+
+		tracer._export(Span(
+			self._span_id_,
+			self._parent_id_,
+			self._name_,
+			tracer._origin_ns_ + self._start_,
+			end - self._start_,
+			threading.get_ident(),
+			self._args_,
+		))
+
+class _No_span:
+	__slots__ = []
+
+	def __enter__(self) -> None:
+		pass
+
+	def __exit__(self, *args: Iterable) -> None:
+		pass
+
+_NO_SPAN: Final[_No_span] = _No_span()
+
+class Tracer:
+	"""Times nested spans and sends each finished one to the exporters
+	"""
+	_exporters_: List[object]
+	_ids_: Iterator[int]
+	# Id of the innermost open span of each thread and asyncio task
+	_parent_: ContextVar
+	# Epoch nanoseconds minus perf_counter_ns, so spans have wall clock starts
+	_origin_ns_: int
+	_lock_: threading.Lock
+
+	def __init__(self, exporters: Iterable[object]) -> None:
+		self._exporters_ = list(exporters)
+		self._ids_ = count(1)
+		self._parent_ = ContextVar('trace_parent', default=0)
+		self._origin_ns_ = time_ns() - perf_counter_ns()
+		self._lock_ = threading.Lock()
+
+	@property
+	def exporters(self) -> List[object]:
+		return self._exporters_
+
+	def span(self, name: str, **args) -> _Open_span:
+		return _Open_span(self, name, args)
+
+	def _export(self, span: Span) -> None:
+		with self._lock_:
+			for exporter in self._exporters_:
+				exporter.export(span)
+
+	def close(self) -> None:
+		with self._lock_:
+			for exporter in self._exporters_:
+				exporter.close()
+
+# The tracer of this process, None while tracing is off
+_tracer: Optional[Tracer] = None
+
+def start_tracing(*exporters: object) -> Tracer:
+	"""Start tracing every store in this process
+
+	Args:
+		*exporters: Objects with export(span) and close(). Defaults to a Memory_exporter
+
+	Returns:
+		Tracer: The new tracer
+	"""
+	global _tracer
+
+	if(_tracer is not None):
+		stop_tracing()
+
+	_tracer = Tracer(exporters or (Memory_exporter(),))
+	return _tracer
+
+def stop_tracing() -> Optional[Tracer]:
+	"""Stop tracing and close the exporters, writing the trace files
+
+	Returns:
+		Optional[Tracer]: The stopped tracer, if tracing was on
+	"""
+	global _tracer
+
+	tracer, _tracer = _tracer, None
+	if(tracer is not None):
+		tracer.close()
+	return tracer
+
+def span(name: str, **args) -> Union[_Open_span, _No_span]:
+	"""Time a block of code while tracing is on
+
+	with span('gc.collect'):
+		gc.collect()
+	"""
+	tracer = _tracer
+	if(tracer is None):
+		return _NO_SPAN
+	return tracer.span(name, **args)
+
+def traced(fn: Callable) -> Callable:
+	"""Time every call to a function while tracing is on, in a span named after it.
+	A string first argument, usually the variable name, is kept in the span
+	"""
+	name = fn.__qualname__
+
+	@functools.wraps(fn)
+	def traced_fn(*args, **kwargs):
+		tracer = _tracer
+		if(tracer is None):
+			return fn(*args, **kwargs)
+
+		span_args: Dict[str, Any] = dict()
+		if(len(args) > 1 and isinstance(args[1], str)):
+			span_args['arg'] = args[1]
+
+		with tracer.span(name, **span_args):
+			return fn(*args, **kwargs)
+
+	return traced_fn
+
+class Var_tracing:
+	"""Spans around loads, stores, steps and scopes, for every store of the process
+
+	vv.start_tracing(Chrome_trace_exporter('run.json'))
+	...
+	vv.stop_tracing()
+	"""
+	def start_tracing(self, *exporters: object) -> Tracer:
+		"""Start tracing loads, stores, steps and scopes
+
+		vv.start_tracing(Chrome_trace_exporter('run.json'))
+
+		Args:
+			*exporters: Objects with export(span) and close(), such as Memory_exporter and
+				Chrome_trace_exporter. Defaults to a Memory_exporter
+
+		Returns:
+			Tracer: The new tracer, with its exporters
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.start_tracing()")
+
+		return start_tracing(*exporters)
+
+	def stop_tracing(self) -> Optional[Tracer]:
+		"""Stop tracing and close the exporters, writing the trace files
+
+		Returns:
+			Optional[Tracer]: The stopped tracer, if tracing was on
+		"""
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}.stop_tracing()")
+
+		return stop_tracing()
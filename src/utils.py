@@ -79,7 +79,7 @@ class Var_utils:
 			if(valid.match(var) and type(var).__name__ == "function"):
 				result[var] = value
 		
-		for var in os.listdir(self._folder_name_):
+		for var in self.filesystem.listdir(self._folder_name_):
 			if(var not in result and valid.match(var) and not os.path.isdir(var)):
 				to_run = self.load_var(var[:-4])
 				
@@ -0,0 +1,90 @@
+from typing import *
+
+import zlib
+import struct
+import hashlib
+
+try:
+	import numpy
+	use_numpy = True
+except ImportError:
+	use_numpy = False
+
+DELTA_MAGIC: Final[bytes] = b'VSDELTA\x01'
+# magic, sha1 of the base, size of the encoded version, length of the base name
+delta_header = struct.Struct('>8s20sQH')
+
+def xor_bytes(base: bytes, data: bytes) -> bytes:
+	"""XOR data against base. Past the end of the base data is copied as is,
+	so the result is as long as data
+	"""
+	common = min(len(base), len(data))
+	if(not common):
+		return bytes(data)
+
+	if(use_numpy):
+		xored = numpy.bitwise_xor(
+			numpy.frombuffer(base, numpy.uint8, common),
+			numpy.frombuffer(data, numpy.uint8, common),
+		).tobytes()
+	else:
+		xored = (
+			int.from_bytes(base[:common], 'little') ^ int.from_bytes(data[:common], 'little')
+		).to_bytes(common, 'little')
+
+	return xored + data[common:]
+
+def encode_delta(base_name: str, base: bytes, target: bytes) -> bytes:
+	"""Encode a version as the compressed XOR against a base version.
+	Unchanged bytes become zeros, which compress to almost nothing
+
+	Args:
+		base_name (str): The name of the version it is encoded against
+		base (bytes): The serialized base version
+		target (bytes): The serialized version to be encoded
+
+	Returns:
+		bytes: The delta, with a header that identifies its base
+	"""
+	name = base_name.encode()
+	return b''.join((
+		delta_header.pack(DELTA_MAGIC, hashlib.sha1(base).digest(), len(target), len(name)),
+		name,
+		zlib.compress(xor_bytes(base, target)),
+	))
+
+def read_delta_header(data: bytes) -> Tuple[str, bytes, int, int]:
+	"""Parse the header of a delta
+
+	Args:
+		data (bytes): At least the header of the delta
+
+	Returns:
+		Tuple[str, bytes, int, int]: The base name, base sha1, size of the encoded version and
+			the offset of the compressed payload
+	"""
+	magic, base_sha1, size, name_length = delta_header.unpack_from(data)
+	if(magic != DELTA_MAGIC):
+		raise ValueError("Not a step delta")
+
+	offset = delta_header.size + name_length
+	return data[delta_header.size:offset].decode(), base_sha1, size, offset
+
+def decode_delta(data: bytes, base: bytes) -> bytes:
+	"""Rebuild a version from its delta and the serialized base version
+
+	Args:
+		data (bytes): The delta, as written by encode_delta
+		base (bytes): The serialized base version
+
+	Returns:
+		bytes: The serialized version
+	"""
+	base_name, base_sha1, size, offset = read_delta_header(data)
+	if(hashlib.sha1(base).digest() != base_sha1):
+		raise ValueError(f"The base version \"{base_name}\" of the delta was modified")
+
+	target = xor_bytes(base, zlib.decompress(data[offset:]))
+	if(len(target) != size):
+		raise ValueError(f"Corrupted delta against \"{base_name}\"")
+	return target
@@ -1,24 +1,119 @@
 import functools
 from inspect import getsource
 import re
+import io
+import time
 
 from typing import *
 from inspect import signature
 
 import typeguard
 
+from logging import info,\
+	INFO,\
+	getLogger
+
 from ..scope import Dependency
 from ..defaults import\
 	DEFAULT_LATEST_SUFFIX,\
 	DEFAULT_STEP_SUFFIX,\
-	DEFAULT_REF_SUFFIX
+	DEFAULT_REF_SUFFIX,\
+	DEFAULT_DELTA_STEPS,\
+	DEFAULT_DELTA_KEYFRAME_INTERVAL,\
+	DEFAULT_DELTA_SUFFIX,\
+	DEFAULT_DELTA_REPORT_INTERVALS,\
+	DEFAULT_STEP_INDEX_SUFFIX,\
+	DEFAULT_STEP_NAMES_SUFFIX,\
+	DEFAULT_STEP_CACHE
+
+from .delta import encode_delta, decode_delta, read_delta_header, delta_header
+from .step_index import Step_index, Step_record, hash_file
+from .step_cache import Step_cache
+from ..prefetch import MISSING
+from ..scheduler import step_outputs
+from ..tracing import traced
+from ..retention import Step_candidate, select_versions
 
 import os
 
+logger = getLogger()
+
 class Disk:
 	_parent_: object
-	def __init__(self, parent, **kwargs) -> None:
+
+	# Whether previous versions are stored as deltas against the next one
+	_delta_steps_: bool
+	_delta_keyframe_interval_: int
+
+	# Real steps folder path -> its step index, which caches the names table
+	_step_indexes_: Dict[str, Step_index]
+
+	_step_cache_: Step_cache
+	_step_cache_enabled_: bool
+
+	def __init__(self, 
+			  	 parent, 
+				 *, 
+				 delta_steps: bool=DEFAULT_DELTA_STEPS, 
+				 delta_keyframe_interval: int=DEFAULT_DELTA_KEYFRAME_INTERVAL, 
+				 step_cache: bool=DEFAULT_STEP_CACHE,
+				 **kwargs
+		) -> None:
 		self._parent_ = parent
+
+		self._step_cache_ = Step_cache(parent, self)
+		self._step_cache_enabled_ = step_cache
+
+		self._delta_steps_ = delta_steps
+		self._delta_keyframe_interval_ = max(1, delta_keyframe_interval)
+
+		self._step_indexes_ = dict()
+
+	def set_delta_steps(self, enabled: bool=True, *, keyframe_interval: int=None) -> None:
+		"""Enable or disable storing step versions as deltas.
+		Only versions added from now on are affected
+
+		Args:
+			enabled (bool): Whether to store deltas
+		Kwargs:
+			keyframe_interval (int): Every this many versions one is kept whole
+		"""
+		self._delta_steps_ = enabled
+		if(keyframe_interval is not None):
+			self._delta_keyframe_interval_ = max(1, keyframe_interval)
+
+	def _get_step_index(self, steps_folder_path: str, stored_varname: str) -> Step_index:
+		"""Get the step index of a variable, building it from
+		the text steps file of older folders the first time
+		"""
+		filesystem = self._parent_.filesystem
+		real_folder = filesystem.resolve(steps_folder_path)
+
+		step_index = self._step_indexes_.get(real_folder)
+		if(step_index is None):
+			step_index = self._step_indexes_[real_folder] = Step_index(real_folder, stored_varname)
+
+		steps_file = f"{steps_folder_path}/{stored_varname}{DEFAULT_STEP_SUFFIX}"
+		if(not step_index.exists() and steps_file in filesystem):
+			with filesystem.open(steps_file, filesystem.READ_TEXT) as f:
+				steps = [
+					step.strip()
+					for step in f.readlines()
+					if step.strip()
+				]
+
+			step_index.migrate(steps, lambda version: self._version_path(version, folder=steps_folder_path))
+			filesystem.remove(steps_file)
+
+		return step_index
+
+	def _version_path(self, version: str, *, folder: str) -> Optional[str]:
+		"""Get the real path of the file of a version, either whole or a delta
+		"""
+		filesystem = self._parent_.filesystem
+		for path in (f"{folder}/{version}", f"{folder}/{version}{DEFAULT_DELTA_SUFFIX}"):
+			if(path in filesystem):
+				return filesystem.resolve(path)
 		
 	def get_file_steps(self, varname: str, *, folder: Optional[str]=None, prefix: str=None) -> List[str]:
 		if(folder is None):
@@ -27,55 +122,405 @@ class Disk:
 			prefix = self._parent_.get_var_prefix()
 		
 		try:
-			with self._parent_.filesystem.open(
-					f"{folder}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}", self._parent_.filesystem.READ_TEXT	
-				) as f:
-				return list(
-					map(
-						str.strip, 
-						filter(
-							None, 
-							f.readlines()
-				)))
+			return self._get_step_index(
+				f"{folder}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}",
+				f"{prefix}{varname}",
+			).names()
 		except Exception as err:
 			print(f"Error: {err}")
 			pass
 
+	def get_step_at(self, varname: str, timestamp: float, *, folder: Optional[str]=None, prefix: str=None) -> Optional[str]:
+		"""Get the last version of a variable added at or before a point in time
+
+		Args:
+			varname (str): The name of the variable
+			timestamp (float): The point in time, as seconds since the epoch
+
+		Returns:
+			Optional[str]: The version name, or None if there was no version yet
+		"""
+		if(folder is None):
+			folder = self._parent_._folder_name_
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
+
+		step_index = self._get_step_index(f"{folder}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}", f"{prefix}{varname}")
+		step_n = step_index.find_time(timestamp)
+		if(step_n < 0):
+			return None
+		return step_index[step_n].name
+
 	def load_file_step(self, varname: str, version: str, *, folder: Optional[str]=None) -> Any:
 		if(folder is None):
 			folder = self._parent_._folder_name_
 		
-		return self._parent_.load_var(
+		return self._load_version(
 			version, 
 			folder=f"{folder}/{varname}{DEFAULT_STEP_SUFFIX}"	
 		)
+
+	def _load_version(self, version: str, *, folder: str, loaded_refs: Set[str]=set(), load_as: str=None) -> Any:
+		if(f"{folder}/{version}" in self._parent_.filesystem):
+			return self._parent_.load_var(version, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
+
+		if(f"{folder}/{version}{DEFAULT_DELTA_SUFFIX}" in self._parent_.filesystem):
+			return self._parent_.serializer.load(io.BytesIO(self._read_version(version, folder=folder)))
+
+		return self._parent_.load_var(version, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
+
+	def _read_file(self, path: str) -> bytes:
+		with self._parent_.filesystem.open(path, self._parent_.filesystem.READ_BINARY) as f:
+			return f.read()
+
+	def _read_version(self, version: str, *, folder: str) -> bytes:
+		"""Get the serialized contents of a version, rebuilding it from its deltas if needed
+		"""
+		filesystem = self._parent_.filesystem
+
+		deltas: List[bytes] = list()
+		while(f"{folder}/{version}" not in filesystem):
+			delta = self._read_file(f"{folder}/{version}{DEFAULT_DELTA_SUFFIX}")
+			deltas.append(delta)
+			version = read_delta_header(delta)[0]
+
+		data = self._read_file(f"{folder}/{version}")
+		for delta in reversed(deltas):
+			data = decode_delta(delta, data)
+		return data
+
+	def _delta_base(self, path: str) -> str:
+		with self._parent_.filesystem.open(path, self._parent_.filesystem.READ_BINARY) as f:
+			header = f.read(delta_header.size)
+			name_length = delta_header.unpack(header)[3]
+			return read_delta_header(header + f.read(name_length))[0]
+
+	def _materialize_dependents(self, version: str, *, folder: str) -> None:
+		"""Store whole every delta encoded against a version, before it is overwritten
+		"""
+		filesystem = self._parent_.filesystem
+
+		for filename in list(filesystem.listdir(folder)):
+			if(not filename.endswith(DEFAULT_DELTA_SUFFIX)):
+				continue
+
+			dependent = filename[:-len(DEFAULT_DELTA_SUFFIX)]
+			if(dependent == version or self._delta_base(f"{folder}/{filename}") != version):
+				continue
+
+			data = self._read_version(dependent, folder=folder)
+			with filesystem.open(f"{folder}/{dependent}", filesystem.WRITE_BINARY) as f:
+				f.write(data)
+			filesystem.remove(f"{folder}/{filename}")
+
+		if(f"{folder}/{version}{DEFAULT_DELTA_SUFFIX}" in filesystem):
+			filesystem.remove(f"{folder}/{version}{DEFAULT_DELTA_SUFFIX}")
+
+	def _encode_previous(self, previous: str, version: str, *, folder: str) -> None:
+		"""Replace a whole version by a delta against the version that follows it
+		"""
+		filesystem = self._parent_.filesystem
+		previous_path = f"{folder}/{previous}"
+		version_path = f"{folder}/{version}"
+		if(previous_path not in filesystem or version_path not in filesystem):
+			# References, sources and missing versions are kept as they are
+			return
+
+		previous_data = self._read_file(previous_path)
+		delta = encode_delta(version, self._read_file(version_path), previous_data)
+		if(len(delta) >= len(previous_data)):
+			return
+
+		with filesystem.open(f"{previous_path}{DEFAULT_DELTA_SUFFIX}", filesystem.WRITE_BINARY) as f:
+			f.write(delta)
+		filesystem.remove(previous_path)
+
+	def delta_report(self, 
+				     varname: str, 
+					 keyframe_intervals: Iterable[int]=DEFAULT_DELTA_REPORT_INTERVALS, 
+					 *, 
+					 folder: Optional[str]=None, 
+					 prefix: str=None
+			) -> Dict[str, Any]:
+		"""Measure how much disk delta steps save for a variable, and what they cost to load,
+		for different keyframe intervals. Every version is read once
+
+		Args:
+			varname (str): The name of the variable
+			keyframe_intervals (Iterable[int]): The keyframe intervals to evaluate
+		Kwargs:
+			folder (str): The variables folder. Defaults to the current one
+			prefix (str): The variable prefix. Defaults to the current one
+
+		Returns:
+			Dict[str, Any]: The whole and current sizes in bytes, and for each interval the
+				stored bytes, saved bytes and the mean and max seconds to rebuild a version
+		"""
+		if(folder is None):
+			folder = self._parent_._folder_name_
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
+
+		filesystem = self._parent_.filesystem
+		steps_folder_path = f"{folder}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
+		steps = list(dict.fromkeys(self._get_step_index(steps_folder_path, f"{prefix}{varname}").names()))
+
+		current_bytes = 0
+		for step in steps:
+			for path in (f"{steps_folder_path}/{step}", f"{steps_folder_path}/{step}{DEFAULT_DELTA_SUFFIX}"):
+				if(path in filesystem):
+					current_bytes += filesystem.size(path)
+
+		# Size, load time, delta size and delta decoding time of every version
+		whole_sizes: List[int] = list()
+		load_times: List[float] = list()
+		delta_sizes: List[int] = list()
+		decode_times: List[float] = list()
+
+		data: Optional[bytes] = None
+		for step in reversed(steps):
+			start = time.perf_counter()
+			previous_data = self._read_version(step, folder=steps_folder_path)
+			load_times.append(time.perf_counter() - start)
+			whole_sizes.append(len(previous_data))
+
+			if(data is None):
+				delta_sizes.append(len(previous_data))
+				decode_times.append(0.)
+			else:
+				delta = encode_delta(step, data, previous_data)
+				delta_sizes.append(len(delta))
+
+				start = time.perf_counter()
+				decode_delta(delta, data)
+				decode_times.append(time.perf_counter() - start)
+			data = previous_data
+
+		whole_sizes.reverse()
+		load_times.reverse()
+		delta_sizes.reverse()
+		decode_times.reverse()
+
+		report: Dict[str, Any] = dict(
+			versions=len(steps),
+			whole_bytes=sum(whole_sizes),
+			current_bytes=current_bytes,
+			intervals=dict(),
+		)
+
+		n_steps = len(steps)
+		for interval in keyframe_intervals:
+			interval = max(1, interval)
+			
+			stored_bytes = 0
+			latencies: List[float] = list()
+			for i in range(n_steps):
+				is_whole = i == n_steps-1 or i % interval == 0
+				stored_bytes += whole_sizes[i] if is_whole else delta_sizes[i]
+
+				# Walk the deltas up to the next whole version
+				latency = 0.
+				j = i
+				while(not (j == n_steps-1 or j % interval == 0)):
+					latency += decode_times[j]
+					j += 1
+				latencies.append(latency + load_times[j])
+
+			report['intervals'][interval] = dict(
+				stored_bytes=stored_bytes,
+				saved_bytes=report['whole_bytes'] - stored_bytes,
+				mean_latency=sum(latencies) / n_steps if n_steps else 0.,
+				max_latency=max(latencies, default=0.),
+			)
+
+		return report
+
+	def _version_size(self, version: str, *, folder: str) -> int:
+		path = self._version_path(version, folder=folder)
+		if(path is None):
+			return 0
+		return os.path.getsize(path)
+
+	def gc_steps(self, *, dry_run: bool=True, folder: Optional[str]=None) -> Dict[str, Any]:
+		"""Delete the step versions not kept by the retention policies, 
+		and remove them from the steps lists
+
+		Kwargs:
+			dry_run (bool): Only report what would be deleted
+			folder (str): The variables folder. Defaults to the current one
+
+		Returns:
+			Dict[str, Any]: The reclaimed bytes and the removed versions of each variable
+		"""
+		if(folder is None):
+			folder = self._parent_._folder_name_
+
+		filesystem = self._parent_.filesystem
+
+		reclaimed = 0
+		removed: Dict[str, List[str]] = dict()
+		for filename in list(filesystem.listdir(folder)):
+			if(not filename.endswith(DEFAULT_STEP_SUFFIX)):
+				continue
+
+			steps_folder_path = f"{folder}/{filename}"
+			varname = filename[:-len(DEFAULT_STEP_SUFFIX)]
+
+			policy = self._parent_.get_retention(varname)
+			if(policy is None):
+				continue
+
+			step_index = self._get_step_index(steps_folder_path, varname)
+			if(not step_index.exists()):
+				continue
+
+			records = list(step_index)
+			# A version run more than once counts where it was last added
+			latest_records: Dict[str, Step_record] = dict()
+			for record in reversed(records):
+				latest_records.setdefault(record.name, record)
+			versions = list(latest_records)
+
+			keep = select_versions([
+				Step_candidate(
+					(version[len(varname)+1:],),
+					record.timestamp,
+					self._version_size(version, folder=steps_folder_path),
+				)
+				for version, record in latest_records.items()
+			], policy)
+
+			dropped = [
+				version
+				for version, kept in zip(versions, keep)
+				if not kept
+			]
+
+			# Versions of overridden steps, no longer in the index
+			orphans = {
+				filename[:-len(DEFAULT_DELTA_SUFFIX)] if filename.endswith(DEFAULT_DELTA_SUFFIX) else filename
+				for filename in filesystem.listdir(steps_folder_path)
+				if filename.startswith(f"{varname}.") and not filename.startswith((
+					f"{varname}{DEFAULT_STEP_INDEX_SUFFIX}",
+					f"{varname}{DEFAULT_STEP_NAMES_SUFFIX}",
+					f"{varname}{DEFAULT_STEP_SUFFIX}",
+				))
+			}.difference(versions)
+			dropped.extend(sorted(orphans))
+
+			if(not dropped):
+				continue
+
+			removed[varname] = dropped
+			if(dry_run):
+				reclaimed += sum(
+					self._version_size(version, folder=steps_folder_path)
+					for version in dropped
+				)
+				continue
+
+			size_before = sum(
+				self._version_size(version, folder=steps_folder_path)
+				for version in (*versions, *orphans)
+			)
+
+			# The oldest first, so deltas are only rebuilt for versions that are kept
+			for version in (*orphans, *reversed(dropped[:len(dropped)-len(orphans)])):
+				self._materialize_dependents(version, folder=steps_folder_path)
+				if(f"{steps_folder_path}/{version}" in filesystem):
+					filesystem.remove(f"{steps_folder_path}/{version}")
+
+			dropped_set = set(dropped)
+			step_index.rewrite(
+				record
+				for record in records
+				if record.name not in dropped_set
+			)
+
+			reclaimed += size_before - sum(
+				self._version_size(version, folder=steps_folder_path)
+				for version in versions
+			)
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] {'Reclaimable' if dry_run else 'Reclaimed'} {reclaimed} bytes from {sum(map(len, removed.values()))} step versions")
+
+		return dict(
+			dry_run=dry_run,
+			reclaimed_bytes=reclaimed,
+			removed=removed,
+		)
+
+	def load_file_steps(self, 
+					    varname: str, 
+					    version_names: Iterable[str]=None, 
+					    step_ns: Iterable[int]=None, 
+					    *, 
+					    prefix: str=None,
+					    folder: Optional[str]=None
+			) -> List[Any]:
+		"""Load many versions of a variable at once
+
+		Args:
+			varname (str): The name of the variable
+			version_names (Iterable[str]): The step names of the versions to load
+			step_ns (Iterable[int]): The step numbers of the versions to load, 0 being the first one
+		Kwargs:
+			prefix (str): The variable prefix. Defaults to the current one
+
+		Returns:
+			List[Any]: The loaded versions, in the requested order. Missing versions are None
+		"""
+		if(folder is None):
+			folder = self._parent_._folder_name_
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
+
+		steps_folder_path = f"{folder}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
+		if(version_names is None):
+			if(step_ns is None):
+				raise ValueError("Either of 'version_names' or 'step_ns' arguments should be set")
+
+			step_index = self._get_step_index(steps_folder_path, f"{prefix}{varname}")
+			n_steps = len(step_index)
+			version_names = [
+				step_index[step_n].name if 0 <= step_n < n_steps else None
+				for step_n in step_ns
+			]
+
+		return [
+			self._load_version(version, folder=steps_folder_path)
+			if version is not None and self._version_path(version, folder=steps_folder_path) is not None else None
+			for version in version_names
+		]
 	
-	def load_latest_step(self, varname: str, *, folder: Optional[str]=None, loaded_refs:Set[str]=set(), load_as: str=None) -> Any:
+	def load_latest_step(self, varname: str, *, folder: Optional[str]=None, loaded_refs:Set[str]=set(), load_as: str=None, prefix: str=None) -> Any:
 		if(folder is None):
 			folder = self._parent_._folder_name_
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
 
-		steps_folder_path = f"{folder}/{self._parent_.get_var_prefix()}{varname}{DEFAULT_STEP_SUFFIX}"
-		latest_ref_filename = f"{self._parent_.get_var_prefix()}{varname}{DEFAULT_LATEST_SUFFIX}"
-		if(os.path.exists(f"{steps_folder_path}/{latest_ref_filename}{DEFAULT_REF_SUFFIX}")):
-			print("Latest step ref")
-			return self._parent_._load_ref(latest_ref_filename, loaded_refs=loaded_refs, folder=steps_folder_path, load_as=load_as)
-		
-		steps_filename = f"{self._parent_.get_var_prefix()}{varname}{DEFAULT_STEP_SUFFIX}"
-		if(os.path.exists(f"{steps_folder_path}/{steps_filename}")):
+		steps_folder_path = f"{folder}/{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
+		steps_filename = f"{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
+		# The index skips versions removed since they were added, which the ref does not
+		step_index = self._get_step_index(steps_folder_path, f"{prefix}{varname}")
+		if(step_index.exists()):
 			print("Latest steps")
-			return self._load_steps(steps_filename, loaded_refs=loaded_refs, folder=steps_folder_path, load_as=load_as)
-		print("Nothingness")
+			return self._load_steps(step_index, steps_filename=steps_filename, loaded_refs=loaded_refs, folder=steps_folder_path, load_as=load_as)
 
-	def _load_steps(self, steps_filename: str, *, loaded_refs: Set[str], folder: str, load_as: str=None) -> Any:
-		steps: List[str]
-		with self._parent_.filesystem.open(f"{folder}/{steps_filename}", self._parent_.filesystem.READ_TEXT) as f:
-			steps = f.readlines()
+		# Written by add_new_step and _restore_output next to the versions
+		if(f"{steps_folder_path}/{DEFAULT_LATEST_SUFFIX}{DEFAULT_REF_SUFFIX}" in self._parent_.filesystem):
+			print("Latest step ref")
+			return self._parent_._storager_._load_ref(DEFAULT_LATEST_SUFFIX, loaded_refs=loaded_refs, folder=steps_folder_path, load_as=load_as)
+		print("Nothingness")
 
-		steps_folder_files = os.listdir(folder)
-		for step in map(str.strip, steps[::-1]):
-			if(step and step in steps_folder_files):
+	def _load_steps(self, step_index: Step_index, *, steps_filename: str, loaded_refs: Set[str], folder: str, load_as: str=None) -> Any:
+		# Usually the last record, unless its version was removed
+		for step_n in range(len(step_index)-1, -1, -1):
+			step = step_index[step_n].name
+			if(self._version_path(step, folder=folder) is not None):
 				loaded_refs.add(steps_filename)
-				return self._parent_.load_var(step, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
+				return self._load_version(step, loaded_refs=loaded_refs, folder=folder, load_as=load_as)
 
 	@functools.singledispatchmethod
 	def step(self, step: str, **kwargs) -> Any:
@@ -105,6 +550,7 @@ class Disk:
 
 		return self.step_run_function(step_fn, **kwargs)
 	
+	@traced
 	def step_run_function(self, 
 					      step_fn: Any,
 						  *,
@@ -113,16 +559,25 @@ class Disk:
 						  step_n: int=None, 
 						  type_check: bool=False,
 						  processer: bool | str | object=False,
+						  force: bool=False,
 						  **kwargs
 			) -> Any:
 		step_name = kwargs.get('step_name', step_fn.__name__)
 
+		current_prefix: str = self._parent_.get_var_prefix()
+
+		cache_key, value = self._cached_step(step_fn, step_name, kwargs, processer=processer, force=force, prefix=current_prefix)
+		if(value is not MISSING):
+			return value
+
+		producer_fn = step_fn
 		if(type_check):
 			step_fn = typeguard.typechecked(step_fn)
 
 		self._parent_.__enter__()
 		try:
 			fn_args = self._parent_.load_function_args(step_fn, not_load=kwargs.keys())
+			input_names = list(fn_args.keys())
 			fn_args.update(kwargs)
 			
 			step_fn_sig = signature(step_fn)
@@ -150,32 +605,191 @@ class Disk:
 				**fn_args
 			)
 
-		current_prefix: str = self._parent_.get_var_prefix()
+		output_spec, output_values = step_outputs(output_name, value)
+		self._version_step(
+			step_name,
+			stored_vars,
+			output_spec=output_spec,
+			output_values=output_values,
+			keep_intermediate=keep_intermediate,
+			step_n=step_n,
+			# Only runs whose value can be rebuilt from their outputs are cached
+			cache_key=cache_key if value is None or output_spec is not None else None,
+			prefix=current_prefix,
+		)
+
+		if(output_spec is not None):
+			self._parent_._record_producer(
+				producer_fn,
+				step_name,
+				output_spec,
+				input_names,
+				kwargs,
+				cache_key=cache_key,
+				prefix=current_prefix,
+				keep_intermediate=keep_intermediate,
+				type_check=type_check,
+			)
+
+		return value
+
+	@traced
+	def _cached_step(self, 
+				  	 step_fn: Callable, 
+					 step_name: str, 
+					 kwargs: Dict[str, Any], 
+					 *, 
+					 processer: bool | str | object=False, 
+					 force: bool=False,
+					 prefix: str=None
+			) -> Tuple[Optional[str], Any]:
+		"""Restore the outputs of a previous run of a step with the same code, inputs and kwargs
+
+		Returns:
+			Tuple[Optional[str], Any]: The cache key of the run, if it can be cached, 
+				and the value the step returned, or MISSING if it has to be run
+		"""
+		# Processer steps need the arguments, so they are always run
+		if(not self._step_cache_enabled_ or processer):
+			return None, MISSING
+
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
+
+		cache_key = self._step_cache_.run_key(step_fn, step_name, kwargs, prefix=prefix)
+		if(cache_key is None):
+			return None, MISSING
+
+		entry = None if force else self._step_cache_.get(cache_key)
+		changed = None if entry is None else self._step_cache_.restore(entry, prefix=prefix)
+		if(changed is None):
+			self._step_cache_.count(forced=force)
+			return cache_key, MISSING
+
+		self._step_cache_.count(hit=True)
+		return cache_key, self._step_cache_.value(entry)
+
+	@traced
+	def _version_step(self, 
+				   	  step_name: str, 
+					  stored_vars: Iterable[str], 
+					  input_names: Iterable[str]=(), 
+					  *, 
+					  output_spec: Union[None, str, Tuple[str, ...]]=None, 
+					  output_values: Optional[List[Any]]=None, 
+					  keep_intermediate: bool=True, 
+					  step_n: int=None, 
+					  cache_key: Optional[str]=None, 
+					  prefix: str=None,
+					  **kwargs
+			) -> List[str]:
+		"""Version the variables stored by a step run and its outputs
+
+		Args:
+			step_name (str): The name of the step
+			stored_vars (Iterable[str]): The variables stored while the step ran
+			input_names (Iterable[str]): The variables loaded as arguments of the step
+		Kwargs:
+			output_spec (Union[None, str, Tuple[str, ...]]): The outputs, as given by step_outputs
+			output_values (List[Any]): The value of each output, or None if they are already stored
+			cache_key (str): The step cache key under which the run is recorded
+
+		Returns:
+			List[str]: The versioned variables
+		"""
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
 
+		outputs: List[str] = list()
 		if(keep_intermediate):
 			for stored_varname in stored_vars:
-				self.add_new_step(stored_varname, step_name, prefix=current_prefix)
+				self.add_new_step(stored_varname, step_name, prefix=prefix)
+				outputs.append(stored_varname)
+
+		if(output_spec is not None):
+			output_names = output_spec if isinstance(output_spec, tuple) else (output_spec,)
+			if(not isinstance(step_n, (list, tuple))):
+				step_n = [step_n] * len(output_names)
+
+			for i, (output_name_n, step_n_n) in enumerate(zip(output_names, step_n)):
+				if(output_values is not None):
+					self._parent_.store_var(output_name_n, output_values[i])
+				self.add_new_step(output_name_n, step_name, step_n=step_n_n, prefix=prefix)
+				outputs.append(output_name_n)
+
+		if(cache_key is not None and outputs):
+			self._step_cache_.record(cache_key, step_name, outputs, output_spec, prefix=prefix)
+
+		return outputs
+
+	def set_step_cache(self, enabled: bool=True) -> None:
+		"""Enable or disable reusing the outputs of previous step runs
+		with the same code, inputs and kwargs
+		"""
+		self._step_cache_enabled_ = enabled
+
+	def step_cache_stats(self) -> Dict[str, Union[int, float]]:
+		return self._step_cache_.stats()
+
+	def reset_step_cache_stats(self) -> None:
+		self._step_cache_.reset_stats()
+
+	def clear_step_cache(self) -> None:
+		self._step_cache_.clear()
+
+	def _output_step_index(self, stored_varname: str) -> Optional[Step_index]:
+		steps_folder_path = f"{self._parent_._folder_name_}/{stored_varname}{DEFAULT_STEP_SUFFIX}"
+		if(steps_folder_path not in self._parent_.filesystem):
+			return None
+		return self._get_step_index(steps_folder_path, stored_varname)
+
+	def _stored_hash(self, varname: str, *, prefix: str) -> Optional[str]:
+		return self._output_version(f"{prefix}{varname}")
+
+	def _output_version(self, stored_varname: str) -> Optional[str]:
+		step_index = self._output_step_index(stored_varname)
+		latest = None if step_index is None else step_index.latest()
+		return None if latest is None else latest.sha1.hex()
+
+	def _find_output_version(self, stored_varname: str, sha1: str) -> Optional[str]:
+		"""Find the version name whose file still holds some contents
+		"""
+		step_index = self._output_step_index(stored_varname)
+		if(step_index is None):
+			return None
+
+		# Versions of the same step are overwritten, so only the last record of each name holds
+		seen: Set[str] = set()
+		for record in reversed(list(step_index)):
+			if(record.name in seen):
+				continue
+			seen.add(record.name)
 
-		if(output_name is not None and value is not None):
 			if(
-				hasattr(value, '__len__') and
-				hasattr(output_name, '__len__') and
-				type(output_name) != str and
-				type(value) != str and
-				len(output_name) == len(value)
+					record.sha1.hex() == sha1 and
+					self._version_path(record.name, folder=f"{self._parent_._folder_name_}/{stored_varname}{DEFAULT_STEP_SUFFIX}") is not None
 				):
-				if(isinstance(step_n, int)):
-					step_n = [step_n]* len(output_name)
-
-				for output_name_n, step_n_n, value_n in zip(output_name, step_n, value):
-					self._parent_.store_var(output_name_n, value_n)
-					self.add_new_step(output_name_n, step_name, step_n=step_n_n, prefix=current_prefix)
-			else:
-				self._parent_.store_var(output_name, value)
-				self.add_new_step(output_name, step_name, step_n=step_n, prefix=current_prefix)
+				return record.name
+
+	def _restore_output(self, stored_varname: str, version: str) -> bool:
+		step_index = self._output_step_index(stored_varname)
+		latest = step_index.latest()
+		if(latest.name == version):
+			return False
+
+		record = next(
+			record
+			for record in reversed(list(step_index))
+			if record.name == version
+		)
+		step_index.append(version, time.time(), record.size, record.sha1)
 
-		return value
+		steps_folder_path = f"{self._parent_._folder_name_}/{stored_varname}{DEFAULT_STEP_SUFFIX}"
+		with self._parent_.filesystem.open(f"{steps_folder_path}/{DEFAULT_LATEST_SUFFIX}{DEFAULT_REF_SUFFIX}", self._parent_.filesystem.WRITE_CREATE_TEXT) as f:
+			f.write(version)
+		return True
 
+	@traced
 	def add_new_step(self, stored_varname: str, step_name: str, step_n: int=None, *, prefix: str=None) -> None:
 		if(prefix is None):
 			prefix = self._parent_.get_var_prefix()
@@ -183,34 +797,41 @@ class Disk:
 			stored_varname = f"{prefix}{stored_varname}"
 
 		steps_folder_path = f"{self._parent_._folder_name_}/{stored_varname}{DEFAULT_STEP_SUFFIX}"
-		if(not os.path.exists(steps_folder_path)):
-			os.mkdir(steps_folder_path)
-	
-		self._parent_.move_var(stored_varname, f"{steps_folder_path}/{stored_varname}.{step_name}")
+		if(steps_folder_path not in self._parent_.filesystem):
+			self._parent_.filesystem.mkdir(steps_folder_path)
 
-		steps_file = f"{steps_folder_path}/{stored_varname}{DEFAULT_STEP_SUFFIX}"
+		version = f"{stored_varname}.{step_name}"
+		step_index = self._get_step_index(steps_folder_path, stored_varname)
+		previous = step_index.latest()
 
-		step_set: bool = False
-		if(step_n is not None and os.path.exists(steps_file)):
-			steps: List[str]
-			with self._parent_.filesystem.open(steps_file, self._parent_.filesystem.READ_TEXT) as f:
-				steps = f.readlines()
-
-			if(len(steps) > step_n):
-				steps[step_n] = f'{stored_varname}.{step_name}\n'
+		if(self._delta_steps_ or f"{steps_folder_path}/{version}{DEFAULT_DELTA_SUFFIX}" in self._parent_.filesystem):
+			# The version is overwritten, so no delta can depend on it anymore
+			self._materialize_dependents(version, folder=steps_folder_path)
+	
+		self._parent_.move_var(stored_varname, f"{steps_folder_path}/{version}")
+		size, sha1 = hash_file(self._parent_.filesystem.resolve(f"{steps_folder_path}/{version}"))
 
-				with self._parent_.filesystem.open(steps_file, self._parent_.filesystem.WRITE_CREATE_TEXT) as f:
-					f.writelines(steps)
+		step_set: bool = False
+		if(step_n is not None and len(step_index) > step_n):
+			step_index.set(step_n, version, size, sha1)
 
-				step_set = True
+			step_set = True
 
 		if(not step_set):
 			if(step_n is not None):
 				# logger.info
 				print("[i] Added step as latest")
 			
-			with self._parent_.filesystem.open(steps_file, self._parent_.filesystem.APPEND_CREATE_TEXT) as f:
-				f.write(f'{stored_varname}.{step_name}\n')
+			step_n = step_index.append(version, time.time(), size, sha1)
+
+			# The newest version is always whole, and the previous one becomes a delta against it
+			if(
+					self._delta_steps_ and 
+					previous is not None and 
+					previous.name != version and
+					(step_n-1) % self._delta_keyframe_interval_
+				):
+				self._encode_previous(previous.name, version, folder=steps_folder_path)
 		with self._parent_.filesystem.open(f"{steps_folder_path}/{DEFAULT_LATEST_SUFFIX}{DEFAULT_REF_SUFFIX}", self._parent_.filesystem.WRITE_CREATE_TEXT) as f:
 			f.write(f"{stored_varname}.{step_name}")
 
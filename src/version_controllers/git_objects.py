@@ -0,0 +1,129 @@
+from typing import *
+
+import io
+import atexit
+import subprocess
+
+from threading import Lock
+
+from logging import debug,\
+	DEBUG,\
+	getLogger
+
+logger = getLogger()
+
+class Blob_stream(io.RawIOBase):
+	"""Read-only stream over a single object coming through a "git cat-file --batch" pipe.
+	The pipe is locked until the stream is closed, when any unread data is skipped
+	"""
+	_reader_: 'Cat_file_reader'
+	_remaining_: int
+	size: int
+
+	def __init__(self, reader: 'Cat_file_reader', size: int) -> None:
+		super().__init__()
+		self._reader_ = reader
+		self._remaining_ = size
+		self.size = size
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, buffer) -> int:
+		if(not self._remaining_):
+			return 0
+
+		view = memoryview(buffer)[:self._remaining_]
+		read = self._reader_._stdout_.readinto(view)
+		if(not read):
+			raise EOFError("git cat-file closed the pipe in the middle of an object")
+
+		self._remaining_ -= read
+		return read
+
+	def close(self) -> None:
+		if(self.closed):
+			return
+
+		try:
+			stdout = self._reader_._stdout_
+			while(self._remaining_):
+				skipped = len(stdout.read(min(self._remaining_, 1024**2)))
+				if(not skipped):
+					break
+				self._remaining_ -= skipped
+			# Every object is followed by a newline
+			stdout.read(1)
+		finally:
+			super().close()
+			self._reader_._lock_.release()
+
+class Cat_file_reader:
+	"""Long-lived "git cat-file --batch" process that serves any amount of
+	object reads over a single pipe
+	"""
+	_repo_dir_: str
+	_process_: Optional[subprocess.Popen]
+	_stdout_: Optional[BinaryIO]
+	_lock_: Lock
+
+	def __init__(self, repo_dir: str) -> None:
+		self._repo_dir_ = repo_dir
+		self._process_ = None
+		self._stdout_ = None
+		self._lock_ = Lock()
+
+		atexit.register(self.close)
+
+	def _start(self) -> None:
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f"[R] {self.__class__.__name__}._start({self._repo_dir_})")
+
+		self._process_ = subprocess.Popen(
+			['git', 'cat-file', '--batch'],
+			cwd=self._repo_dir_,
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+		)
+		self._stdout_ = self._process_.stdout
+
+	def open(self, hexsha: str) -> Blob_stream:
+		"""Open an object for streaming. The stream must be closed before reading another object,
+		so it is meant to be used as
+
+		with reader.open(hexsha) as stream:
+			...
+
+		Args:
+			hexsha (str): The hex sha of the object
+
+		Returns:
+			Blob_stream: The stream over the object contents
+		"""
+		self._lock_.acquire()
+		try:
+			if(self._process_ is None or self._process_.poll() is not None):
+				self._start()
+
+			self._process_.stdin.write(f"{hexsha}\n".encode())
+			self._process_.stdin.flush()
+
+			header = self._stdout_.readline().decode().split()
+			if(len(header) != 3):
+				raise KeyError(f"Object {hexsha} not found in \"{self._repo_dir_}\"")
+
+			return Blob_stream(self, int(header[2]))
+		except BaseException:
+			self._lock_.release()
+			raise
+
+	def read(self, hexsha: str) -> bytes:
+		with self.open(hexsha) as stream:
+			return stream.read()
+
+	def close(self) -> None:
+		if(self._process_ is not None):
+			self._process_.stdin.close()
+			self._process_.wait()
+			self._process_ = None
+			self._stdout_ = None
@@ -1,11 +1,16 @@
 import functools
 
+from contextlib import contextmanager
+
 from inspect import getsource, signature
 
 import io
 
 import os
 
+import shutil
+import subprocess
+
 from git import Commit, Repo
 from git.cmd import Git as Gitcmd
 
@@ -13,99 +18,381 @@ from typing import *
 
 import typeguard
 
+from logging import info,\
+	INFO,\
+	getLogger
+
+from .git_objects import Cat_file_reader
+from .object_store import Object_store, parse_pointer, POINTER_MAX_SIZE
+from .step_cache import Step_cache
+from ..retention import Step_candidate, select_versions
+from ..prefetch import MISSING
+from ..scheduler import step_outputs
+from ..tracing import traced
+
 from ..defaults import\
 	DEFAULT_FOLDER_NAME,\
-	DEFAULT_STEP_SUFFIX
+	DEFAULT_STEP_SUFFIX,\
+	DEFAULT_GIT_OBJECT_THRESHOLD,\
+	DEFAULT_OBJECT_STORE_FOLDER,\
+	DEFAULT_STEP_CACHE
 
 import re
+
+logger = getLogger()
+
+STEP_TRAILER: Final[str] = 'Step: '
+OUTPUTS_TRAILER: Final[str] = 'Outputs: '
+INPUT_TRAILER: Final[str] = 'Input: '
+
+NULL_SHA: Final[str] = '0' * 40
+# Header of every commit in the log used to build the step index
+INDEX_LOG_FORMAT: Final[str] = '%x00%H%x00%ct%x00%s%x00%(trailers:key=Step,key=Outputs,separator=%x01)'
+
+signature_re = re.compile(r"^(author|committer) (.*) <(.*)> (\d+ [+-]\d{4})$")
+
+def parse_step_trailers(trailers: str) -> Tuple[Tuple[str, ...], Dict[str, str]]:
+	"""Get the steps of a commit, and the step that wrote each output, from its
+	Step and Outputs trailers, separated by \\x01
+
+	Returns:
+		Tuple[Tuple[str, ...], Dict[str, str]]: The step names, and output -> step name
+	"""
+	step_names: List[str] = list()
+	output_steps: Dict[str, str] = dict()
+	for trailer in trailers.split('\x01'):
+		if(trailer.startswith(STEP_TRAILER)):
+			step_names.append(trailer[len(STEP_TRAILER):].strip())
+		elif(trailer.startswith(OUTPUTS_TRAILER) and step_names):
+			# Each Outputs trailer follows the Step trailer of its step
+			for output in trailer[len(OUTPUTS_TRAILER):].split(','):
+				output_steps[output.strip()] = step_names[-1]
+
+	return tuple(step_names), output_steps
+
+class Step_version(NamedTuple):
+	commit: str
+	# None when the commit deleted the file
+	blob: Optional[str]
+	step_names: Tuple[str, ...]
+	timestamp: int
 	
 class Git:
 	_parent_: object
 
 	_repo_: Repo
 	_git_: Gitcmd
+	_objects_: Cat_file_reader
+	_object_store_: Object_store
+	_object_threshold_: int
 
-	def __init__(self, parent: object, folder_name: str=DEFAULT_FOLDER_NAME, **kwargs) -> None:
+	_step_cache_: Step_cache
+	_step_cache_enabled_: bool
+
+	# Steps staged but not committed yet, as (step name, outputs with their prefix, input hashes)
+	_pending_steps_: List[Tuple[str, List[str], Dict[str, str]]]
+	# Repo path -> staged blob hash, None until it is added to the git index
+	_pending_paths_: Dict[str, Optional[str]]
+	_defer_commits_: int
+
+	# Repo path -> versions of the file, the newest first
+	_step_index_: Optional[Dict[str, List[Step_version]]]
+	# HEAD when the index was last updated, to detect external changes
+	_step_index_head_: Optional[str]
+
+	def __init__(self, 
+			  	 parent: object, 
+				 folder_name: str=DEFAULT_FOLDER_NAME, 
+				 *, 
+				 object_threshold: int=DEFAULT_GIT_OBJECT_THRESHOLD, 
+				 step_cache: bool=DEFAULT_STEP_CACHE,
+				 **kwargs
+		) -> None:
 		self._parent_ = parent
 
+		self._step_cache_ = Step_cache(parent, self)
+		self._step_cache_enabled_ = step_cache
+
+		self._pending_steps_ = list()
+		self._pending_paths_ = dict()
+		self._defer_commits_ = 0
+
+		self._step_index_ = None
+		self._step_index_head_ = None
+
 		self._repo_ = Repo.init(folder_name)
 		self._git_ = self._repo_.git
+		self._objects_ = Cat_file_reader(self._repo_.working_tree_dir)
 
 		getattr(self._git_, 'config')('user.email', 'user@var_storage.var')
 		getattr(self._git_, 'config')('user.name', 'user')
+		# Keep paths in the step index log unquoted
+		getattr(self._git_, 'config')('core.quotepath', 'false')
+
+		self._object_store_ = Object_store(self._repo_.working_tree_dir)
+		self._object_threshold_ = object_threshold
+
+		exclude_path = f"{self._repo_.git_dir}/info/exclude"
+		exclude_line = f"/{DEFAULT_OBJECT_STORE_FOLDER}/"
+		excluded = ''
+		if(os.path.exists(exclude_path)):
+			with open(exclude_path, 'r') as f:
+				excluded = f.read()
+		if(exclude_line not in excluded.splitlines()):
+			os.makedirs(os.path.dirname(exclude_path), exist_ok=True)
+			with open(exclude_path, 'a') as f:
+				f.write(f"{exclude_line}\n")
+
+	def _repo_path(self, name: str) -> str:
+		"""Get the path tracked by git of a file in the root of the variables folder,
+		which depends on the folder layout
+		"""
+		folder = self._parent_._folder_name_
+		return os.path.relpath(
+			self._parent_.filesystem.resolve(f"{folder}/{name}"),
+			folder,
+		)
+
+	def _relocate_(self, moves: Iterable[Tuple[str, str]]) -> None:
+		"""Track the new paths of files moved by a layout change
+		
+		Args:
+			moves (Iterable[Tuple[str, str]]): The (old, new) paths relative to the folder
+		"""
+		tracked = {
+			entry_path
+			for entry_path, _ in self._repo_.index.entries.keys()
+		}
+
+		old_paths: List[str] = list()
+		new_paths: List[str] = list()
+		for old_path, new_path in moves:
+			if(old_path in tracked):
+				old_paths.append(old_path)
+				new_paths.append(new_path)
+
+		if(old_paths):
+			self._repo_.index.remove(old_paths)
+			self._repo_.index.add(new_paths)
+			self._repo_.index.commit(f"Moved {len(new_paths)} files to a new layout")
+
+	def _head_hexsha(self) -> str:
+		try:
+			return self._repo_.head.commit.hexsha
+		except ValueError:
+			# No commits yet
+			return ''
+
+	def _get_step_index(self) -> Dict[str, List[Step_version]]:
+		"""Get the index of versions of every versioned file, rebuilding it
+		if the repository was changed outside of this object
+		"""
+		if(self._step_index_ is None or self._step_index_head_ != self._head_hexsha()):
+			self._rebuild_step_index()
+		return self._step_index_
+
+	def _rebuild_step_index(self) -> None:
+		"""Build the index of versions of every file with a single walk of the history
+		"""
+		step_index: Dict[str, List[Step_version]] = dict()
+		head = self._head_hexsha()
+
+		if(head):
+			log = self._git_.log(
+				'--all',
+				'--no-renames',
+				'--raw',
+				'--no-abbrev',
+				f'--format={INDEX_LOG_FORMAT}',
+			)
+
+			header: Tuple[str, Tuple[str, ...], Dict[str, str], int] = None
+			for line in log.splitlines():
+				if(line.startswith('\x00')):
+					_, hexsha, timestamp, summary, trailers = line.split('\x00', 4)
+					step_names, output_steps = parse_step_trailers(trailers)
+					header = (
+						hexsha,
+						step_names or (summary,),
+						output_steps,
+						int(timestamp),
+					)
+				elif(line.startswith(':') and header is not None):
+					meta, path = line.split('\t', 1)
+					blob = meta.split()[3]
+
+					# Commits of several steps name the one that wrote each file
+					step_name = header[2].get(os.path.basename(path)[:-len(DEFAULT_STEP_SUFFIX)])
+					step_index.setdefault(path, list()).append(Step_version(
+						header[0],
+						None if blob == NULL_SHA else blob,
+						header[1] if step_name is None else (step_name,),
+						header[3],
+					))
+
+		self._step_index_ = step_index
+		self._step_index_head_ = head
+
+	def _get_file_versions(self, varname: str, *, folder: str='', prefix: str=None) -> List[Step_version]:
+		if(prefix is None):
+			prefix = self._parent_.get_var_prefix()
+
+		return self._get_step_index().get(
+			f"{folder and folder+'/'}{self._repo_path(f'{prefix}{varname}{DEFAULT_STEP_SUFFIX}')}",
+			[]
+		)
 
 	def get_file_steps(self, varname: str, *, folder:str='', prefix: str=None) -> List[str]:
 		if(prefix is None):
 			prefix = self._parent_.get_var_prefix()
 		
 		return [
-			f"{prefix}{varname}.{commit.message}"
-			for commit in self._repo_.iter_commits(
-				all=True, 
-				paths=f"{folder and folder+'/'}{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
-			)
+			f"{prefix}{varname}.{version.step_names[-1]}"
+			for version in self._get_file_versions(varname, folder=folder, prefix=prefix)
 		]
 	
 	def get_file_commits(self, varname: str, *, folder: str='', prefix: str=None) -> Iterable[Commit]:
-		if(prefix is None):
-			prefix = self._parent_.get_var_prefix()
-		
-		return self._repo_.iter_commits(
-			all=True, 
-			paths=f"{folder and folder+'/'}{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
+		return (
+			self._repo_.commit(version.commit)
+			for version in self._get_file_versions(varname, folder=folder, prefix=prefix)
 		)
 
 	def load_file_step(self, varname: str, version_name: str=None, step_n: int=None, *, prefix: str=None) -> Any:
 		if(version_name is not None):
 			return self._load_file_step_by_name(varname, version_name, prefix=prefix)
 		elif(step_n is not None):
-			commits = list(self.get_file_commits(varname, prefix=prefix))
+			versions = self._get_file_versions(varname, prefix=prefix)
 
-			if(step_n >= len(commits)):
-				print(f"Asked for step number {step_n}, but only {len(commits)} exist")
+			if(step_n >= len(versions)):
+				print(f"Asked for step number {step_n}, but only {len(versions)} exist")
 				return
-			return self._load_commit(commits[-(step_n+1)], varname)
+			return self._load_blob(versions[-(step_n+1)].blob)
 		raise ValueError("Either of 'version_name' or 'step_n' arguments should be set")
 	
 	def _load_file_step_by_name(self, varname: str, version_name: str, *, prefix: str=None):
 		if(prefix is None):
 			prefix = self._parent_.get_var_prefix()
 		
-		steps_varname = f"{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
-		for commit in self._repo_.iter_commits(all=True, paths=steps_varname):
-			if(True):
-				print(commit.message)
-			
-			if(commit.message == version_name):
-				return self._load_commit(commit, steps_varname)
+		for version in self._get_file_versions(varname, prefix=prefix):
+			if(version_name in version.step_names):
+				return self._load_blob(version.blob)
 
 	def load_latest_step(self, varname: str, *, folder: Optional[str]=None, loaded_refs:Set[str]=set(), load_as: str=None, prefix: str=None) -> Any:
 		if(prefix is None):
 			prefix = self._parent_.get_var_prefix()
+
+		repo_path = self._repo_path(f"{prefix}{varname}{DEFAULT_STEP_SUFFIX}")
+		if(repo_path in self._pending_paths_):
+			# Written by a step whose commit is deferred
+			self._stage_pending()
+			return self._load_blob(self._pending_paths_[repo_path])
 		
-		steps_varname = f"{prefix}{varname}{DEFAULT_STEP_SUFFIX}"
-		try:
-			return self._load_commit(
-				next(
-					self._repo_.iter_commits(
-						all=True, 
-						paths=steps_varname
-				)	),
-				steps_varname,
-			)
-		except StopIteration:
-			print(f"No previous commit exists for {steps_varname}")
-			pass
+		versions = self._get_file_versions(varname, prefix=prefix)
+		if(not versions):
+			print(f"No previous commit exists for {prefix}{varname}{DEFAULT_STEP_SUFFIX}")
+			return
+
+		return self._load_blob(versions[0].blob)
 
 	def _load_commit(self, commit: Commit, varname: str) -> Any:
 		if(commit is None): 
 			return
 	
+		return self._load_blob((commit.tree / varname).hexsha)
+
+	def load_file_steps(self, 
+					    varname: str, 
+					    version_names: Iterable[str]=None, 
+					    step_ns: Iterable[int]=None, 
+					    *, 
+					    prefix: str=None
+			) -> List[Any]:
+		"""Load many versions of a variable at once, through the same object reader
+
+		Args:
+			varname (str): The name of the variable
+			version_names (Iterable[str]): The step names of the versions to load
+			step_ns (Iterable[int]): The step numbers of the versions to load, 0 being the first one
+		Kwargs:
+			prefix (str): The variable prefix. Defaults to the current one
+
+		Returns:
+			List[Any]: The loaded versions, in the requested order. Missing versions are None
+		"""
+		versions = self._get_file_versions(varname, prefix=prefix)
+
+		blobs: List[Optional[str]]
+		if(version_names is not None):
+			blob_by_name: Dict[str, str] = dict()
+			for version in reversed(versions):
+				for step_name in version.step_names:
+					blob_by_name[step_name] = version.blob
+
+			blobs = [blob_by_name.get(version_name) for version_name in version_names]
+		elif(step_ns is not None):
+			blobs = [
+				versions[-(step_n+1)].blob if step_n < len(versions) else None
+				for step_n in step_ns
+			]
+		else:
+			raise ValueError("Either of 'version_names' or 'step_ns' arguments should be set")
+
+		# Inline blobs come through the pipe one by one, while the
+		# payloads in the object store are read in parallel
+		values: List[Any] = list()
+		digests: Dict[int, str] = dict()
+		for i, blob in enumerate(blobs):
+			value, digest = self._read_blob(blob)
+			values.append(value)
+			if(digest is not None):
+				digests[i] = digest
+
+		for i, value in zip(
+					digests.keys(), 
+					self._object_store_.map_objects(self._load_object, digests.values())
+				):
+			values[i] = value
+
+		return values
+
+	def _load_blob(self, hexsha: Optional[str]) -> Any:
+		value, digest = self._read_blob(hexsha)
+		if(digest is not None):
+			return self._load_object(digest)
+		return value
+
+	def _read_blob(self, hexsha: Optional[str]) -> Tuple[Any, Optional[str]]:
+		"""Load a blob, unless it is a pointer to the object store
+
+		Returns:
+			Tuple[Any, Optional[str]]: The value, or the digest of the object the blob points to
+		"""
+		if(hexsha is None):
+			return None, None
+
+		filesystem = self._parent_.filesystem
+		with self._objects_.open(hexsha) as stream:
+			if(stream.size > POINTER_MAX_SIZE):
+				# Deserialize straight from the pipe, without a full copy of the blob in memory
+				return self._parent_.serializer.load(
+					filesystem.transform_back_stream(io.BufferedReader(stream))
+				), None
+
+			data = stream.read()
+
+		pointer = parse_pointer(data)
+		if(pointer is not None):
+			return None, pointer[0]
+
 		return self._parent_.serializer.load(
-			io.BytesIO(
-				self._parent_.filesystem.transform_back(
-					(commit.tree / varname).data_stream.read()
-		)	)	)
+			filesystem.transform_back_stream(io.BytesIO(data))
+		), None
+
+	def _load_object(self, digest: str) -> Any:
+		with self._object_store_.open(digest) as f:
+			return self._parent_.serializer.load(
+				self._parent_.filesystem.transform_back_stream(f)
+			)
 
 	@functools.singledispatchmethod
 	def step(self, step: str, **kwargs) -> Any:
@@ -136,8 +423,9 @@ class Git:
 
 		return self.step_run_function(step_fn, **kwargs)
 	
+	@traced
 	def step_run_function(self, 
-						  step_fn: Any,
+					 	  step_fn: Any,
 						  *,
 						  output_name: str=None,
 						  keep_intermediate: bool=True, 
@@ -145,19 +433,30 @@ class Git:
 						  type_check: bool=False,
 						  step_name: str=None,
 					 	  processer: bool | str | object=False,
+						  force: bool=False,
 						  **kwargs
 			) -> Any:
 		if(step_name is None):
 			step_name = step_fn.__name__
 
+		# Kept out of kwargs, which are not loaded as arguments of the step
+		prefix: str = kwargs.get('prefix', self._parent_.get_var_prefix())
+
+		cache_key, value = self._cached_step(step_fn, step_name, kwargs, processer=processer, force=force, prefix=prefix)
+		if(value is not MISSING):
+			return value
+
+		producer_fn = step_fn
 		if(type_check):
 			step_fn = typeguard.typechecked(step_fn)
 
 		self._parent_.__enter__()
 
 		fn_args: Dict[str, Any]
+		input_names: List[str]
 		try:
 			fn_args = self._parent_.load_function_args(step_fn, not_load=kwargs.keys())
+			input_names = list(fn_args.keys())
 			fn_args.update(kwargs)
 			
 			step_fn_sig = signature(step_fn)
@@ -184,40 +483,546 @@ class Git:
 				**fn_args
 			)
 
+		output_spec, output_values = step_outputs(output_name, value)
+		self._version_step(
+			step_name,
+			stored_vars,
+			input_names,
+			output_spec=output_spec,
+			output_values=output_values,
+			keep_intermediate=keep_intermediate,
+			step_n=step_n,
+			# Only runs whose value can be rebuilt from their outputs are cached
+			cache_key=cache_key if value is None or output_spec is not None else None,
+			**{**kwargs, 'prefix': prefix}
+		)
+
+		if(output_spec is not None):
+			self._parent_._record_producer(
+				producer_fn,
+				step_name,
+				output_spec,
+				input_names,
+				kwargs,
+				cache_key=cache_key,
+				prefix=prefix,
+				keep_intermediate=keep_intermediate,
+				type_check=type_check,
+			)
+
+		return value
+
+	@traced
+	def _cached_step(self, 
+				  	 step_fn: Callable, 
+					 step_name: str, 
+					 kwargs: Dict[str, Any], 
+					 *, 
+					 processer: bool | str | object=False, 
+					 force: bool=False,
+					 prefix: str=None
+			) -> Tuple[Optional[str], Any]:
+		"""Restore the outputs of a previous run of a step with the same code, inputs and kwargs
+
+		Returns:
+			Tuple[Optional[str], Any]: The cache key of the run, if it can be cached, 
+				and the value the step returned, or MISSING if it has to be run
+		"""
+		# Processer steps need the arguments, so they are always run
+		if(not self._step_cache_enabled_ or processer):
+			return None, MISSING
+
+		if(prefix is None):
+			prefix = kwargs.get('prefix', self._parent_.get_var_prefix())
+
+		cache_key = self._step_cache_.run_key(step_fn, step_name, kwargs, prefix=prefix)
+		if(cache_key is None):
+			return None, MISSING
+
+		entry = None if force else self._step_cache_.get(cache_key)
+		changed = None if entry is None else self._step_cache_.restore(entry, prefix=prefix)
+		if(changed is None):
+			self._step_cache_.count(forced=force)
+			return cache_key, MISSING
+
+		self._step_cache_.count(hit=True)
+		if(changed):
+			self._pending_steps_.append((step_name, [f"{prefix}{output}" for output in changed], dict()))
+			if(not self._defer_commits_):
+				self.commit_steps()
+		return cache_key, self._step_cache_.value(entry)
+
+	@traced
+	def _version_step(self, 
+				   	  step_name: str, 
+					  stored_vars: Iterable[str], 
+					  input_names: Iterable[str], 
+					  *, 
+					  output_spec: Union[None, str, Tuple[str, ...]]=None, 
+					  output_values: Optional[List[Any]]=None, 
+					  keep_intermediate: bool=True, 
+					  step_n: int=None, 
+					  cache_key: Optional[str]=None, 
+					  **kwargs
+			) -> List[str]:
+		"""Version the variables stored by a step run and its outputs, as a single commit
+
+		Args:
+			step_name (str): The name of the step
+			stored_vars (Iterable[str]): The variables stored while the step ran
+			input_names (Iterable[str]): The variables loaded as arguments of the step
+		Kwargs:
+			output_spec (Union[None, str, Tuple[str, ...]]): The outputs, as given by step_outputs
+			output_values (List[Any]): The value of each output, or None if they are already stored
+			cache_key (str): The step cache key under which the run is recorded
+
+		Returns:
+			List[str]: The versioned variables
+		"""
 		if('prefix' not in kwargs):
 			kwargs['prefix'] = self._parent_.get_var_prefix()
 
+		input_hashes = self._get_input_hashes(input_names, prefix=kwargs['prefix'])
+
+		# Every output is staged, and committed at once below
+		outputs: List[str] = list()
+		# The outputs with their prefix, as their files are named
+		stored_outputs: List[str] = list()
 		if(keep_intermediate):
 			for stored_varname in stored_vars:
-				self.add_new_step(stored_varname, step_name, **kwargs)
-		
-		if(output_name is not None and value is not None):
-			if(
-				hasattr(value, '__len__') and
-				hasattr(output_name, '__len__') and
-				type(output_name) != str and
-				type(value) != str and
-				len(output_name) == len(value)
-				):
-				if(isinstance(step_n, int)):
-					step_n = [step_n]* len(output_name)
+				self.add_new_step(stored_varname, step_name, commit=False, **kwargs)
+				outputs.append(stored_varname)
+				stored_outputs.append(f"{kwargs['prefix']}{stored_varname}")
 
-				for output_name_n, step_n_n, value_n in zip(output_name, step_n, value):
-					self._parent_.store_var(output_name_n, value_n)
-					self.add_new_step(output_name_n, step_name, step_n=step_n_n)
-			else:
-				self._parent_.store_var(output_name, value)
-				self.add_new_step(output_name, step_name, step_n=step_n)
+		if(output_spec is not None):
+			output_names = output_spec if isinstance(output_spec, tuple) else (output_spec,)
+			if(not isinstance(step_n, (list, tuple))):
+				step_n = [step_n] * len(output_names)
 
+			for i, (output_name_n, step_n_n) in enumerate(zip(output_names, step_n)):
+				if(output_values is not None):
+					self._parent_.store_var(output_name_n, output_values[i])
+				self.add_new_step(output_name_n, step_name, step_n=step_n_n, commit=False)
+				outputs.append(output_name_n)
+				stored_outputs.append(f"{self._parent_.get_var_prefix()}{output_name_n}")
 
-		return value
+		if(outputs):
+			self._pending_steps_.append((step_name, stored_outputs, input_hashes))
+
+			if(cache_key is not None):
+				self._step_cache_.record(cache_key, step_name, outputs, output_spec, prefix=kwargs['prefix'])
+
+			if(not self._defer_commits_):
+				self.commit_steps()
+
+		return outputs
+
+	def set_step_cache(self, enabled: bool=True) -> None:
+		"""Enable or disable reusing the outputs of previous step runs
+		with the same code, inputs and kwargs
+		"""
+		self._step_cache_enabled_ = enabled
+
+	def step_cache_stats(self) -> Dict[str, Union[int, float]]:
+		return self._step_cache_.stats()
+
+	def reset_step_cache_stats(self) -> None:
+		self._step_cache_.reset_stats()
+
+	def clear_step_cache(self) -> None:
+		self._step_cache_.clear()
+
+	def _stored_hash(self, varname: str, *, prefix: str) -> Optional[str]:
+		return self._get_input_hashes([varname], prefix=prefix).get(varname)
+
+	def _output_version(self, stored_varname: str) -> Optional[str]:
+		self._stage_pending()
+		entry = self._repo_.index.entries.get((self._repo_path(f"{stored_varname}{DEFAULT_STEP_SUFFIX}"), 0))
+		return None if entry is None else entry.hexsha
+
+	def _find_output_version(self, stored_varname: str, blob: str) -> Optional[str]:
+		sizes = self._blob_sizes([blob])
+		if(blob not in sizes):
+			return None
+
+		# The payload of a big output may have been pruned
+		digest = sizes[blob][1]
+		if(digest is not None and digest not in self._object_store_):
+			return None
+		return blob
+
+	def _restore_output(self, stored_varname: str, blob: str) -> bool:
+		if(self._output_version(stored_varname) == blob):
+			return False
+
+		repo_path = self._repo_path(f"{stored_varname}{DEFAULT_STEP_SUFFIX}")
+		path = f"{self._repo_.working_tree_dir}/{repo_path}"
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		self._parent_.filesystem.unshare(path, 'wb')
+		with self._objects_.open(blob) as stream, open(path, 'wb') as f:
+			shutil.copyfileobj(stream, f)
+
+		self._pending_paths_[repo_path] = None
+		return True
+
+	@contextmanager
+	def defer_commits(self):
+		"""Stage the outputs of every step run inside the context, and create
+		a single commit for all of them when leaving it.
+		Only the last version of a variable written more than once inside the context is kept
+
+		with vv.defer_commits():
+			vv.step(normalize, output_name='df')
+			vv.step(train, output_name='model')
+		"""
+		self._defer_commits_ += 1
+		try:
+			yield self
+		finally:
+			self._defer_commits_ -= 1
+			if(not self._defer_commits_):
+				self.commit_steps()
+
+	def commit_steps(self) -> Optional[Commit]:
+		"""Commit every staged step output, with the step names, outputs and
+		input hashes as commit trailers
+
+		Returns:
+			Optional[Commit]: The new commit, or None if there was nothing staged
+		"""
+		if(not self._pending_steps_):
+			return None
+
+		self._stage_pending()
+
+		lines: List[str] = [self._pending_steps_[-1][0], '']
+		for step_name, outputs, input_hashes in self._pending_steps_:
+			lines.append(f"{STEP_TRAILER}{step_name}")
+			lines.append(f"{OUTPUTS_TRAILER}{', '.join(outputs)}")
+			lines.extend(
+				f"{INPUT_TRAILER}{input_name}={input_hash}"
+				for input_name, input_hash in input_hashes.items()
+			)
+
+		# Repo path -> the last step that wrote it, whose version is the one committed
+		path_steps: Dict[str, str] = {
+			self._repo_path(f"{output}{DEFAULT_STEP_SUFFIX}"): step_name
+			for step_name, outputs, _ in self._pending_steps_
+			for output in outputs
+		}
+		last_step = self._pending_steps_[-1][0]
+		self._pending_steps_.clear()
+
+		index_is_current = self._step_index_ is not None and self._step_index_head_ == self._head_hexsha()
+		commit = self._repo_.index.commit('\n'.join(lines))
+
+		if(index_is_current):
+			for path, blob in self._pending_paths_.items():
+				self._step_index_.setdefault(path, list()).insert(0, Step_version(
+					commit.hexsha,
+					blob,
+					(path_steps.get(path, last_step),),
+					commit.committed_date,
+				))
+			self._step_index_head_ = commit.hexsha
+		self._pending_paths_.clear()
+
+		return commit
+
+	def _stage_pending(self) -> None:
+		"""Add the pending step files to the git index with a single index write.
+		Files over the object threshold are moved first into the object store, 
+		so only a pointer to them is committed
+		"""
+		paths = [
+			path
+			for path, blob in self._pending_paths_.items()
+			if blob is None
+		]
+		if(not paths):
+			return
+
+		working_tree = self._repo_.working_tree_dir
+		big_paths = [
+			f"{working_tree}/{path}"
+			for path in paths
+			if os.path.getsize(f"{working_tree}/{path}") >= self._object_threshold_
+		]
+		self._object_store_.externalize(big_paths)
+
+		self._repo_.index.add(paths)
+
+		entries = self._repo_.index.entries
+		for path in paths:
+			self._pending_paths_[path] = entries[(path, 0)].hexsha
+
+	def prune_objects(self, *, dry_run: bool=False) -> int:
+		"""Delete the payloads of the object store no longer referenced by any commit
+
+		Kwargs:
+			dry_run (bool): Only compute the reclaimable bytes
+
+		Returns:
+			int: The bytes reclaimed (or reclaimable, in a dry run)
+		"""
+		self._stage_pending()
+
+		blobs = {
+			version.blob
+			for versions in self._get_step_index().values()
+			for version in versions
+			if version.blob is not None
+		}
+		blobs.update(entry.hexsha for entry in self._repo_.index.entries.values())
+
+		referenced = {
+			digest
+			for _, digest in self._blob_sizes(blobs).values()
+			if digest is not None
+		}
+
+		return self._object_store_.prune(referenced, dry_run=dry_run)
+
+	def _run_git(self, *args: str, input: str=None, env: Dict[str, str]=None) -> str:
+		return subprocess.run(
+			['git', *args],
+			cwd=self._repo_.working_tree_dir,
+			input=None if input is None else input.encode(),
+			stdout=subprocess.PIPE,
+			env=env,
+			check=True,
+		).stdout.decode()
+
+	def _blob_sizes(self, blobs: Iterable[str]) -> Dict[str, Tuple[int, Optional[str]]]:
+		"""Get the size of the contents of many blobs, following pointers to the object store
+
+		Returns:
+			Dict[str, Tuple[int, Optional[str]]]: blob -> (size, digest of the object it points to or None)
+		"""
+		blobs = set(blobs)
+		if(not blobs):
+			return dict()
+
+		sizes: Dict[str, Tuple[int, Optional[str]]] = dict()
+		# A single batch to get the size of every blob, so only pointers are read
+		for line in self._run_git('cat-file', '--batch-check', input='\n'.join(blobs)).splitlines():
+			fields = line.split()
+			if(len(fields) != 3 or fields[1] != 'blob'):
+				continue
+
+			hexsha, size = fields[0], int(fields[2])
+			pointer = None
+			if(size <= POINTER_MAX_SIZE):
+				pointer = parse_pointer(self._objects_.read(hexsha))
+
+			sizes[hexsha] = (size, None) if pointer is None else (pointer[1], pointer[0])
+
+		return sizes
+
+	def _repository_size(self) -> int:
+		counts = dict(
+			line.split(': ', 1)
+			for line in self._run_git('count-objects', '-v').splitlines()
+		)
+		return (int(counts.get('size', 0)) + int(counts.get('size-pack', 0))) * 1024
+
+	def gc_steps(self, *, dry_run: bool=True) -> Dict[str, Any]:
+		"""Delete the step versions not kept by the retention policies,
+		rewriting the history of the current branch so they are no longer reachable.
+		Versions still reachable from other branches or tags are not reclaimed
+
+		Kwargs:
+			dry_run (bool): Only report what would be deleted
+
+		Returns:
+			Dict[str, Any]: The reclaimed bytes and the removed versions of each variable
+		"""
+		self.commit_steps()
+
+		step_index = self._get_step_index()
+		sizes = self._blob_sizes(
+			version.blob
+			for versions in step_index.values()
+			for version in versions
+			if version.blob is not None
+		)
+
+		# Repo path -> (commit, blob, kept) of every version, the oldest first
+		changes: Dict[str, List[Tuple[str, Optional[str], bool]]] = dict()
+		removed: Dict[str, List[str]] = dict()
+		reclaimable = 0
+		for path, versions in step_index.items():
+			if(not path.endswith(DEFAULT_STEP_SUFFIX)):
+				continue
+
+			varname = os.path.basename(path)[:-len(DEFAULT_STEP_SUFFIX)]
+			policy = self._parent_.get_retention(varname)
+			if(policy is None):
+				continue
+
+			# Deletions of the file are not versions, and are always kept
+			candidates = [
+				version
+				for version in versions
+				if version.blob is not None
+			]
+			keep = dict(zip(candidates, select_versions([
+				Step_candidate(
+					version.step_names,
+					version.timestamp,
+					sizes.get(version.blob, (0, None))[0],
+				)
+				for version in candidates
+			], policy)))
+
+			dropped = [
+				version
+				for version in candidates
+				if not keep[version]
+			]
+			if(not dropped):
+				continue
+
+			removed[varname] = [version.step_names[-1] for version in dropped]
+			changes[path] = [
+				(version.commit, version.blob, keep.get(version, True))
+				for version in reversed(versions)
+			]
+
+			kept_blobs = {version.blob for version in candidates if keep[version]}
+			reclaimable += sum(
+				sizes.get(blob, (0, None))[0]
+				for blob in {version.blob for version in dropped} - kept_blobs
+			)
+
+		if(dry_run or not changes):
+			if(logger.isEnabledFor(INFO)):
+				info(f"[i] Reclaimable {reclaimable} bytes from {sum(map(len, removed.values()))} step versions")
+			return dict(
+				dry_run=dry_run,
+				reclaimed_bytes=reclaimable if dry_run else 0,
+				removed=removed,
+			)
+
+		size_before = self._repository_size()
+
+		self._rewrite_history(changes)
+		self._git_.reflog('expire', '--expire=now', '--all')
+		self._git_.gc('--prune=now', '--quiet')
+
+		self._step_index_ = None
+
+		reclaimed = size_before - self._repository_size() + self.prune_objects()
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Reclaimed {reclaimed} bytes from {sum(map(len, removed.values()))} step versions")
+
+		return dict(
+			dry_run=dry_run,
+			reclaimed_bytes=reclaimed,
+			removed=removed,
+		)
+
+	def _rewrite_history(self, changes: Dict[str, List[Tuple[str, Optional[str], bool]]]) -> None:
+		"""Rewrite the current branch so the dropped versions never happened.
+		After each dropped version the file keeps the previous kept version (or does not exist)
+
+		Args:
+			changes (Dict[str, List[Tuple[str, Optional[str], bool]]]): repo path -> (commit, blob, kept)
+				of every version, the oldest first
+		"""
+		changes_by_commit: Dict[str, List[Tuple[str, Optional[str], bool]]] = dict()
+		for path, path_changes in changes.items():
+			for commit, blob, kept in path_changes:
+				changes_by_commit.setdefault(commit, list()).append((path, blob, kept))
+
+		index_path = f"{self._repo_.git_dir}/gc_index"
+		env = dict(os.environ, GIT_INDEX_FILE=index_path)
+
+		original: Dict[str, Optional[str]] = dict()
+		effective: Dict[str, Optional[str]] = dict()
+
+		head = self._head_hexsha()
+		new_parent: Optional[str] = None
+		rewriting = False
+		try:
+			for commit in self._run_git('rev-list', '--reverse', '--first-parent', head).split():
+				for path, blob, kept in changes_by_commit.get(commit, ()):
+					original[path] = blob
+					if(kept):
+						effective[path] = blob
+
+				differing = [
+					(path, effective.get(path))
+					for path in changes
+					if effective.get(path) != original.get(path)
+				]
+
+				if(not (rewriting or differing)):
+					# Identical up to the first dropped version
+					new_parent = commit
+					continue
+				rewriting = True
+
+				if(differing):
+					self._run_git('read-tree', commit, env=env)
+					self._run_git('update-index', '--index-info', input=''.join(
+						f"100644 {blob}\t{path}\n" if blob is not None else f"0 {NULL_SHA}\t{path}\n"
+						for path, blob in differing
+					), env=env)
+					tree = self._run_git('write-tree', env=env).strip()
+				else:
+					tree = self._run_git('rev-parse', f"{commit}^{{tree}}").strip()
+
+				# Same authorship, dates and message as the original commit
+				headers, message = self._objects_.read(commit).decode().split('\n\n', 1)
+				commit_env = dict(os.environ)
+				for line in headers.splitlines():
+					match = signature_re.match(line)
+					if(match is not None):
+						role = match.group(1).upper()
+						commit_env[f"GIT_{role}_NAME"] = match.group(2)
+						commit_env[f"GIT_{role}_EMAIL"] = match.group(3)
+						commit_env[f"GIT_{role}_DATE"] = match.group(4)
+
+				new_parent = self._run_git(
+					'commit-tree', 
+					tree, 
+					*(('-p', new_parent) if new_parent is not None else ()), 
+					input=message, 
+					env=commit_env,
+				).strip()
+		finally:
+			if(os.path.exists(index_path)):
+				os.remove(index_path)
+
+		if(rewriting):
+			# The newest versions are always kept, so the working tree and index stay valid
+			self._run_git('update-ref', '-m', 'gc_steps', self._run_git('symbolic-ref', 'HEAD').strip(), new_parent, head)
+
+	def _get_input_hashes(self, input_names: Iterable[str], *, prefix: str='') -> Dict[str, str]:
+		"""Get the staged blob hash of every input that is versioned, without reading it
+		"""
+		self._stage_pending()
+
+		entries = self._repo_.index.entries
+
+		input_hashes: Dict[str, str] = dict()
+		for input_name in input_names:
+			entry = entries.get((self._repo_path(f"{prefix}{input_name}{DEFAULT_STEP_SUFFIX}"), 0))
+			if(entry is not None):
+				input_hashes[input_name] = entry.hexsha
+
+		return input_hashes
 
+	@traced
 	def add_new_step(self, 
 					 stored_varname: str, 
 					 step_name: str, 
 					 step_n: int=None, 
 					 *, 
 					 prefix: str=None,
+					 commit: bool=True,
 					 **kwargs
 					 ) -> None:
 		if(prefix is None):
@@ -230,8 +1035,12 @@ class Git:
 	
 		self._parent_.move_var(stored_varname, steps_varpath)
 
-		self._repo_.index.add(steps_varname)
-		self._repo_.index.commit(step_name)
+		# Staged along with the rest of pending files when committing
+		self._pending_paths_[self._repo_path(steps_varname)] = None
+		if(commit):
+			self._pending_steps_.append((step_name, [stored_varname], dict()))
+			if(not self._defer_commits_):
+				self.commit_steps()
 
 	def _instantiate_function_src(self, fn_src: str, step_fn_name: str, src='', **kwargs):
 		rlocals = self._parent_._rlocals_.copy()
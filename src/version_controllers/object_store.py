@@ -0,0 +1,153 @@
+from typing import *
+
+import os
+import re
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from ..defaults import \
+	DEFAULT_OBJECT_STORE_FOLDER,\
+	DEFAULT_OBJECT_STORE_WORKERS
+
+logger = getLogger()
+
+POINTER_PREFIX: Final[bytes] = b"var_storage-object sha256:"
+# Pointers are always smaller than this, so bigger blobs are never parsed
+POINTER_MAX_SIZE: Final[int] = 128
+pointer_re = re.compile(rb"^var_storage-object sha256:([0-9a-f]{64}) (\d+)\n$")
+
+HASH_CHUNK_SIZE: Final[int] = 1024**2
+
+def parse_pointer(data: bytes) -> Optional[Tuple[str, int]]:
+	"""Get the (digest, size) of the object a pointer file refers to
+
+	Returns:
+		Optional[Tuple[str, int]]: The digest and size, or None if data is not a pointer
+	"""
+	if(len(data) > POINTER_MAX_SIZE or not data.startswith(POINTER_PREFIX)):
+		return None
+
+	match = pointer_re.match(data)
+	if(match is None):
+		return None
+	return match.group(1).decode(), int(match.group(2))
+
+def hash_file(path: str) -> str:
+	digest = hashlib.sha256()
+	with open(path, 'rb') as f:
+		while(chunk := f.read(HASH_CHUNK_SIZE)):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+class Object_store:
+	"""Local content-addressed store for the payloads of big versioned files,
+	which are replaced in the git repository by a small pointer file
+	"""
+	_folder_: str
+	_workers_: int
+
+	def __init__(self, folder: str, *, object_folder: str=DEFAULT_OBJECT_STORE_FOLDER, workers: int=DEFAULT_OBJECT_STORE_WORKERS) -> None:
+		self._folder_ = f"{folder}/{object_folder}"
+		self._workers_ = workers
+
+	def object_path(self, digest: str) -> str:
+		return f"{self._folder_}/{digest[:2]}/{digest[2:]}"
+
+	def __contains__(self, digest: str) -> bool:
+		return os.path.exists(self.object_path(digest))
+
+	def open(self, digest: str) -> BinaryIO:
+		return open(self.object_path(digest), 'rb')
+
+	def externalize(self, paths: Iterable[str]) -> Dict[str, Tuple[str, int]]:
+		"""Move the given files into the store, hashing them in parallel,
+		and replace each one by a pointer to its stored payload
+
+		Args:
+			paths (Iterable[str]): The files to be moved into the store
+
+		Returns:
+			Dict[str, Tuple[str, int]]: path -> (digest, size) of every moved file
+		"""
+		paths = list(paths)
+		if(not paths):
+			return dict()
+
+		with ThreadPoolExecutor(min(self._workers_, len(paths))) as executor:
+			digests = list(executor.map(hash_file, paths))
+
+		moved: Dict[str, Tuple[str, int]] = dict()
+		for path, digest in zip(paths, digests):
+			size = os.path.getsize(path)
+			object_path = self.object_path(digest)
+
+			if(os.path.exists(object_path)):
+				os.remove(path)
+			else:
+				os.makedirs(os.path.dirname(object_path), exist_ok=True)
+				os.replace(path, object_path)
+				# Payloads are immutable once stored
+				os.chmod(object_path, 0o444)
+
+			with open(path, 'wb') as f:
+				f.write(POINTER_PREFIX + f"{digest} {size}\n".encode())
+
+			moved[path] = (digest, size)
+			if(logger.isEnabledFor(DEBUG)):
+				debug(f" [i] Moved \"{path}\" ({size} bytes) into the object store")
+
+		return moved
+
+	def map_objects(self, function: Callable[[str], Any], digests: Iterable[str]) -> List[Any]:
+		"""Apply a function to many stored objects in parallel
+
+		Args:
+			function (Callable[[str], Any]): Receives the digest of each object
+			digests (Iterable[str]): The objects
+
+		Returns:
+			List[Any]: The results, in order
+		"""
+		digests = list(digests)
+		if(len(digests) <= 1):
+			return list(map(function, digests))
+
+		with ThreadPoolExecutor(min(self._workers_, len(digests))) as executor:
+			return list(executor.map(function, digests))
+
+	def prune(self, referenced: Set[str], *, dry_run: bool=False) -> int:
+		"""Delete every stored payload that is not referenced
+
+		Args:
+			referenced (Set[str]): The digests still referenced by some pointer
+		Kwargs:
+			dry_run (bool): Only compute the reclaimable bytes
+
+		Returns:
+			int: The bytes reclaimed (or reclaimable, in a dry run)
+		"""
+		if(not os.path.exists(self._folder_)):
+			return 0
+
+		reclaimed = 0
+		for shard in os.scandir(self._folder_):
+			if(not shard.is_dir()):
+				continue
+
+			for entry in os.scandir(shard.path):
+				if(f"{shard.name}{entry.name}" in referenced):
+					continue
+
+				reclaimed += entry.stat().st_size
+				if(not dry_run):
+					os.remove(entry.path)
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] {'Reclaimable' if dry_run else 'Reclaimed'} {reclaimed} bytes from unreferenced objects")
+
+		return reclaimed
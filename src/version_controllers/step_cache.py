@@ -0,0 +1,259 @@
+from typing import *
+
+import os
+import hashlib
+
+from collections import OrderedDict
+
+from inspect import getsource
+
+from logging import debug, info,\
+	DEBUG, INFO,\
+	getLogger
+
+from .step_index import hash_file
+
+from ..defaults import \
+	DEFAULT_STEP_CACHE_NAME,\
+	DEFAULT_STEP_CACHE_MAX_ENTRIES
+
+logger = getLogger()
+
+class Step_cache_entry(NamedTuple):
+	step_name: str
+	# The variables versioned by the run, without prefix
+	outputs: Tuple[str, ...]
+	# Version of each output, as understood by the version controller
+	versions: Tuple[str, ...]
+	# How the value returned by the step is rebuilt: None, a single output or a tuple of outputs
+	output_name: Union[None, str, Tuple[str, ...]]
+
+def function_hash(function: Callable) -> str:
+	"""Hash the source code of a function, or its bytecode if the source is not available
+	"""
+	try:
+		code = getsource(function).encode()
+	except (OSError, TypeError):
+		fn_code = function.__code__
+		code = b''.join((
+			fn_code.co_code,
+			repr(fn_code.co_consts).encode(),
+			repr(fn_code.co_names).encode(),
+		))
+	return hashlib.sha256(code).hexdigest()
+
+class Step_cache:
+	"""Memo of step runs, keyed by the step code, the hashes of its inputs and its
+	explicit kwargs, pointing to the versions of the outputs of the run.
+	The version controller tells how versions are identified and restored through
+	_stored_hash, _output_version, _find_output_version and _restore_output
+	"""
+	_parent_: object
+	_version_controller_: object
+
+	_entries_: Optional['OrderedDict[str, Step_cache_entry]']
+	# (real path, mtime_ns, size) -> hash, so unchanged files are hashed once
+	_file_hashes_: Dict[Tuple[str, int, int], str]
+
+	_hits_: int
+	_misses_: int
+	_forced_: int
+
+	def __init__(self, parent: object, version_controller: object) -> None:
+		self._parent_ = parent
+		self._version_controller_ = version_controller
+
+		self._entries_ = None
+		self._file_hashes_ = dict()
+
+		self.reset_stats()
+
+	def _get_entries(self) -> 'OrderedDict[str, Step_cache_entry]':
+		if(self._entries_ is None):
+			self._entries_ = OrderedDict(
+				(key, Step_cache_entry(*entry))
+				for key, entry in (self._parent_.load_var(DEFAULT_STEP_CACHE_NAME) or dict()).items()
+			)
+		return self._entries_
+
+	def _store_entries(self) -> None:
+		self._parent_.store_var(DEFAULT_STEP_CACHE_NAME, {
+			key: tuple(entry)
+			for key, entry in self._entries_.items()
+		})
+
+	def file_hash(self, path: str) -> str:
+		stat = os.stat(path)
+		file_key = (path, stat.st_mtime_ns, stat.st_size)
+
+		file_hash = self._file_hashes_.get(file_key)
+		if(file_hash is None):
+			file_hash = self._file_hashes_[file_key] = hash_file(path)[1].hex()
+		return file_hash
+
+	def stored_hash(self, varname: str) -> Optional[str]:
+		"""Get the hash of the file load_var would read for a variable, without loading it.
+		References are followed. None for variables that are not plain files, such as step outputs
+		"""
+		path = self._parent_._storager_.get_var_path(varname)
+		if(path is not None):
+			return self.file_hash(self._parent_.filesystem.resolve(path))
+
+	def value_hash(self, value: Any) -> str:
+		return hashlib.sha256(self._parent_.serializer.dumps(value)).hexdigest()
+
+	def key(self,
+		 	step_fn: Callable,
+			step_name: str,
+			input_hashes: Dict[str, str],
+			kwargs: Dict[str, Any]
+		) -> Optional[str]:
+		"""Get the cache key of a step run
+
+		Returns:
+			Optional[str]: The key, or None if the run can not be cached
+		"""
+		try:
+			# The step name is part of the key on its own
+			kwargs_hash = self.value_hash(sorted(
+				(arg, value)
+				for arg, value in kwargs.items()
+				if arg != 'step_name'
+			))
+		except Exception:
+			# Unserializable kwargs
+			return None
+
+		key = hashlib.sha256()
+		for part in (
+				function_hash(step_fn),
+				step_name,
+				kwargs_hash,
+				*(f"{name}={input_hash}" for name, input_hash in sorted(input_hashes.items())),
+			):
+			key.update(part.encode())
+			key.update(b'\x00')
+		return key.hexdigest()
+
+	def run_key(self, step_fn: Callable, step_name: str, kwargs: Dict[str, Any], *, prefix: str) -> Optional[str]:
+		"""Get the cache key of running a step now. Inputs are hashed from the file
+		load_var reads, their plain file before their latest step version,
+		and only loaded if they have neither
+		"""
+		input_hashes: Dict[str, str] = dict()
+		for input_name in self._parent_.function_arg_names(step_fn, not_load=kwargs.keys()):
+			input_hash = \
+				self.stored_hash(input_name) or \
+				self._version_controller_._stored_hash(input_name, prefix=prefix)
+
+			if(input_hash is None):
+				try:
+					input_hash = self.value_hash(self._parent_.load_var(input_name))
+				except Exception:
+					return None
+			input_hashes[input_name] = input_hash
+
+		return self.key(step_fn, step_name, input_hashes, {**kwargs, 'prefix': prefix})
+
+	def restore(self, entry: Step_cache_entry, *, prefix: str) -> Optional[List[str]]:
+		"""Make the versions of a cached run the latest ones of its outputs
+
+		Returns:
+			Optional[List[str]]: The outputs that changed, or None if some version no longer exists
+		"""
+		version_controller = self._version_controller_
+
+		found = [
+			version_controller._find_output_version(f"{prefix}{output}", version)
+			for output, version in zip(entry.outputs, entry.versions)
+		]
+		if(any(version is None for version in found)):
+			return None
+
+		changed: List[str] = list()
+		for output, version in zip(entry.outputs, found):
+			if(version_controller._restore_output(f"{prefix}{output}", version)):
+				changed.append(output)
+			self._parent_._rlocals_.pop(output, None)
+			self._parent_._invalidate_prefetch(output)
+
+		return changed
+
+	def value(self, entry: Step_cache_entry) -> Any:
+		"""Get the value the step returned, from its restored outputs
+		"""
+		if(entry.output_name is None):
+			return None
+		if(isinstance(entry.output_name, tuple)):
+			return tuple(map(self._parent_.load_var, entry.output_name))
+		return self._parent_.load_var(entry.output_name)
+
+	def record(self, 
+			   key: str, 
+			   step_name: str, 
+			   outputs: Iterable[str], 
+			   output_name: Union[None, str, Tuple[str, ...]], 
+			   *, 
+			   prefix: str
+		) -> None:
+		outputs = tuple(outputs)
+		versions = tuple(
+			self._version_controller_._output_version(f"{prefix}{output}")
+			for output in outputs
+		)
+		if(any(version is None for version in versions)):
+			return
+
+		self.put(key, Step_cache_entry(step_name, outputs, versions, output_name))
+
+	def get(self, key: str) -> Optional[Step_cache_entry]:
+		entry = self._get_entries().get(key)
+		if(entry is not None):
+			self._entries_.move_to_end(key)
+		return entry
+
+	def put(self, key: str, entry: Step_cache_entry) -> None:
+		entries = self._get_entries()
+		entries[key] = entry
+		entries.move_to_end(key)
+
+		while(len(entries) > DEFAULT_STEP_CACHE_MAX_ENTRIES):
+			entries.popitem(last=False)
+
+		self._store_entries()
+
+	def entries(self) -> List[Tuple[str, Step_cache_entry]]:
+		return list(self._get_entries().items())
+
+	def clear(self) -> None:
+		self._entries_ = OrderedDict()
+		self._store_entries()
+
+		if(logger.isEnabledFor(INFO)):
+			info("[i] Cleared the step cache")
+
+	def count(self, *, hit: bool=False, forced: bool=False) -> None:
+		if(hit):
+			self._hits_ += 1
+		else:
+			self._misses_ += 1
+		if(forced):
+			self._forced_ += 1
+
+		if(logger.isEnabledFor(DEBUG)):
+			debug(f" [i] Step cache {'hit' if hit else 'miss'}{' (forced)' if forced else ''}")
+
+	def stats(self) -> Dict[str, Union[int, float]]:
+		requests = self._hits_ + self._misses_
+		return dict(
+			hits=self._hits_,
+			misses=self._misses_,
+			forced=self._forced_,
+			hit_ratio=self._hits_ / requests if requests else 0.,
+			entries=len(self._get_entries()),
+		)
+
+	def reset_stats(self) -> None:
+		self._hits_ = 0
+		self._misses_ = 0
+		self._forced_ = 0
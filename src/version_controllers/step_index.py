@@ -0,0 +1,216 @@
+from typing import *
+
+import os
+import struct
+import hashlib
+
+from logging import info,\
+	INFO,\
+	getLogger
+
+from ..defaults import \
+	DEFAULT_STEP_INDEX_SUFFIX,\
+	DEFAULT_STEP_NAMES_SUFFIX
+
+logger = getLogger()
+
+# name id, timestamp when the slot was added, size and sha1 of the stored version
+step_record = struct.Struct('<IdQ20s')
+
+HASH_CHUNK_SIZE: Final[int] = 1024**2
+
+class Step_record(NamedTuple):
+	name: str
+	timestamp: float
+	size: int
+	sha1: bytes
+
+def hash_file(path: str) -> Tuple[int, bytes]:
+	"""Get the size and sha1 of a file
+	"""
+	digest = hashlib.sha1()
+	size = 0
+	with open(path, 'rb') as f:
+		while(chunk := f.read(HASH_CHUNK_SIZE)):
+			digest.update(chunk)
+			size += len(chunk)
+	return size, digest.digest()
+
+class Step_index:
+	"""Append-only binary index of the versions of a variable, with a fixed-size record per step.
+	Record i is step number i, so the latest version is the last record, overriding a step
+	rewrites a single record and steps can be found by time with a binary search.
+	Version names are kept once in a separate append-only names table
+	"""
+	_index_path_: str
+	_names_path_: str
+
+	_names_: Optional[List[str]]
+	_name_ids_: Optional[Dict[str, int]]
+
+	def __init__(self, steps_folder: str, varname: str) -> None:
+		self._index_path_ = f"{steps_folder}/{varname}{DEFAULT_STEP_INDEX_SUFFIX}"
+		self._names_path_ = f"{steps_folder}/{varname}{DEFAULT_STEP_NAMES_SUFFIX}"
+
+		self._names_ = None
+		self._name_ids_ = None
+
+	def exists(self) -> bool:
+		return os.path.exists(self._index_path_)
+
+	def _load_names(self, *, reload: bool=False) -> List[str]:
+		if(self._names_ is None or reload):
+			names: List[str] = list()
+			if(os.path.exists(self._names_path_)):
+				with open(self._names_path_, 'r') as f:
+					names = f.read().splitlines()
+
+			self._names_ = names
+			self._name_ids_ = {
+				name: name_id
+				for name_id, name in enumerate(names)
+			}
+		return self._names_
+
+	def _name_id(self, name: str) -> int:
+		self._load_names()
+
+		name_id = self._name_ids_.get(name)
+		if(name_id is None):
+			name_id = len(self._names_)
+			with open(self._names_path_, 'a') as f:
+				f.write(f"{name}\n")
+
+			self._names_.append(name)
+			self._name_ids_[name] = name_id
+		return name_id
+
+	def _unpack(self, data: bytes) -> Step_record:
+		name_id, timestamp, size, sha1 = step_record.unpack(data)
+
+		names = self._load_names()
+		if(name_id >= len(names)):
+			# Added by another instance
+			names = self._load_names(reload=True)
+		return Step_record(names[name_id], timestamp, size, sha1)
+
+	def __len__(self) -> int:
+		try:
+			return os.path.getsize(self._index_path_) // step_record.size
+		except FileNotFoundError:
+			return 0
+
+	def __getitem__(self, step_n: int) -> Step_record:
+		length = len(self)
+		if(step_n < 0):
+			step_n += length
+		if(not 0 <= step_n < length):
+			raise IndexError(f"Step {step_n} out of range")
+
+		with open(self._index_path_, 'rb') as f:
+			f.seek(step_n * step_record.size)
+			return self._unpack(f.read(step_record.size))
+
+	def __iter__(self) -> Iterator[Step_record]:
+		if(not self.exists()):
+			return
+
+		with open(self._index_path_, 'rb') as f:
+			data = f.read()
+
+		for offset in range(0, len(data) - len(data) % step_record.size, step_record.size):
+			yield self._unpack(data[offset:offset+step_record.size])
+
+	def names(self) -> List[str]:
+		return [record.name for record in self]
+
+	def latest(self) -> Optional[Step_record]:
+		if(not len(self)):
+			return None
+		return self[-1]
+
+	def find_time(self, timestamp: float) -> int:
+		"""Binary search the last step added at or before a timestamp
+
+		Returns:
+			int: The step number, or -1 if every step is newer
+		"""
+		if(not self.exists()):
+			return -1
+
+		low, high = 0, len(self)
+		with open(self._index_path_, 'rb') as f:
+			while(low < high):
+				middle = (low + high) // 2
+				f.seek(middle * step_record.size)
+				if(step_record.unpack(f.read(step_record.size))[1] <= timestamp):
+					low = middle + 1
+				else:
+					high = middle
+		return low - 1
+
+	def append(self, name: str, timestamp: float, size: int, sha1: bytes) -> int:
+		"""Add a new step
+
+		Returns:
+			int: The step number
+		"""
+		with open(self._index_path_, 'ab') as f:
+			f.write(step_record.pack(self._name_id(name), timestamp, size, sha1))
+			return f.tell() // step_record.size - 1
+
+	def set(self, step_n: int, name: str, size: int, sha1: bytes) -> None:
+		"""Override the version of an existing step in place.
+		It keeps the time the step was added, so the records stay sorted by time
+		"""
+		with open(self._index_path_, 'r+b') as f:
+			f.seek(step_n * step_record.size)
+			timestamp = step_record.unpack(f.read(step_record.size))[1]
+
+			f.seek(step_n * step_record.size)
+			f.write(step_record.pack(self._name_id(name), timestamp, size, sha1))
+
+	def rewrite(self, records: Iterable[Step_record]) -> None:
+		"""Replace every record, compacting the names table
+		"""
+		names: Dict[str, int] = dict()
+		data: List[bytes] = list()
+		for record in records:
+			name_id = names.setdefault(record.name, len(names))
+			data.append(step_record.pack(name_id, record.timestamp, record.size, record.sha1))
+
+		for path, contents in (
+					(self._names_path_, ''.join(f"{name}\n" for name in names).encode()),
+					(self._index_path_, b''.join(data)),
+				):
+			with open(f"{path}.tmp", 'wb') as f:
+				f.write(contents)
+			os.replace(f"{path}.tmp", path)
+
+		self._names_ = list(names)
+		self._name_ids_ = names
+
+	def migrate(self, steps: Iterable[str], version_path: Callable[[str], Optional[str]]) -> None:
+		"""Build the index from the version names of a text steps file
+
+		Args:
+			steps (Iterable[str]): The version names, the oldest first
+			version_path (Callable[[str], Optional[str]]): Gets the real path of the file of a version, if any
+		"""
+		records: List[Step_record] = list()
+		timestamp = 0.
+		for step in steps:
+			path = version_path(step)
+			if(path is None):
+				records.append(Step_record(step, timestamp, 0, bytes(20)))
+				continue
+
+			# Kept sorted, even if files were modified out of order
+			timestamp = max(timestamp, os.path.getmtime(path))
+			size, sha1 = hash_file(path)
+			records.append(Step_record(step, timestamp, size, sha1))
+
+		self.rewrite(records)
+
+		if(logger.isEnabledFor(INFO)):
+			info(f"[i] Migrated {len(records)} steps into \"{self._index_path_}\"")
@@ -0,0 +1,34 @@
+"""Fixtures shared by the tests.
+Runs from the root of the repository with python -m pytest tests
+"""
+from typing import *
+
+import os
+import sys
+import importlib
+
+import pytest
+
+ROOT: Final[str] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def make_storage(tmp_path) -> Callable[..., Any]:
+	"""Build a Var_storage in a temporary folder, with its own locals
+	"""
+	for module in ('cython', 'dagster', 'git', 'typeguard'):
+		pytest.importorskip(module)
+
+	# var_storage.py imports the modules of src relative to the repository
+	if(os.path.dirname(ROOT) not in sys.path):
+		sys.path.insert(0, os.path.dirname(ROOT))
+	Var_storage = importlib.import_module(f"{os.path.basename(ROOT)}.var_storage").Var_storage
+
+	def make_storage(folder: str='vars', **kwargs) -> Any:
+		folder = str(tmp_path / folder)
+		# The orchestration project is only generated, from its templates, in a new folder
+		os.makedirs(f"{folder}/dagster_orchestration_project/dagster_orchestration_project", exist_ok=True)
+
+		locals_: Dict[str, Any] = dict()
+		return Var_storage('vv', locals_, folder_name=folder, **kwargs)
+
+	return make_storage
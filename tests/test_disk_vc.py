@@ -0,0 +1,107 @@
+"""Steps, step cache and step index of the Disk version controller
+"""
+from typing import *
+
+import os
+import time
+
+CALLS: List[str] = list()
+
+def make_b() -> int:
+	CALLS.append('make_b')
+	return 3
+
+def make_b_again() -> int:
+	return 4
+
+def test_cached_step_loads_output(make_storage) -> None:
+	CALLS.clear()
+	vv = make_storage(chosen_version_controller='disk')
+
+	assert vv.step(make_b, output_name='b') == 3
+	# A hit of the step cache loads the stored output instead of running it
+	assert vv.step(make_b, output_name='b') == 3
+	assert CALLS == ['make_b']
+
+	assert vv.b == 3
+
+def test_latest_step_through_index(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='disk')
+	folder = vv._folder_name_
+
+	vv.step(make_b, output_name='b')
+	vv.step(make_b_again, output_name='b')
+	assert vv.get_file_steps('b') == ['b.make_b', 'b.make_b_again']
+	assert vv.load_var('b') == 4
+
+	# Without the latest version, the index gives the one before
+	os.remove(f"{folder}/b.steps/b.make_b_again")
+	assert vv.load_var('b') == 3
+
+def test_latest_step_with_prefix(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='disk')
+
+	vv.set_var_prefix('exp')
+	vv.step(make_b_again, output_name='b')
+	assert os.path.isdir(f"{vv._folder_name_}/exp_b.steps")
+	assert vv.load_var('b') == 4
+	assert vv.b == 4
+
+def test_forced_step_runs_again(make_storage) -> None:
+	CALLS.clear()
+	vv = make_storage(chosen_version_controller='disk')
+	vc = vv.version_controller
+
+	vv.step(make_b, output_name='b')
+	vv.step(make_b, output_name='b')
+	vv.step(make_b, output_name='b', force=True)
+	assert CALLS == ['make_b', 'make_b']
+
+	stats = vc.step_cache_stats()
+	assert (stats['hits'], stats['misses'], stats['forced']) == (1, 2, 1)
+
+def test_delta_steps_load_every_version(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='disk')
+	vc = vv.version_controller
+	vc.set_delta_steps(keyframe_interval=3)
+
+	values = [list(range(1000)) + [n] for n in range(5)]
+	for n, value in enumerate(values):
+		vv.step(lambda value=value: value, output_name='data', step_name=f"v{n}")
+
+	steps_folder = f"{vv._folder_name_}/data.steps"
+	assert any(filename.endswith('.delta') for filename in os.listdir(steps_folder))
+
+	for n, value in enumerate(values):
+		assert vv.load_file_step('data', f"data.v{n}") == value
+	assert vv.load_var('data') == values[-1]
+
+def test_get_step_at(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='disk')
+
+	vv.step(make_b, output_name='b')
+	between = time.time()
+	time.sleep(0.01)
+	vv.step(make_b_again, output_name='b')
+
+	assert vv.get_step_at('b', between) == 'b.make_b'
+	assert vv.get_step_at('b', time.time()) == 'b.make_b_again'
+
+def test_gc_steps_keep_last(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='disk')
+	vc = vv.version_controller
+
+	for n in range(4):
+		vv.step(lambda n=n: n, output_name='c', step_name=f"v{n}")
+	vv.set_retention('c', keep_last=2, pinned=['v0'])
+
+	# A dry run deletes nothing
+	report = vc.gc_steps()
+	assert report['removed']['c'] == ['c.v1']
+	assert vv.get_file_steps('c') == ['c.v0', 'c.v1', 'c.v2', 'c.v3']
+
+	vc.gc_steps(dry_run=False)
+	assert vv.get_file_steps('c') == ['c.v0', 'c.v2', 'c.v3']
+	assert not os.path.exists(f"{vv._folder_name_}/c.steps/c.v1")
+	assert vv.load_file_step('c', 'c.v0') == 0
+	assert vv.load_var('c') == 3
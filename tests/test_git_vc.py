@@ -0,0 +1,100 @@
+"""Commits, step index and step cache of the Git version controller
+"""
+from typing import *
+
+import os
+
+CALLS: List[str] = list()
+
+def normalize() -> List[int]:
+	CALLS.append('normalize')
+	return [1, 2, 3]
+
+def train(df: List[int]) -> int:
+	return sum(df)
+
+def test_deferred_steps_names(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='git')
+	vc = vv.version_controller
+	# Built now, so the commit updates it
+	vc._get_step_index()
+
+	with vc.defer_commits():
+		vv.step(normalize, output_name='df')
+		vv.step(train, output_name='model')
+
+	def check() -> None:
+		assert vv.get_file_steps('df') == ['df.normalize']
+		assert vv.get_file_steps('model') == ['model.train']
+		assert vv.load_file_step('df', version_name='normalize') == [1, 2, 3]
+		assert vv.load_file_step('df', version_name='train') is None
+		assert vv.load_file_step('model', version_name='train') == 6
+		assert vv.load_file_steps('df', ['normalize', 'train']) == [[1, 2, 3], None]
+
+	check()
+
+	# As built from the history, when the repository changed elsewhere
+	vc._step_index_ = None
+	check()
+
+def payload() -> bytes:
+	return os.urandom(4096)
+
+def test_one_commit_per_step(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='git')
+	vc = vv.version_controller
+
+	vv.step(normalize, output_name='df')
+	vv.step(train, output_name='model')
+
+	commits = list(vc.get_file_commits('model'))
+	assert len(commits) == 1
+	message = commits[0].message
+	assert message.startswith('train\n')
+	assert 'Step: train' in message and 'Outputs: model' in message
+	assert 'Step: normalize' not in message
+
+	assert [commit.hexsha for commit in vc.get_file_commits('df')] != [commits[0].hexsha]
+
+def test_cached_step_loads_output(make_storage) -> None:
+	CALLS.clear()
+	vv = make_storage(chosen_version_controller='git')
+	vc = vv.version_controller
+
+	assert vv.step(normalize, output_name='df') == [1, 2, 3]
+	assert vv.step(normalize, output_name='df') == [1, 2, 3]
+	assert CALLS == ['normalize']
+	assert vc.step_cache_stats()['hits'] == 1
+
+	vv.step(normalize, output_name='df', force=True)
+	assert CALLS == ['normalize', 'normalize']
+
+def test_objects_read_through_cat_file(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='git')
+	vc = vv.version_controller
+
+	vv.step(normalize, output_name='df')
+	blob = next(iter(vc.get_file_commits('df'))).tree / vc._repo_path('df.steps')
+
+	# The same process reads one object after another
+	assert vc._objects_.read(blob.hexsha) == blob.data_stream.read()
+	with vc._objects_.open(blob.hexsha) as stream:
+		assert stream.read(4) == blob.data_stream.read()[:4]
+	assert vc._objects_.read(blob.hexsha) == blob.data_stream.read()
+
+def test_big_outputs_in_object_store(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='git', object_threshold=1024)
+	vc = vv.version_controller
+
+	data = vv.step(payload, output_name='data')
+	blob = next(iter(vc.get_file_commits('data'))).tree / vc._repo_path('data.steps')
+
+	# Only a pointer is committed, the payload is kept out of the repository
+	assert blob.size < 1024
+	assert blob.data_stream.read().startswith(b'var_storage-object')
+	assert os.listdir(f"{vv._folder_name_}/.objects")
+
+	assert vv.load_file_step('data', version_name='payload') == data
+	assert vv.load_var('data') == data
+	# Still referenced by the history
+	assert vc.prune_objects(dry_run=True) == 0
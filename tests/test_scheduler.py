@@ -0,0 +1,37 @@
+"""Steps run concurrently by run_steps
+"""
+from typing import *
+
+import os
+
+def load() -> List[int]:
+	return [1, 2, 3]
+
+def double(data: List[int]) -> List[int]:
+	return [value * 2 for value in data]
+
+def total(data: List[int]) -> int:
+	return sum(data)
+
+def worker() -> int:
+	return os.getpid()
+
+def test_run_steps_in_order(make_storage) -> None:
+	vv = make_storage(chosen_version_controller='disk')
+
+	values = vv.run_steps([
+		dict(step=load, output_name='data'),
+		dict(step=worker, output_name='pid'),
+		dict(step=double, output_name='data'),
+		dict(step=total, output_name='result'),
+	], workers=2, return_values=True)
+
+	# Each step sees the outputs of the steps before it, as if run one by one
+	assert values[0] == [1, 2, 3]
+	assert values[2] == [2, 4, 6]
+	assert values[3] == 12
+	assert values[1] != os.getpid()
+
+	assert vv.get_file_steps('data') == ['data.load', 'data.double']
+	assert vv.load_var('data') == [2, 4, 6]
+	assert vv.load_var('result') == 12
@@ -0,0 +1,178 @@
+"""Stress test of the per thread and per asyncio task scope stacks.
+Runs from the root of the repository with python -m pytest tests
+"""
+from typing import *
+
+import os
+import time
+import pickle
+import random
+import asyncio
+import threading
+
+from src.scope import Var_depsgraph_scope
+from src.memory import Var_memory
+from src.file_systems.disk_fs import Disk
+
+THREADS: Final[int] = 8
+THREAD_STEPS: Final[int] = 100
+ASYNC_STEPS: Final[int] = 200
+STEP_INPUTS: Final[int] = 3
+
+class _Serializer:
+	def __getattr__(self, attr: str) -> Any:
+		return getattr(pickle, attr)
+
+class _Base:
+	def __init__(self, **kwargs) -> None:
+		pass
+
+class _Store(Var_memory, Var_depsgraph_scope, _Base):
+	"""The scope of a Var_storage, with loads and stores as its __getattribute__
+	and __setattr__ make them
+	"""
+	def __init__(self, folder: str, locals_: Dict[str, Any], **kwargs) -> None:
+		self._folder_name_ = folder
+		self.filesystem = Disk(folder_name=folder)
+		self.serializer = _Serializer()
+
+		Var_memory.__init__(self, **kwargs)
+		Var_depsgraph_scope.__init__(self, 'vv', locals_, **kwargs)
+
+	def load_var(self, varname: str) -> Any:
+		path = f"{self._folder_name_}/{varname}"
+		if(os.path.exists(path)):
+			with open(path, 'rb') as f:
+				return pickle.load(f)
+
+	def store_var(self, varname: str, value: Any) -> None:
+		with self.filesystem.open(f"{self._folder_name_}/{varname}", 'wb') as f:
+			pickle.dump(value, f)
+
+	def _prefetch_scope(self, scope_name: Optional[str]) -> None:
+		pass
+
+	def load(self, varname: str) -> Any:
+		if(self._scope_active_):
+			self.add_loaded_var(varname)
+		if(varname not in self._rlocals_):
+			self._set_scope_local(varname, varname)
+		return self._rlocals_[varname]
+
+	def store(self, varname: str, value: Any) -> None:
+		if(self._scope_active_):
+			self.add_stored_var(varname)
+		self._set_scope_local(varname, value)
+
+def _expected_ancestors(step: int) -> Set[str]:
+	return {f"in{step}_{j}" for j in range(STEP_INPUTS)} | {'shared', 'notebook'}
+
+def _wrong_ancestors(store: _Store) -> List[int]:
+	return [
+		step
+		for step in range(THREADS * THREAD_STEPS + ASYNC_STEPS)
+		if store.ancestors(f"out{step}") != _expected_ancestors(step)
+	]
+
+def test_concurrent_scopes(tmp_path) -> None:
+	folder = str(tmp_path)
+	# A global of the notebook, loaded by every scope but never put in locals by them
+	locals_: Dict[str, Any] = dict(notebook='notebook')
+	store = _Store(folder, locals_, depsgraph_checkpoint_interval=50)
+
+	errors: List[Any] = list()
+
+	def step(i: int) -> None:
+		store.__enter__(f"step{i}")
+		try:
+			for j in range(STEP_INPUTS):
+				store.load(f"in{i}_{j}")
+				store.load('shared')
+				store.load('notebook')
+				time.sleep(random.random() * 0.001)
+				# Another scope closing must not drop what this one still uses
+				if('shared' not in locals_):
+					errors.append(('shared dropped', i))
+
+			if(store._scope_deps_._name_ != f"step{i}"):
+				errors.append(('scope name', i, store._scope_deps_._name_))
+			store.store(f"out{i}", i)
+		except Exception as e:
+			errors.append(e)
+		finally:
+			store.__exit__()
+
+	def worker(k: int) -> None:
+		for i in range(k * THREAD_STEPS, (k + 1) * THREAD_STEPS):
+			step(i)
+
+	threads = [threading.Thread(target=worker, args=(k,)) for k in range(THREADS)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	async def async_step(i: int) -> None:
+		store.__enter__(f"step{i}")
+		try:
+			for j in range(STEP_INPUTS):
+				store.load(f"in{i}_{j}")
+				store.load('shared')
+				store.load('notebook')
+				await asyncio.sleep(0)
+
+			if(store._scope_deps_._name_ != f"step{i}"):
+				errors.append(('scope name', i, store._scope_deps_._name_))
+			store.store(f"out{i}", i)
+		finally:
+			store.__exit__()
+
+	async def run_async_steps() -> None:
+		first = THREADS * THREAD_STEPS
+		await asyncio.gather(*(
+			async_step(i)
+			for i in range(first, first + ASYNC_STEPS)
+		))
+
+	asyncio.run(run_async_steps())
+
+	assert errors == []
+	assert store._open_scopes_ == 0
+	assert store._scope_refs_ == {}
+	assert store._scope_owned_ == set()
+	# Everything the scopes loaded or stored is gone, and the global stays
+	assert set(locals_) == {'notebook'}
+
+	assert _wrong_ancestors(store) == []
+
+	reloaded = _Store(folder, dict())
+	assert _wrong_ancestors(reloaded) == []
+
+def test_updated_variable_keeps_inputs(tmp_path) -> None:
+	folder = str(tmp_path)
+	store = _Store(folder, dict(), depsgraph_checkpoint_interval=2)
+
+	# x = f(x, y), then enough scopes for the log to be compacted
+	for i in range(4):
+		store.__enter__(f"update{i}")
+		store.load('x')
+		store.load('y')
+		store.store('x', i)
+		store.__exit__()
+
+	assert store.ancestors('x') == {'y'}
+	assert _Store(folder, dict()).ancestors('x') == {'y'}
+
+def test_last_scope_by_name(tmp_path) -> None:
+	folder = str(tmp_path)
+	store = _Store(folder, dict(), depsgraph_checkpoint_interval=3)
+
+	# Prefetching a scope loads what its last run loaded
+	for i in range(5):
+		store.__enter__('train')
+		store.load(f"data{i}")
+		store.store('model', i)
+		store.__exit__()
+
+	assert store._depsgraph_last_scopes_['train'].names() == ['data4']
+	assert _Store(folder, dict())._depsgraph_last_scopes_['train'].names() == ['data4']
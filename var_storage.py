@@ -46,6 +46,17 @@ from .src.folder_handler import Var_folder_handler
 #from .src.transformation import Var_transformation
 from .src.processer import Var_processer
 from .src.orchestration import Var_orchestrator
+from .src.prefetch import Var_prefetcher, MISSING
+from .src.preload import Var_preloader
+from .src.asynchronous import Var_async
+from .src.retention import Var_retention
+from .src.reclaim import Var_reclaimer
+from .src.scheduler import Var_scheduler
+from .src.snapshots import Var_snapshots
+from .src.incremental import Var_incremental
+from .src.stats import Var_stats
+from .src.memory import Var_memory
+from .src.tracing import Var_tracing, Memory_exporter, Chrome_trace_exporter
 
 from .src.defaults import DEFAULT_DUMP_VERBOSE, DEFAULT_VERBOSITY
 
@@ -60,6 +71,17 @@ class Var_storage(
 		Var_folder_handler,
 		Var_utils,
 		Var_storager,
+		Var_stats,
+		Var_prefetcher,
+		Var_preloader,
+		Var_async,
+		Var_retention,
+		Var_reclaimer,
+		Var_scheduler,
+		Var_snapshots,
+		Var_incremental,
+		Var_tracing,
+		Var_memory,
 		Var_depsgraph_scope,
 		Var_processer,
 		Var_orchestrator,
@@ -186,9 +208,9 @@ class Var_storage(
 		if(logger.isEnabledFor(DEBUG)):
 			debug(f"[R] {self.__class__.__name__}.__contains__({attr=})")
 		return attr in self._rlocals_ or \
-			os.path.exists(f"{self._folder_name_}/{attr}") or \
-			os.path.exists(f"{self._folder_name_}/{attr}.src") or \
-			os.path.exists(f"{self._folder_name_}/{attr}.gen")
+			f"{self._folder_name_}/{attr}" in self.filesystem or \
+			f"{self._folder_name_}/{attr}.src" in self.filesystem or \
+			f"{self._folder_name_}/{attr}.gen" in self.filesystem
 
 	def purge(self, *, force: bool=False) -> None:
 		"""Erase the set up variable folder with all other variables from disk.
@@ -239,11 +261,18 @@ class Var_storage(
 		if(attr in self._rlocals_):
 			if(logger.isEnabledFor(DEBUG)):
 				debug(f" [i] var is in memory")
+			if(self._io_stats_ is not None):
+				self._io_stats_.record_hit(attr)
 			return self._rlocals_[attr]
 	
-		value = self._storager_.load_var(attr)
+		value = self._take_prefetched(attr)
+		if(value is MISSING):
+			value = self._storager_.load_var(attr)
+		elif(self._io_stats_ is not None):
+			self._io_stats_.record_hit(attr)
 
-		self._rlocals_[attr] = value
+		self._set_scope_local(attr, value)
+		self._prefetch_related(attr)
 		return value
 
 	def __setattr__(self, attr: str, value: Any) -> Any:
@@ -274,7 +303,7 @@ class Var_storage(
 				debug(f" [i] added var to scope {self._scope_active_}")
 			self.add_stored_var(attr)
 		
-		self._rlocals_[attr] = value
+		self._set_scope_local(attr, value)
 		if(logger.isEnabledFor(DEBUG)):
 			debug(" [i] added var locals")
 	